@@ -0,0 +1,500 @@
+
+import argparse
+import bisect
+import datetime
+import functools
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+import uuid
+import zlib
+
+import instrument
+
+# Audit events for the audit_logs table in design/database_schema.md,
+# recorded without making billing actions wait for them. log() only adds
+# the event to an in-memory buffer. A writer thread takes everything
+# buffered at once, appends it to the current segment in one write and
+# makes it durable with one fdatasync, so a thousand events cost about
+# what one did (group commit). flush() waits until everything logged so
+# far is on disk, for the callers that must know.
+#
+# Segments are append-only files, 00000001.seg, 00000002.seg and so on,
+# of records
+#
+#   payload length (u32)  crc32 of the payload (u32)
+#   payload: created_at in microseconds since the epoch, UTC (i64)
+#            event id (16 bytes)  user id (16 bytes, zeros for none)
+#            action length (u8)  action  details as compact JSON
+#
+# A crash can leave a torn record at the end of the last segment. It
+# fails its checksum and is cut off when the log is next opened. Once a
+# segment reaches segment_size it is sealed: an .idx file is written next
+# to it with a (created_at, user id, offset) entry per record, sorted by
+# time and again by user, so query() can bisect to a user's events or a
+# time window and skip whole segments outside the window.
+#
+# replay() copies the segments into the audit_logs table in batches,
+# recording how far it got, and can run in another process while events
+# are still being logged.
+
+log_dir = 'audit'
+segment_bytes = 64 << 20
+batch_events = 4096
+# The longest an event waits in the buffer before it is written
+batch_wait = 0.05
+# log() blocks beyond this many unwritten events rather than let the
+# buffer grow without bound when the disk cannot keep up
+max_pending = 1 << 17
+
+_record = struct.Struct('<II')
+_fixed = struct.Struct('<q16s16sB')
+_entry = struct.Struct('<q16sQ')
+_index_header = struct.Struct('<4sIqq')
+_index_magic = b'AIX1'
+_no_user = bytes(16)
+_epoch = datetime.datetime(1970, 1, 1)
+
+_replay_schema = [
+    '''CREATE TABLE IF NOT EXISTS audit_logs (
+        id TEXT PRIMARY KEY,
+        user_id TEXT,
+        action TEXT NOT NULL,
+        details TEXT,
+        created_at TEXT NOT NULL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS audit_replay (
+        directory TEXT PRIMARY KEY,
+        segment INTEGER NOT NULL,
+        offset INTEGER NOT NULL,
+        updated_at TEXT NOT NULL
+    )'''
+]
+
+
+@functools.lru_cache(maxsize=4096)
+def _user_bytes(user_id):
+    return uuid.UUID(user_id).bytes if user_id else _no_user
+
+
+def _micros(value):
+    # datetime or 'YYYY-MM-DD HH:MM:SS', UTC unless it says otherwise
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return (value - _epoch) // datetime.timedelta(microseconds=1)
+
+
+def _timestamp(micros):
+    return (_epoch + datetime.timedelta(microseconds=micros)).isoformat(' ')
+
+
+def _fields(payload):
+    # A record's payload -> an audit_logs row, details left as JSON text
+    micros, event_id, user, length = _fixed.unpack_from(payload)
+    start = _fixed.size + length
+    return (str(uuid.UUID(bytes=event_id)), str(uuid.UUID(bytes=user)) if user != _no_user else None,
+            payload[_fixed.size:start].decode(), payload[start:].decode(), _timestamp(micros))
+
+
+def _decode(payload):
+    event_id, user_id, action, details, created_at = _fields(payload)
+    return {'id': event_id, 'user_id': user_id, 'action': action, 'details': json.loads(details),
+            'created_at': created_at}
+
+
+def _scan(buf, offset=0):
+    # Yields (offset, payload) for each intact record from `offset` on,
+    # stopping at the end or at the first torn record
+    end = len(buf)
+    while offset + _record.size <= end:
+        length, crc = _record.unpack_from(buf, offset)
+        start = offset + _record.size
+        payload = buf[start:start + length]
+        if length < _fixed.size or len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        yield offset, payload
+        offset = start + length
+
+
+def _entries(buf):
+    # Index entries for an unsealed segment, and where its intact records end
+    entries = bytearray()
+    end = 0
+    for offset, payload in _scan(buf):
+        micros, _, user, _ = _fixed.unpack_from(payload)
+        entries += _entry.pack(micros, user, offset)
+        end = offset + _record.size + len(payload)
+    return entries, end
+
+
+def _map(path, length=0):
+    with open(path, 'rb') as f:
+        if not (length or os.fstat(f.fileno()).st_size):
+            return b''
+        return mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ)
+
+
+def _sync_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def segments(directory=None):
+    # Segment numbers in the log, oldest first
+    directory = directory or log_dir
+    if not os.path.isdir(directory):
+        return []
+    return sorted(int(name[:-4]) for name in os.listdir(directory)
+                  if name.endswith('.seg') and name[:-4].isdigit())
+
+
+def _path(directory, number, suffix='.seg'):
+    return os.path.join(directory, f'{number:08d}{suffix}')
+
+
+class _Entries:
+    # A sorted run of index entries in a buffer, as a sequence for bisect
+
+    def __init__(self, buf, start, count):
+        self.buf = buf
+        self.start = start
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return _entry.unpack_from(self.buf, self.start + i * _entry.size)
+
+
+def _write_index(path, entries):
+    # entries: packed index entries in time order
+    by_time = list(_entry.iter_unpack(entries))
+    first = by_time[0][0] if by_time else 0
+    last = by_time[-1][0] if by_time else 0
+    # sorted() is stable, so each user's entries stay in time order
+    by_user = sorted(by_time, key=lambda entry: entry[1])
+    data = b''.join([_index_header.pack(_index_magic, len(by_time), first, last), bytes(entries)] +
+                    [_entry.pack(*entry) for entry in by_user])
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _load_index(path):
+    # -> (first created_at, last created_at, entries by time, by user)
+    buf = _map(path)
+    magic, count, first, last = _index_header.unpack_from(buf)
+    if magic != _index_magic:
+        raise ValueError(f'{path} is not an audit index')
+    start = _index_header.size
+    return first, last, _Entries(buf, start, count), _Entries(buf, start + count * _entry.size, count)
+
+
+def _search(buf, by_time, by_user, user, since, until):
+    # Yields the payloads of matching records, in time order
+    if user is not None and by_user is not None:
+        entries = by_user
+        lo = bisect.bisect_left(entries, (user, since), key=lambda entry: (entry[1], entry[0]))
+        hi = bisect.bisect_left(entries, (user, until), key=lambda entry: (entry[1], entry[0]))
+    else:
+        # The active segment is only in time order, so a user's events
+        # are picked out of the window
+        entries = by_time
+        lo = bisect.bisect_left(entries, since, key=lambda entry: entry[0])
+        hi = bisect.bisect_left(entries, until, key=lambda entry: entry[0])
+    for i in range(lo, hi):
+        _, entry_user, offset = entries[i]
+        if user is None or entry_user == user:
+            length = _record.unpack_from(buf, offset)[0]
+            yield buf[offset + _record.size:offset + _record.size + length]
+
+
+def _query(directory, user_id, since, until, active=None):
+    # active: (segment number, size, entries) of the segment being written
+    user = _user_bytes(user_id) if user_id else None
+    since = _micros(since)
+    until = _micros(until)
+    since = -1 << 63 if since is None else since
+    until = (1 << 63) - 1 if until is None else until
+    for number in segments(directory):
+        path = _path(directory, number)
+        if active is not None and number >= active[0]:
+            if number > active[0]:
+                break
+            size, entries = active[1:]
+            by_time, by_user = _Entries(entries, 0, len(entries) // _entry.size), None
+        elif os.path.exists(_path(directory, number, '.idx')):
+            first, last, by_time, by_user = _load_index(_path(directory, number, '.idx'))
+            if last < since or first > until:
+                continue
+            size = 0
+        else:
+            entries, size = _entries(_map(path))
+            by_time, by_user = _Entries(entries, 0, len(entries) // _entry.size), None
+        if by_time:
+            buf = _map(path, size)
+            for payload in _search(buf, by_time, by_user, user, since, until):
+                yield _decode(payload)
+
+
+def query(directory=None, user_id=None, since=None, until=None):
+    # Yields the events in a log directory, as dicts shaped like audit_logs
+    # rows, for `user_id` if given and created in [since, until). Works on
+    # the files alone, so it can run while another process writes the log.
+    return _query(directory or log_dir, user_id, since, until)
+
+
+class AuditLog:
+
+    def __init__(self, directory=None, segment_size=None, batch_size=None, flush_interval=None,
+                 fsync=True):
+        self.directory = directory or log_dir
+        self.segment_size = segment_size or segment_bytes
+        self.batch_size = batch_size or batch_events
+        self.flush_interval = batch_wait if flush_interval is None else flush_interval
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        # The writer waits on `ready` for events, callers on `written`
+        # for the writer
+        self.ready = threading.Condition(self.lock)
+        self.written = threading.Condition(self.lock)
+        self.pending = []
+        # Sequence numbers: the last event logged, the last one on disk and
+        # the highest one a flush() is waiting for
+        self.logged = 0
+        self.durable = 0
+        self.flushing = 0
+        self.last_micros = 0
+        self.closed = False
+        self.error = None
+        self.events = 0
+        self.batches = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._open()
+        self.thread = threading.Thread(target=self._write_loop, name='audit-writer', daemon=True)
+        self.thread.start()
+
+    def _open(self):
+        numbers = segments(self.directory)
+        # A crash while rolling over can leave an older segment unsealed
+        for number in numbers[:-1]:
+            if not os.path.exists(_path(self.directory, number, '.idx')):
+                _write_index(_path(self.directory, number, '.idx'),
+                             _entries(_map(_path(self.directory, number)))[0])
+        self.number = numbers[-1] if numbers else 1
+        if os.path.exists(_path(self.directory, self.number, '.idx')):
+            self.number += 1
+        path = _path(self.directory, self.number)
+        self.entries, self.size = _entries(_map(path)) if os.path.exists(path) else (bytearray(), 0)
+        if self.entries:
+            self.last_micros = _entry.unpack_from(self.entries, len(self.entries) - _entry.size)[0]
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        # Cut off a torn record left by a crash
+        if os.fstat(self.fd).st_size != self.size:
+            os.ftruncate(self.fd, self.size)
+        _sync_directory(self.directory)
+
+    def log(self, user_id, action, details=None):
+        # Records an event and returns its sequence number, for flush().
+        # Does not wait for the disk unless max_pending events are queued.
+        user = _user_bytes(user_id)
+        action = action.encode()
+        if len(action) > 255:
+            raise ValueError(f'audit action too long: {action[:40]!r}...')
+        details = json.dumps(details, separators=(',', ':'), default=str).encode()
+        with self.lock:
+            while len(self.pending) >= max_pending and not (self.error or self.closed):
+                self.written.wait()
+            if self.error:
+                raise self.error
+            if self.closed:
+                raise ValueError('audit log is closed')
+            # Kept in order even if the clock steps back, as the index is
+            # bisected by time
+            micros = max(time.time_ns() // 1000, self.last_micros)
+            self.last_micros = micros
+            self.pending.append((micros, user, action, details))
+            self.logged += 1
+            if len(self.pending) == 1 or len(self.pending) >= self.batch_size:
+                self.ready.notify()
+            return self.logged
+
+    def flush(self, seq=None):
+        # Waits until event `seq` (by default, every event logged so far)
+        # is on disk
+        with self.lock:
+            seq = self.logged if seq is None else seq
+            if seq > self.flushing:
+                self.flushing = seq
+                self.ready.notify()
+            while self.durable < seq and not self.error:
+                self.written.wait()
+            if self.error:
+                raise self.error
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.ready.notify()
+        self.thread.join()
+        os.close(self.fd)
+        if self.error:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def query(self, user_id=None, since=None, until=None):
+        # As query(), over the events written so far, without rescanning
+        # the active segment
+        with self.lock:
+            active = self.number, self.size, bytes(self.entries)
+        return _query(self.directory, user_id, since, until, active)
+
+    def _write_loop(self):
+        while True:
+            with self.lock:
+                deadline = None
+                while not (self.closed or len(self.pending) >= self.batch_size or self.flushing > self.durable):
+                    if not self.pending:
+                        self.ready.wait()
+                        continue
+                    deadline = deadline or time.monotonic() + self.flush_interval
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.ready.wait(remaining)
+                batch, self.pending = self.pending, []
+                last = self.logged
+                if not batch and self.closed:
+                    return
+            try:
+                with instrument.stage('audit.write', items=len(batch)):
+                    self._write(batch)
+            except BaseException as e:
+                with self.lock:
+                    self.error = e
+                    self.written.notify_all()
+                return
+            with self.lock:
+                self.durable = last
+                self.events += len(batch)
+                self.batches += 1
+                self.written.notify_all()
+
+    def _write(self, batch):
+        ids = bytearray(os.urandom(16 * len(batch)))
+        data = bytearray()
+        entries = bytearray()
+        for i, (micros, user, action, details) in enumerate(batch):
+            # Random (version 4) UUIDs, as the id column expects
+            ids[16 * i + 6] = ids[16 * i + 6] & 0x0f | 0x40
+            ids[16 * i + 8] = ids[16 * i + 8] & 0x3f | 0x80
+            payload = _fixed.pack(micros, bytes(ids[16 * i:16 * i + 16]), user, len(action)) + action + details
+            entries += _entry.pack(micros, user, self.size + len(data))
+            data += _record.pack(len(payload), zlib.crc32(payload))
+            data += payload
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.fd, view):]
+        if self.fsync:
+            os.fdatasync(self.fd)
+        with self.lock:
+            self.entries += entries
+            self.size += len(data)
+        if self.size >= self.segment_size:
+            self._roll()
+
+    def _roll(self):
+        _write_index(_path(self.directory, self.number, '.idx'), self.entries)
+        fd = os.open(_path(self.directory, self.number + 1), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        _sync_directory(self.directory)
+        os.close(self.fd)
+        with self.lock:
+            self.fd = fd
+            self.number += 1
+            self.entries = bytearray()
+            self.size = 0
+
+
+def replay(connection, directory=None, chunk=5000):
+    # Copies the events not yet replayed into the audit_logs table and
+    # returns how many. Each chunk is committed together with the position
+    # it reached in the log, and event ids are unique anyway, so this is
+    # safe to run again after a crash or while the log is being written.
+    directory = directory or log_dir
+    for statement in _replay_schema:
+        connection.execute(statement)
+    key = os.path.abspath(directory)
+    checkpoint = connection.execute('SELECT segment, offset FROM audit_replay WHERE directory = ?',
+                                    (key,)).fetchone()
+    segment, offset = checkpoint or (0, 0)
+    copied = 0
+
+    def commit(rows, number, end):
+        with connection:
+            connection.executemany('INSERT OR IGNORE INTO audit_logs (id, user_id, action, details, created_at) '
+                                   'VALUES (?, ?, ?, ?, ?)', rows)
+            connection.execute('INSERT OR REPLACE INTO audit_replay (directory, segment, offset, updated_at) '
+                               'VALUES (?, ?, ?, ?)',
+                               (key, number, end, datetime.datetime.now().isoformat(' ', 'seconds')))
+
+    for number in segments(directory):
+        if number < segment:
+            continue
+        rows = []
+        end = offset if number == segment else 0
+        for position, payload in _scan(_map(_path(directory, number)), end):
+            rows.append(_fields(payload))
+            end = position + _record.size + len(payload)
+            if len(rows) == chunk:
+                commit(rows, number, end)
+                copied += len(rows)
+                rows = []
+        if rows:
+            commit(rows, number, end)
+            copied += len(rows)
+    return copied
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query the audit log or replay it into audit_logs.')
+    parser.add_argument('command', choices=['query', 'replay'])
+    parser.add_argument('database', nargs='?', help='SQLite database to replay into')
+    parser.add_argument('--directory', default=log_dir, help=f'audit log directory (default: {log_dir})')
+    parser.add_argument('--user', help='only events of this user id')
+    parser.add_argument('--since', help="only events at or after this UTC time ('YYYY-MM-DD HH:MM:SS')")
+    parser.add_argument('--until', help='only events before this UTC time')
+    args = parser.parse_args()
+
+    if args.command == 'query':
+        for event in query(args.directory, args.user, args.since, args.until):
+            print(json.dumps(event))
+    else:
+        if not args.database:
+            parser.error('replay needs a database')
+        connection = sqlite3.connect(args.database)
+        start = time.perf_counter()
+        copied = replay(connection, args.directory)
+        connection.close()
+        print(f'Replayed {copied} events into {args.database} in {time.perf_counter() - start:.2f}s')
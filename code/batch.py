@@ -0,0 +1,238 @@
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import generate_architecture_diagram
+from parse_cache import ParseCache
+from section_engine import SpecError, section_inputs, write_section
+from section_specs import sections
+
+# Renders the research report for many tenants in one run. A manifest
+# lists the tenants and, for each, where its search results live, which
+# sections its report has and which source files each section uses:
+#
+#   {
+#     "output": "tenants",
+#     "tenants": {
+#       "acme-ontario": {
+#         "sections": ["gateway_analysis", "tax_compliance"],
+#         "sources": {
+#           "gateway_analysis": ["stripe_api.json", "square_api.json"],
+#           "tax_compliance": ["hst_requirements_detailed.json",
+#                              "hst_remittance_details.json"]
+#         }
+#       },
+#       "globex-us": {
+#         "search_results": "tenants/globex/search_results",
+#         "sources": {"tax_compliance": ["us_tax_requirements.json"]}
+#       }
+#     }
+#   }
+#
+# Every key of a tenant is optional: by default it gets every section of
+# final_report, rendered from search_results/ with the sources listed in
+# section_specs.py. A `sources` list picks which of a section's files are
+# used; a part left with none is dropped along with its heading, and files
+# the spec does not list are added to sections with a single source part.
+#
+# Tenants asking for the same section from the same files share one
+# rendering of it. The run has three phases, each spread across worker
+# processes: every distinct input file is parsed once into the parse
+# cache, every distinct section variant is rendered once, then each
+# tenant's docs/ is assembled from the variants and its report merged.
+# The output for tenant T is <output>/T/docs/. Its architecture diagrams
+# are drawn into <output>/T/design/, from the tenant's "architecture" key
+# if it has one (see generate_architecture_diagram.py), when there is a
+# registry in design/ or some tenant asks for a diagram.
+
+report = 'final_report'
+
+_report_concat = [filename for part in sections[report]['body'] for filename in part.get('concat', [])]
+
+# Section name -> its file name in the report's directory
+_report_files = {
+    name: os.path.basename(spec['output']) for name, spec in sections.items()
+    if os.path.dirname(spec['output']) == sections[report]['directory']
+    and os.path.basename(spec['output']) in _report_concat
+}
+
+
+def load_manifest(path):
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    for tenant, config in manifest['tenants'].items():
+        unknown = set(config.get('sections', [])) - set(_report_files)
+        unknown |= set(config.get('sources', {})) - set(_report_files)
+        if unknown:
+            raise SpecError(f'Tenant {tenant!r} names unknown sections: {", ".join(sorted(unknown))}')
+    return manifest
+
+
+def _select_sources(name, selected):
+    # Source lists per part of section `name`, keeping only `selected`
+    parts = [part['sources'] for part in sections[name]['body'] if 'sources' in part]
+    known = {filename for sources in parts for filename in sources}
+    extra = [filename for filename in selected if filename not in known]
+    if extra and len(parts) != 1:
+        raise SpecError(f'{name} has several source parts, so cannot tell where {", ".join(extra)} belong')
+    chosen = [[filename for filename in sources if filename in selected] for sources in parts]
+    if extra:
+        chosen[0] += extra
+    return chosen
+
+
+def section_variants(config):
+    # The section variants one tenant's report needs, as
+    # section name -> (directory, source list per part)
+    variants = {}
+    for name in config.get('sections', list(_report_files)):
+        spec = sections[name]
+        directory = config.get('search_results', spec['directory'])
+        if name in config.get('sources', {}):
+            chosen = _select_sources(name, config['sources'][name])
+        else:
+            chosen = [part['sources'] for part in spec['body'] if 'sources' in part]
+        variants[name] = (directory, chosen)
+    return variants
+
+
+def variant_key(name, directory, chosen):
+    text = json.dumps([name, os.path.normpath(directory), chosen])
+    return f'{name}-{hashlib.sha256(text.encode()).hexdigest()[:12]}'
+
+
+def variant_spec(name, directory, chosen, output):
+    # The spec of section `name` with its sources replaced by `chosen`.
+    # The node lists are the ones in section_specs.py, so each worker
+    # compiles them only once.
+    spec = sections[name]
+    sources = iter(chosen)
+    body = []
+    for part in spec['body']:
+        if 'sources' in part:
+            part = dict(part, sources=next(sources))
+            if not part['sources']:
+                continue
+        body.append(part)
+    return dict(spec, output=output, directory=directory, body=body)
+
+
+def parse_input(path):
+    cache = ParseCache()
+    try:
+        cache.load(path)
+    except json.JSONDecodeError:
+        # Reported when the section using it is rendered
+        pass
+    cache.save()
+
+
+def render_variant(name, directory, chosen, output, stream=False, use_cache=True):
+    cache = ParseCache() if use_cache and not stream else None
+    write_section(variant_spec(name, directory, chosen, output), stream=stream, cache=cache)
+    if cache is not None:
+        cache.save()
+
+
+def assemble_tenant(docs_dir, variant_files):
+    # variant_files: section name -> rendered variant. Each is copied into
+    # the tenant's docs/ under its usual name, then the report is merged
+    # from just those sections.
+    os.makedirs(docs_dir, exist_ok=True)
+    for name, path in variant_files.items():
+        shutil.copyfile(path, os.path.join(docs_dir, _report_files[name]))
+    spec = sections[report]
+    wanted = {_report_files[name] for name in variant_files}
+    body = [dict(part, concat=[filename for filename in part['concat'] if filename in wanted])
+            if 'concat' in part else part for part in spec['body']]
+    tenant_spec = dict(spec, directory=docs_dir, body=body,
+                       output=os.path.join(docs_dir, os.path.basename(spec['output'])))
+    if spec.get('toc'):
+        tenant_spec['toc'] = os.path.join(docs_dir, os.path.basename(spec['toc']))
+    write_section(tenant_spec)
+
+
+def _run(pool, tasks, describe):
+    # Runs (function, *args) tasks keyed by name, returning the failed names
+    futures = {name: pool.submit(*task) for name, task in tasks.items()}
+    failed = set()
+    for name, future in futures.items():
+        try:
+            future.result()
+        except Exception as e:
+            print(f'Error {describe} {name}: {e}')
+            failed.add(name)
+    return failed
+
+
+def batch(manifest, output=None, jobs=None, stream=False, use_cache=True):
+    # Returns the tenants whose report could not be built
+    root = output or manifest.get('output', 'tenants')
+    variants_dir = os.path.join(root, '.variants')
+    os.makedirs(variants_dir, exist_ok=True)
+
+    tenants = {}
+    variants = {}
+    for tenant, config in manifest['tenants'].items():
+        tenants[tenant] = {}
+        for name, (directory, chosen) in section_variants(config).items():
+            key = variant_key(name, directory, chosen)
+            variants[key] = (name, directory, chosen)
+            tenants[tenant][name] = key
+    print(f'{len(tenants)} tenants need {len(variants)} distinct sections')
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        if use_cache and not stream:
+            inputs = {path for name, directory, chosen in variants.values()
+                      for path in section_inputs(variant_spec(name, directory, chosen, None))
+                      if os.path.exists(path)}
+            _run(pool, {path: (parse_input, path) for path in sorted(inputs)}, 'parsing')
+
+        failed_variants = _run(pool, {
+            key: (render_variant, name, directory, chosen, os.path.join(variants_dir, key + '.md'),
+                  stream, use_cache)
+            for key, (name, directory, chosen) in variants.items()
+        }, 'rendering')
+
+        failed = set()
+        tasks = {}
+        for tenant, keys in tenants.items():
+            if set(keys.values()) & failed_variants:
+                print(f'Skipping tenant {tenant}: a section failed')
+                failed.add(tenant)
+                continue
+            tasks[tenant] = (assemble_tenant, os.path.join(root, tenant, 'docs'),
+                             {name: os.path.join(variants_dir, key + '.md') for name, key in keys.items()})
+        failed |= _run(pool, tasks, 'assembling tenant')
+    # Diagrams are drawn when a tenant asks for one or there is a registry
+    # to draw the default from; a registry that cannot be read fails the
+    # tenants that asked
+    wanted = {tenant for tenant, config in manifest['tenants'].items() if 'architecture' in config}
+    if wanted or os.path.exists(generate_architecture_diagram.registry_file):
+        try:
+            failed |= generate_architecture_diagram.generate_deployments(manifest['tenants'], root)
+        except (OSError, json.JSONDecodeError, generate_architecture_diagram.RegistryError) as e:
+            print(f'Error drawing the architecture diagrams: {e}')
+            failed |= wanted
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the research report for every tenant in a manifest.')
+    parser.add_argument('manifest', help='tenant manifest (JSON)')
+    parser.add_argument('-o', '--output', help='output directory (default: the manifest\'s, or tenants/)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--stream', action='store_true',
+                        help='stream large JSON inputs instead of loading them whole')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='parse every JSON input instead of using the parse cache')
+    args = parser.parse_args()
+    failed = batch(load_manifest(args.manifest), output=args.output, jobs=args.jobs,
+                   stream=args.stream, use_cache=not args.no_cache)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,131 @@
+
+import gc
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import audit
+
+# Records `count` audit events from 4 threads through audit.AuditLog and
+# compares the time a billing action spends on each one against the usual
+# synchronous INSERT and commit per event into audit_logs. It then times a
+# user lookup and a time-window query against a full scan, replays the log
+# into SQLite, and checks nothing was lost or duplicated on the way.
+
+threads = 4
+
+
+def events(count, seed=0):
+    rng = random.Random(seed)
+    users = [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(1000)]
+    actions = ['created_invoice', 'payment_successful', 'payment_failed', 'updated_subscription']
+    return [(rng.choice(users), rng.choice(actions),
+             {'invoice_id': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+              'total': f'{rng.randrange(500, 50000) / 100:.2f}', 'currency': 'CAD'})
+            for _ in range(count)]
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return [latencies[int(len(latencies) * p)] / 1000 for p in (0.5, 0.99)]
+
+
+def synchronous(path, work):
+    # One row and one commit per event, as billing code would do inline
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE audit_logs (id TEXT PRIMARY KEY, user_id TEXT, action TEXT, '
+                       'details TEXT, created_at TEXT)')
+    latencies = []
+    start = time.perf_counter()
+    for user_id, action, details in work:
+        t = time.perf_counter_ns()
+        with connection:
+            connection.execute('INSERT INTO audit_logs VALUES (?, ?, ?, ?, ?)',
+                               (str(uuid.uuid4()), user_id, action, repr(details),
+                                time.strftime('%Y-%m-%d %H:%M:%S')))
+        latencies.append(time.perf_counter_ns() - t)
+    elapsed = time.perf_counter() - start
+    connection.close()
+    return elapsed, latencies
+
+
+def buffered(directory, work):
+    log = audit.AuditLog(directory, segment_size=8 << 20)
+    latencies = [[] for _ in range(threads)]
+
+    def worker(i):
+        for user_id, action, details in work[i::threads]:
+            t = time.perf_counter_ns()
+            log.log(user_id, action, details)
+            latencies[i].append(time.perf_counter_ns() - t)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    logged = time.perf_counter() - start
+    log.flush()
+    durable = time.perf_counter() - start
+    batches = log.batches
+    log.close()
+    return logged, durable, batches, [latency for part in latencies for latency in part]
+
+
+def main(count=200000):
+    work = events(count)
+    with tempfile.TemporaryDirectory() as tmp:
+        gc.disable()
+        sync_count = min(count, 5000)
+        sync_time, sync_latencies = synchronous(os.path.join(tmp, 'sync.db'), work[:sync_count])
+        directory = os.path.join(tmp, 'audit')
+        logged, durable, batches, latencies = buffered(directory, work)
+        gc.enable()
+
+        everything = list(audit.query(directory))
+        user_id = work[0][0]
+        start = time.perf_counter()
+        by_user = list(audit.query(directory, user_id))
+        user_time = time.perf_counter() - start
+        since, until = everything[count // 2]['created_at'], everything[count // 2 + count // 100]['created_at']
+        start = time.perf_counter()
+        window = list(audit.query(directory, since=since, until=until))
+        window_time = time.perf_counter() - start
+        start = time.perf_counter()
+        scanned = [event for event in audit.query(directory) if event['user_id'] == user_id]
+        scan_time = time.perf_counter() - start
+
+        connection = sqlite3.connect(os.path.join(tmp, 'replay.db'))
+        start = time.perf_counter()
+        replayed = audit.replay(connection, directory)
+        replay_time = time.perf_counter() - start
+        again = audit.replay(connection, directory)
+        rows, ids = connection.execute('SELECT COUNT(*), COUNT(DISTINCT id) FROM audit_logs').fetchone()
+        connection.close()
+        segments = len(audit.segments(directory))
+
+    sync_p50, sync_p99 = percentiles(sync_latencies)
+    p50, p99 = percentiles(latencies)
+    print(f'{count} audit events from {threads} threads')
+    print(f'  INSERT + commit per event: {sync_count / sync_time:9.0f} events/s  '
+          f'p50 {sync_p50:7.1f}us  p99 {sync_p99:7.1f}us  ({sync_count} events)')
+    print(f'  AuditLog.log():            {count / logged:9.0f} events/s  p50 {p50:7.1f}us  p99 {p99:7.1f}us')
+    print(f'  durable after flush():     {count / durable:9.0f} events/s  '
+          f'({batches} group commits, {segments} segments)')
+    print(f'  user lookup: {len(by_user)} events in {user_time * 1000:.1f}ms '
+          f'(full scan {scan_time * 1000:.0f}ms); 1% time window: {len(window)} events in '
+          f'{window_time * 1000:.1f}ms')
+    print(f'  replayed into audit_logs: {replayed / replay_time:9.0f} events/s, {again} on a second replay')
+    expected = sum(event[0] == user_id for event in work)
+    ok = rows == ids == replayed == len(everything) == count and by_user == scanned and len(by_user) == expected
+    print(f'  every event logged, indexed and replayed exactly once: {ok}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,88 @@
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import generate_architecture_diagram
+from generate_architecture_diagram import DiagramCache, deployment_registry, generate_deployments, load_registry
+
+# Draws the architecture diagrams of `count` deployments, each with a
+# random choice of gateways, four ways: rendering and writing every one
+# afresh; with an empty DiagramCache; again with nothing changed; and
+# after one deployment changed its gateways. It checks the cached outputs
+# match the fresh renderings.
+
+
+def deployments(count, seed=0):
+    rng = random.Random(seed)
+    gateways = ['stripe', 'square', 'paypal', 'btcpay', 'web3']
+    tenants = {}
+    for i in range(count):
+        config = {'gateways': sorted(rng.sample(gateways, rng.randrange(1, len(gateways) + 1)))}
+        if rng.random() < 0.3:
+            config['without'] = ['data_warehouse']
+        tenants[f'tenant-{i:04d}'] = {'architecture': config}
+    return tenants
+
+
+def uncached(tenants, output):
+    registry = load_registry()
+    for tenant, config in tenants.items():
+        deployment = deployment_registry(registry, config['architecture'])
+        design_dir = os.path.join(output, tenant, 'design')
+        os.makedirs(design_dir, exist_ok=True)
+        for fmt, path in generate_architecture_diagram.outputs.items():
+            with open(os.path.join(design_dir, os.path.basename(path)), 'w') as f:
+                f.write(generate_architecture_diagram.renderers[fmt][0](deployment))
+
+
+def timed(tenants, output, cache_dir):
+    cache = DiagramCache(cache_dir)
+    start = time.perf_counter()
+    generate_deployments(tenants, output, cache)
+    cache.save()
+    return time.perf_counter() - start, cache
+
+
+def read_all(root):
+    contents = {}
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            with open(os.path.join(directory, filename), 'r') as f:
+                contents[os.path.relpath(os.path.join(directory, filename), root)] = f.read()
+    return contents
+
+
+def main(count=500):
+    tenants = deployments(count)
+    tmp = tempfile.mkdtemp(prefix='billing-bench-')
+    try:
+        start = time.perf_counter()
+        uncached(tenants, os.path.join(tmp, 'fresh'))
+        fresh = time.perf_counter() - start
+
+        output = os.path.join(tmp, 'cached')
+        cache_dir = os.path.join(tmp, 'cache')
+        runs = [('empty cache', timed(tenants, output, cache_dir))]
+        runs.append(('nothing changed', timed(tenants, output, cache_dir)))
+        tenants['tenant-0000']['architecture']['gateways'] = ['stripe']
+        runs.append(('one deployment changed', timed(tenants, output, cache_dir)))
+        shutil.rmtree(os.path.join(tmp, 'fresh'))
+        uncached(tenants, os.path.join(tmp, 'fresh'))
+        same = read_all(os.path.join(tmp, 'fresh')) == read_all(output)
+    finally:
+        shutil.rmtree(tmp)
+
+    print(f'{count} deployments, 2 diagrams each')
+    print(f'  render and write all:     {fresh * 1000:8.1f}ms')
+    for name, (elapsed, cache) in runs:
+        print(f'  {name + ":":<25} {elapsed * 1000:8.1f}ms  ({cache.rendered} rendered, {cache.written} written, '
+              f'{cache.unchanged} unchanged)')
+    print(f'  cached outputs match fresh renderings: {same}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
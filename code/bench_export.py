@@ -0,0 +1,92 @@
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import export
+from markdown_blocks import split_sections
+from section_specs import sections
+
+# Exports the final documents to DOCX and PDF `count` times, each after an
+# edit to one section of one document, two ways: rendering every section
+# afresh, and with the section cache, which only renders the edited one.
+# It checks both give the same files, and times exporting everything in
+# parallel against one document and format after another.
+
+
+def read_outputs():
+    contents = {}
+    for name in export.documents:
+        for fmt in export.writers:
+            with open(export.output_path(name, fmt), 'rb') as f:
+                contents[(name, fmt)] = f.read()
+    return contents
+
+
+def edit(rng):
+    name = rng.choice(export.documents)
+    path = sections[name]['output']
+    with open(path, 'r', encoding='utf-8') as f:
+        parts = split_sections(f.read())
+    i = rng.randrange(len(parts))
+    parts[i] = parts[i].rstrip('\n') + f'\n\nEdited paragraph {rng.random()}.\n\n'
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(''.join(parts))
+
+
+def export_each(directory):
+    for name in export.documents:
+        for fmt in export.writers:
+            export.export(name, fmt, directory)
+
+
+def main(count=20):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    tmp = tempfile.mkdtemp(prefix='billing-bench-')
+    cwd = os.getcwd()
+    rng = random.Random(0)
+    try:
+        for name in export.documents:
+            output = sections[name]['output']
+            os.makedirs(os.path.join(tmp, os.path.dirname(output)), exist_ok=True)
+            shutil.copy(os.path.join(root, output), os.path.join(tmp, output))
+        os.chdir(tmp)
+        cache_dir = os.path.join(tmp, 'cache')
+        export_each(cache_dir)
+        fresh = cached = 0
+        same = True
+        for _ in range(count):
+            edit(rng)
+            start = time.perf_counter()
+            export_each(cache_dir)
+            cached += time.perf_counter() - start
+            incremental = read_outputs()
+            shutil.rmtree(os.path.join(tmp, 'fresh'), ignore_errors=True)
+            start = time.perf_counter()
+            export_each(os.path.join(tmp, 'fresh'))
+            fresh += time.perf_counter() - start
+            same = same and read_outputs() == incremental
+
+        start = time.perf_counter()
+        export_each(os.path.join(tmp, 'serial'))
+        serial = time.perf_counter() - start
+        start = time.perf_counter()
+        export.export_all()
+        parallel = time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+
+    print(f'{count} edits, {len(export.documents)} documents in {len(export.writers)} formats')
+    print(f'  render every section:   {fresh / count * 1000:8.1f}ms per export')
+    print(f'  render changed section: {cached / count * 1000:8.1f}ms per export')
+    print(f'  cached exports match fresh ones: {same}')
+    print(f'  cold export, one after another: {serial * 1000:8.1f}ms')
+    print(f'  cold export, in parallel:       {parallel * 1000:8.1f}ms')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
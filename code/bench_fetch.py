@@ -0,0 +1,125 @@
+
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import fetch_sources
+import stub_server
+from http_pool import ConnectionPool
+
+# Refreshes `count` JSON files from two stand-in research hosts
+# (stub_server.py, 50 ms per request). The first answers the first request
+# for each file with a 503 and redirects every tenth file to the second.
+# First the command line refreshes the default inputs into a directory
+# other than search_results; then refresh() fetches all the files cold,
+# and again with the cached validators, and each run is checked against
+# the served files. Finally a server that closes every connection after
+# answering it, while advertising keep-alive, shows a GET that fails on a
+# reused connection is sent again and a POST is not.
+
+
+def build_sources(directory, names, seed=0):
+    rng = random.Random(seed)
+    os.makedirs(directory)
+    for name in names:
+        results = [{'title': f'{name} result {i}', 'url': f'https://example.com/{name}/{i}',
+                    'snippet': ' '.join(rng.choice(['billing', 'tax', 'api', 'invoice', 'webhook'])
+                                        for _ in range(40))}
+                   for i in range(50)]
+        with open(os.path.join(directory, name), 'w') as f:
+            json.dump({'query': name, 'results': results}, f)
+
+
+def same(directory, source, names):
+    for name in names:
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            return False
+        with open(path, 'rb') as f, open(os.path.join(source, name), 'rb') as g:
+            if f.read() != g.read():
+                return False
+    return True
+
+
+async def closing_server(received):
+    # Answers each request, then drops the connection it promised to keep
+    async def handle(reader, writer):
+        line = await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b''):
+            pass
+        received.append(line.split(b' ')[0].decode())
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}')
+        await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, '127.0.0.1', 0)
+
+
+async def resent(method):
+    # Whether a second `method` request, on the dropped connection, is sent again
+    received = []
+    server = await closing_server(received)
+    url = f'http://127.0.0.1:{server.sockets[0].getsockname()[1]}/'
+    async with ConnectionPool() as pool:
+        await pool.request(method, url, body=b'{}' if method == 'POST' else None)
+        # Let the server's close reach the idle connection
+        await asyncio.sleep(0.05)
+        try:
+            await pool.request(method, url, body=b'{}' if method == 'POST' else None)
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+    server.close()
+    await server.wait_closed()
+    return len(received) == 2
+
+
+def main(count=200):
+    defaults = fetch_sources.default_files()
+    names = defaults + [f'extra_{i}.json' for i in range(max(count - len(defaults), 0))]
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'served')
+        build_sources(source, names)
+        mirror = stub_server.serve(source, delay=0.05)
+        origin = stub_server.serve(source, delay=0.05, fail_first=1,
+                                   redirects={name: f'http://127.0.0.1:{mirror.server_port}/{name}'
+                                              for name in names[::10]})
+        manifest = os.path.join(tmp, 'sources.json')
+        with open(manifest, 'w') as f:
+            json.dump({'base_url': f'http://127.0.0.1:{origin.server_port}/'}, f)
+        try:
+            output = os.path.join(tmp, 'cli')
+            start = time.perf_counter()
+            code = subprocess.run([sys.executable, os.path.abspath(fetch_sources.__file__), manifest,
+                                   '--directory', output], cwd=tmp, capture_output=True).returncode
+            print(f'command line: {len(defaults)} default files into {os.path.basename(output)}/ in '
+                  f'{time.perf_counter() - start:.2f}s, exit code {code}; files match: '
+                  f'{same(output, source, defaults)}')
+
+            fetch_sources.cache_dir = os.path.join(tmp, 'cache')
+            output = os.path.join(tmp, 'out')
+            urls = fetch_sources.source_urls({'base_url': f'http://127.0.0.1:{origin.server_port}/'}, names)
+            for run in ['cold', 'cached']:
+                requests = origin.requests + mirror.requests
+                start = time.perf_counter()
+                results = asyncio.run(fetch_sources.refresh(urls, output))
+                elapsed = time.perf_counter() - start
+                statuses = {status: sum(1 for value in results.values() if value == status)
+                            for status in set(results.values())}
+                print(f'{run}: {len(names)} files, {len(names[::10])} redirected, in {elapsed:.2f}s with '
+                      f'{origin.requests + mirror.requests - requests} requests; {statuses}; '
+                      f'files match: {same(output, source, names)}')
+        finally:
+            origin.shutdown()
+            mirror.shutdown()
+
+    print(f'after the server drops a kept-alive connection: GET sent again: {asyncio.run(resent("GET"))}, '
+          f'POST sent again: {asyncio.run(resent("POST"))}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
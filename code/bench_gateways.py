@@ -0,0 +1,74 @@
+
+import asyncio
+import random
+import sys
+import time
+
+import gateway_stub
+from gateways import PayPalGateway, SquareGateway, StripeGateway, charge_across
+
+# Pushes a synthetic renewal run of `count` charges through stand-in
+# Stripe, Square and PayPal servers (gateway_stub.py, 20 ms per request,
+# 2% of responses lost after the charge was made) and compares one charge
+# at a time against charge_across() with pooled connections. It then
+# checks every successful renewal was charged exactly once.
+
+gateway_classes = [StripeGateway, SquareGateway, PayPalGateway]
+
+
+def renewal_run(count, seed=0):
+    rng = random.Random(seed)
+    batches = {cls: [] for cls in gateway_classes}
+    for i in range(count):
+        token = 'tok_declined' if rng.random() < 0.01 else f'tok_{i}'
+        batches[rng.choice(gateway_classes)].append((f'renewal-{seed}-{i}', rng.randrange(500, 50000), token))
+    return batches
+
+
+async def run(batches, servers, concurrency, workers):
+    gateways = {cls: cls('sk_test', f'http://127.0.0.1:{server.server_port}', concurrency=concurrency,
+                         backoff=0.01)
+                for cls, server in zip(gateway_classes, servers)}
+    start = time.perf_counter()
+    if workers == 1:
+        # One blocking-style call after another, across all gateways
+        results = {gateway: [] for gateway in gateways.values()}
+        for cls, charges in batches.items():
+            results[gateways[cls]] = await gateways[cls].charge_batch(charges, workers=1)
+    else:
+        results = await charge_across({gateways[cls]: charges for cls, charges in batches.items()}, workers)
+    elapsed = time.perf_counter() - start
+    for gateway in gateways.values():
+        await gateway.close()
+    return elapsed, results
+
+
+def check(results, servers):
+    charged = [result for results in results.values() for result in results if result.transaction_id]
+    recorded = sum(len(server.charges) for server in servers)
+    declined = sum(1 for results in results.values() for result in results if result.error)
+    return len(charged), declined, recorded
+
+
+def main(count=3000, serial_count=300):
+    servers = [gateway_stub.serve(delay=0.02, lose_rate=0.02) for _ in gateway_classes]
+    try:
+        serial, serial_results = asyncio.run(run(renewal_run(serial_count, seed=1), servers, 1, 1))
+        for server in servers:
+            server.charges.clear()
+        pooled, results = asyncio.run(run(renewal_run(count), servers, 64, 64))
+        charged, failed, recorded = check(results, servers)
+    finally:
+        for server in servers:
+            server.shutdown()
+
+    print(f'{count} renewals over {len(gateway_classes)} stand-in gateways (20 ms per request, 2% lost responses)')
+    print(f'  one at a time:  {serial_count / serial:8.0f} charges/s  ({serial_count} charges in {serial:.1f}s)')
+    print(f'  charge_across:  {count / pooled:8.0f} charges/s  ({count} charges in {pooled:.1f}s)')
+    print(f'  speedup: {serial / serial_count * count / pooled:.1f}x')
+    print(f'  {charged} charged, {failed} declined or failed, {recorded} charges on the servers: '
+          f'{"no double charges" if recorded == charged else "MISMATCH"}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3000)
@@ -0,0 +1,109 @@
+
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import instrument
+import renewals
+import section_engine
+from bench_renewals import approve, as_of, build_database
+from benchmark import benchmark_sections, generate_corpus
+
+# Measures what the instrument.stage() and count() calls left in the hot
+# paths cost. It times a call of each with instrumentation off and on,
+# then renders every section of a synthetic corpus (benchmark.py's) and
+# runs a renewal over `count` subscriptions, each both ways interleaved,
+# keeping the best of several runs. The difference between those is
+# mostly noise; the cost of the calls while off is estimated from the
+# per-call figure. It checks the rendered output is the same either way.
+
+repeat = 3
+
+
+def per_call(calls=1000000):
+    start = time.perf_counter_ns()
+    for _ in range(calls):
+        with instrument.stage('bench'):
+            pass
+    stage = (time.perf_counter_ns() - start) / calls
+    start = time.perf_counter_ns()
+    for _ in range(calls):
+        instrument.count('bench')
+    counter = (time.perf_counter_ns() - start) / calls
+    start = time.perf_counter_ns()
+    for _ in range(calls):
+        pass
+    loop = (time.perf_counter_ns() - start) / calls
+    return stage - loop, counter - loop
+
+
+def render_all(specs):
+    start = time.perf_counter()
+    for spec in specs.values():
+        section_engine.write_section(spec)
+    elapsed = time.perf_counter() - start
+    outputs = {}
+    for spec in specs.values():
+        with open(spec['output'], 'rb') as f:
+            outputs[spec['output']] = f.read()
+    return elapsed, outputs
+
+
+def renew(template, i):
+    path = f'{template}.{i}'
+    shutil.copy(template, path)
+    start = time.perf_counter()
+    renewals.run(path, as_of, charger=approve)
+    elapsed = time.perf_counter() - start
+    os.remove(path)
+    return elapsed
+
+
+def main(count=50000):
+    off_call = per_call()
+    instrument.enable()
+    on_call = per_call()
+    instrument.disable()
+    print(f'per call:  stage() {off_call[0]:6.0f}ns off, {on_call[0]:6.0f}ns on;  '
+          f'count() {off_call[1]:6.0f}ns off, {on_call[1]:6.0f}ns on')
+
+    root = tempfile.mkdtemp(prefix='billing-bench-')
+    cwd = os.getcwd()
+    try:
+        specs = benchmark_sections(generate_corpus(root, features=500))
+        os.chdir(root)
+        template = os.path.join(root, 'renewals.db')
+        build_database(template, count)
+        best = {'off': float('inf'), 'on': float('inf')}
+        outputs = {}
+        renewal = {'off': float('inf'), 'on': float('inf')}
+        gc.disable()
+        for i in range(repeat):
+            for mode in ['off', 'on']:
+                if mode == 'on':
+                    instrument.enable()
+                elapsed, outputs[mode] = render_all(specs)
+                best[mode] = min(best[mode], elapsed)
+                renewal[mode] = min(renewal[mode], renew(template, i))
+                instrument.disable()
+                gc.collect()
+        gc.enable()
+        stages = instrument.report()['stages']
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+    for name, timings in [('render every section', best), (f'renew {count} subscriptions', renewal)]:
+        print(f'{name + ":":<28} {timings["off"]:7.3f}s off, {timings["on"]:7.3f}s on  '
+              f'({(timings["on"] / timings["off"] - 1) * 100:+.1f}%)')
+    calls = sum(totals['calls'] for totals in stages.values())
+    print(f'  {calls} intervals recorded in the last run; left off they cost about '
+          f'{calls * off_call[0] / 1000:.0f}us in all')
+    print(f'  output identical with and without instrumentation: {outputs["off"] == outputs["on"]}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
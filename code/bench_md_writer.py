@@ -0,0 +1,92 @@
+
+import gc
+import os
+import sys
+import tempfile
+import time
+
+from md_writer import SectionWriter, humanize
+
+# Compares the per-item cost of the tax compliance rendering loop written
+# the original way (one file write per bullet, humanizing every key inline)
+# against SectionWriter plus the memoized humanize(), on a synthetic input
+# of `count` features.
+
+sub_keys = ['filing_frequency', 'registration_threshold', 'remittance_deadline',
+            'small_supplier_limit', 'input_tax_credit']
+
+
+def synthetic_data(count):
+    return {
+        'specifications': {
+            f'requirement_{i}': {sub_key: f'value {i}' for sub_key in sub_keys}
+            for i in range(count)
+        },
+        'features': [
+            {'category': f'Category {i}', 'details': [f'detail {i}a', f'detail {i}b']}
+            for i in range(count)
+        ]
+    }
+
+
+def render_before(data, path):
+    with open(path, 'w') as md_file:
+        for key, value in data['specifications'].items():
+            md_file.write(f'**{key.replace("_", " ").title()}:**\n')
+            for sub_key, sub_value in value.items():
+                md_file.write(f'*   {sub_key.replace("_", " ").title()}: {sub_value}\n')
+        md_file.write('\n')
+        for feature in data['features']:
+            md_file.write(f'### {feature["category"]}\n')
+            for detail in feature['details']:
+                md_file.write(f'*   {detail}\n')
+            md_file.write('\n')
+
+
+def render_after(data, path):
+    with SectionWriter(path) as md_file:
+        for key, value in data['specifications'].items():
+            md_file.write(f'**{humanize(key)}:**\n')
+            for sub_key, sub_value in value.items():
+                md_file.write(f'*   {humanize(sub_key)}: {sub_value}\n')
+        md_file.write('\n')
+        for feature in data['features']:
+            md_file.write(f'### {feature["category"]}\n')
+            for detail in feature['details']:
+                md_file.write(f'*   {detail}\n')
+            md_file.write('\n')
+
+
+def timed(render, data, path):
+    # Like timeit, keep the garbage collector out of the measurement
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        render(data, path)
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def main(count=100000, repeat=5):
+    data = synthetic_data(count)
+    with tempfile.TemporaryDirectory() as tmp:
+        before_path = os.path.join(tmp, 'before.md')
+        after_path = os.path.join(tmp, 'after.md')
+        # Interleave the runs so both see the same machine conditions
+        before = after = float('inf')
+        for _ in range(repeat):
+            before = min(before, timed(render_before, data, before_path))
+            after = min(after, timed(render_after, data, after_path))
+        with open(before_path, 'rb') as f1, open(after_path, 'rb') as f2:
+            identical = f1.read() == f2.read()
+
+    print(f'{count} features, best of {repeat} runs')
+    print(f'  per-line writes:   {before * 1e3:8.1f} ms  {before / count * 1e9:7.0f} ns/item')
+    print(f'  SectionWriter:     {after * 1e3:8.1f} ms  {after / count * 1e9:7.0f} ns/item')
+    print(f'  speedup: {before / after:.2f}x, output identical: {identical}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,165 @@
+
+import datetime
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import rdf_export
+
+# Exports a synthetic SQLite database of `count` users spread over 20
+# tenants, each with a subscription, three invoices and their payments, in
+# every format: in one process and with a worker per CPU. Each file is then
+# checked against the counts the export reported (one line per triple in
+# N-Triples, one block per entity in Turtle, one node per entity in
+# JSON-LD). Peak Python memory is traced while the largest tenant is
+# exported, to show it does not grow with the tenant. Finally 1% of the
+# subscriptions are changed and exported incrementally.
+#
+# One product has a REAL price of 0.00001 and Unix times for its
+# timestamps, as rows written by other tools may, and must still come out
+# as valid xsd:decimal and xsd:dateTime literals.
+
+tenant_count = 20
+
+schema = '''
+CREATE TABLE tenants (id TEXT PRIMARY KEY, name TEXT, created_at TEXT, updated_at TEXT);
+CREATE TABLE users (id TEXT PRIMARY KEY, tenant_id TEXT, email TEXT, password_hash TEXT, first_name TEXT,
+                    last_name TEXT, region TEXT, created_at TEXT, updated_at TEXT);
+CREATE TABLE products (id TEXT PRIMARY KEY, tenant_id TEXT, name TEXT, description TEXT, price REAL,
+                       currency TEXT, created_at TIMESTAMP, updated_at TIMESTAMP);
+CREATE TABLE subscriptions (id TEXT PRIMARY KEY, user_id TEXT, product_id TEXT, status TEXT,
+                            trial_ends_at TEXT, starts_at TEXT, ends_at TEXT, created_at TEXT, updated_at TEXT);
+CREATE TABLE invoices (id TEXT PRIMARY KEY, user_id TEXT, subscription_id TEXT, status TEXT, total TEXT,
+                       tax TEXT, currency TEXT, due_at TEXT, paid_at TEXT, created_at TEXT, updated_at TEXT);
+CREATE TABLE payments (id TEXT PRIMARY KEY, invoice_id TEXT, payment_gateway TEXT, transaction_id TEXT,
+                       amount TEXT, currency TEXT, status TEXT, created_at TEXT, updated_at TEXT);
+CREATE INDEX users_tenant ON users (tenant_id);
+CREATE INDEX products_tenant ON products (tenant_id);
+CREATE INDEX subscriptions_user ON subscriptions (user_id);
+CREATE INDEX invoices_user ON invoices (user_id);
+CREATE INDEX payments_invoice ON payments (invoice_id);
+'''
+
+stamp = '2025-06-01 00:00:00'
+
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def build_database(path, count, seed=0):
+    rng = random.Random(seed)
+    connection = sqlite3.connect(path)
+    connection.executescript(schema)
+    tenant_ids = [_uuid(rng) for _ in range(tenant_count)]
+    connection.executemany('INSERT INTO tenants VALUES (?, ?, ?, ?)',
+                           [(tenant_id, f'Tenant "{i}"', stamp, stamp) for i, tenant_id in enumerate(tenant_ids)])
+    products = []
+    for tenant_id in tenant_ids:
+        for i in range(5):
+            products.append((_uuid(rng), tenant_id, f'Plan {i}', f'Plan {i}\nbilled monthly',
+                             f'{rng.randrange(500, 20000) / 100:.2f}', 'CAD' if i % 2 else 'USD', stamp, stamp))
+    odd_product = (_uuid(rng), tenant_ids[0], 'Metered', 'Per API call', 0.00001, 'USD', 1735689600, 1735689600)
+    connection.executemany('INSERT INTO products VALUES (?, ?, ?, ?, ?, ?, ?, ?)', products + [odd_product])
+
+    for start in range(0, count, 50000):
+        users, subscriptions, invoices, payments = [], [], [], []
+        for i in range(start, min(start + 50000, count)):
+            # Tenants of very different sizes, as in production
+            tenant = min(int(rng.paretovariate(1.2)) - 1, tenant_count - 1)
+            user_id = _uuid(rng)
+            users.append((user_id, tenant_ids[tenant], f'user+{i}@example.com', 'x', f'Zoë {i}', 'Doe',
+                          'CA_ON', stamp, stamp))
+            product = products[tenant * 5 + rng.randrange(5)]
+            subscription_id = _uuid(rng)
+            subscriptions.append((subscription_id, user_id, product[0], 'active', None, '2025-01-01 00:00:00',
+                                  '2025-07-01 00:00:00', stamp, stamp))
+            for month in range(3, 6):
+                invoice_id = _uuid(rng)
+                invoices.append((invoice_id, user_id, subscription_id, 'paid', product[4], '0.00', product[5],
+                                 f'2025-0{month}-01 00:00:00', f'2025-0{month}-01 00:00:05', stamp, stamp))
+                payments.append((_uuid(rng), invoice_id, 'stripe', f'ch_{i}_{month}', product[4], product[5],
+                                 'successful', stamp, stamp))
+        connection.executemany('INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', users)
+        connection.executemany('INSERT INTO subscriptions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', subscriptions)
+        connection.executemany('INSERT INTO invoices VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', invoices)
+        connection.executemany('INSERT INTO payments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', payments)
+        connection.commit()
+    connection.close()
+    return tenant_ids
+
+
+def check(path, fmt, entities, triples):
+    # Whether the file holds the reported number of entities and triples
+    with open(path, 'r', encoding='utf-8') as f:
+        if fmt == 'jsonld':
+            graph = json.load(f)['@graph']
+            return len(graph) == entities and sum(len(node) - 1 for node in graph) == triples
+        text = f.read()
+    if fmt == 'ntriples':
+        return text.count(' .\n') == triples
+    return text.count('\n<') == entities and text.count(' ;\n    ') == triples - entities
+
+
+def main(count=100000):
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'billing.db')
+        start = time.perf_counter()
+        tenant_ids = build_database(database, count)
+        print(f'{count} users in {tenant_count} tenants, with {count} subscriptions, {count * 3} invoices and '
+              f'{count * 3} payments; database built in {time.perf_counter() - start:.1f}s')
+
+        literals = {'"0.00001"', '"2025-01-01T00:00:00+00:00"'}
+        odd_ok = True
+        for fmt in rdf_export.formats:
+            timings = []
+            for jobs in [1, None]:
+                output = os.path.join(tmp, f'{fmt}-{jobs}')
+                start = time.perf_counter()
+                results = rdf_export.export(database, output, fmt, jobs=jobs)
+                timings.append(time.perf_counter() - start)
+            triples = sum(result[2] for result in results.values())
+            size = sum(os.path.getsize(result[0]) for result in results.values())
+            ok = all(check(path, fmt, entities, triples) for path, entities, triples in results.values())
+            with open(results[tenant_ids[0]][0], 'r', encoding='utf-8') as f:
+                text = f.read()
+            odd_ok = odd_ok and all(literal in text for literal in literals)
+            print(f'  {fmt + ":":10} {triples} triples, {size / 2 ** 20:6.0f} MB; '
+                  f'one process {triples / timings[0]:8.0f} triples/s, '
+                  f'{os.cpu_count()} CPUs {triples / timings[1]:8.0f} triples/s; files match counts: {ok}')
+
+        print(f'  REAL price and Unix time columns written as xsd literals: {odd_ok}')
+
+        largest = max(tenant_ids, key=lambda tenant_id: results[tenant_id][1])
+        tracemalloc.start()
+        entities, triples = rdf_export.export_tenant(database, largest, os.path.join(tmp, 'largest.nt'),
+                                                     'ntriples')
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'  largest tenant: {entities} entities, {triples} triples, '
+              f'peak Python memory {peak / 2 ** 20:.1f} MB')
+
+        connection = sqlite3.connect(database)
+        now = datetime.datetime.now().isoformat(' ', 'seconds')
+        with connection:
+            changed = connection.execute("UPDATE subscriptions SET status = 'canceled', updated_at = ? "
+                                         "WHERE id IN (SELECT id FROM subscriptions ORDER BY random() LIMIT ?)",
+                                         (now, count // 100)).rowcount
+        connection.close()
+        start = time.perf_counter()
+        results = rdf_export.export(database, os.path.join(tmp, 'jsonld-None'), 'jsonld', incremental=True)
+        elapsed = time.perf_counter() - start
+        entities = sum(result[1] for result in results.values())
+        ok = all(check(path, 'jsonld', entities, triples) for path, entities, triples in results.values())
+        print(f'  incremental JSON-LD after changing {changed} subscriptions: {entities} entities '
+              f'in {elapsed:.2f}s; files match counts: {ok}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,157 @@
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import renewals
+from bench_tax_engine import rate_rows
+from tax_engine import TaxEngine
+
+# Runs the renewal pipeline over a synthetic SQLite database of `count`
+# subscriptions, about 80% of them due, with an in-process charger that
+# declines 1% of cards. A few users have no region, so no tax rate. The run
+# is stopped a third of the way in, then crashes with an exception in the
+# middle of pricing, and is resumed, then the result is checked: every due
+# subscription with a tax rate invoiced exactly once and charged, and the
+# ones without skipped. Peak Python memory is reported to show it does not
+# grow with the number of subscriptions.
+
+as_of = '2025-07-01 00:00:00'
+
+schema = '''
+CREATE TABLE users (id TEXT PRIMARY KEY, tenant_id TEXT, email TEXT, region TEXT,
+                    created_at TEXT, updated_at TEXT);
+CREATE TABLE products (id TEXT PRIMARY KEY, tenant_id TEXT, name TEXT, price TEXT, currency TEXT,
+                       created_at TEXT, updated_at TEXT);
+CREATE TABLE subscriptions (id TEXT PRIMARY KEY, user_id TEXT, product_id TEXT, status TEXT,
+                            trial_ends_at TEXT, starts_at TEXT, ends_at TEXT, created_at TEXT, updated_at TEXT);
+CREATE TABLE invoices (id TEXT PRIMARY KEY, user_id TEXT, subscription_id TEXT, status TEXT, total TEXT,
+                       tax TEXT, currency TEXT, due_at TEXT, paid_at TEXT, created_at TEXT, updated_at TEXT);
+CREATE TABLE payments (id TEXT PRIMARY KEY, invoice_id TEXT, payment_gateway TEXT, transaction_id TEXT,
+                       amount TEXT, currency TEXT, status TEXT, created_at TEXT, updated_at TEXT);
+CREATE TABLE tax_rates (id TEXT PRIMARY KEY, region TEXT, rate TEXT, description TEXT, effective_from TEXT,
+                        created_at TEXT, updated_at TEXT);
+'''
+
+
+class Crash(Exception):
+    pass
+
+
+class CrashingEngine:
+    # A tax engine that raises on its `after`-th call, as a lost database
+    # connection or a bug would
+
+    def __init__(self, engine, after):
+        self.engine = engine
+        self.calls = 0
+        self.after = after
+
+    def calculate(self, *args):
+        self.calls += 1
+        if self.calls == self.after:
+            raise Crash(f'crash in chunk {self.calls}')
+        return self.engine.calculate(*args)
+
+    def rate(self, *args):
+        return self.engine.rate(*args)
+
+
+def build_database(path, count, seed=0):
+    # Returns the numbers of subscriptions due at as_of with and without a
+    # tax region
+    rng = random.Random(seed)
+    connection = sqlite3.connect(path)
+    connection.executescript(schema)
+    regions = sorted({row['region'] for row in rate_rows})
+    connection.executemany('INSERT INTO tax_rates VALUES (?, ?, ?, ?, ?, ?, ?)', [
+        (str(i), row['region'], row['rate'], '', row['effective_from'], row['effective_from'], row['effective_from'])
+        for i, row in enumerate(rate_rows)])
+    products = [(f'product-{i}', 'tenant', f'Plan {i}', f'{rng.randrange(500, 20000) / 100:.2f}',
+                 'CAD' if i % 2 else 'USD', '', '') for i in range(20)]
+    connection.executemany('INSERT INTO products VALUES (?, ?, ?, ?, ?, ?, ?)', products)
+
+    due = 0
+    unknown = 0
+    for start in range(0, count, 100000):
+        users = []
+        subscriptions = []
+        for i in range(start, min(start + 100000, count)):
+            user_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            region = None if rng.random() < 0.001 else rng.choice(regions)
+            users.append((user_id, 'tenant', f'user{i}@example.com', region, '', ''))
+            status = 'active' if rng.random() < 0.9 else rng.choice(['canceled', 'paused'])
+            ends_at = f'2025-06-{rng.randrange(1, 31):02d} 00:00:00' if rng.random() < 0.9 else \
+                f'2025-07-{rng.randrange(2, 31):02d} 00:00:00'
+            trial = '2025-07-15 00:00:00' if rng.random() < 0.02 else None
+            if status == 'active' and ends_at <= as_of and trial is None:
+                due += region is not None
+                unknown += region is None
+            subscriptions.append((str(uuid.UUID(int=rng.getrandbits(128), version=4)), user_id,
+                                  rng.choice(products)[0], status, trial, '2025-01-01 00:00:00', ends_at, '', ''))
+        connection.executemany('INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)', users)
+        connection.executemany('INSERT INTO subscriptions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', subscriptions)
+        connection.commit()
+    connection.close()
+    return due, unknown
+
+
+def approve(invoices):
+    # Stands in for gateways.py: declines about 1% of cards
+    return [('stub', None if invoice[0].startswith('ff') else f'txn-{invoice[0]}') for invoice in invoices]
+
+
+def main(count=1000000):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'billing.db')
+        start = time.perf_counter()
+        due, unknown = build_database(path, count)
+        print(f'{count} subscriptions, {due} due, {unknown} more due without a tax region; '
+              f'database built in {time.perf_counter() - start:.1f}s')
+
+        # Memory is traced during the first, stopped part of the run and the
+        # rest is timed untraced, as tracemalloc slows Python down
+        tracemalloc.start()
+        first = renewals.run(path, as_of, charger=approve, max_chunks=due // renewals.chunk_size // 3)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        connection = sqlite3.connect(path)
+        engine = CrashingEngine(TaxEngine.from_sqlite(connection), after=3)
+        connection.close()
+        try:
+            renewals.run(path, as_of, engine=engine, charger=approve)
+            crash = None
+        except Crash as e:
+            crash = e
+        start = time.perf_counter()
+        second = renewals.run(path, as_of, charger=approve)
+        elapsed = time.perf_counter() - start
+        third = renewals.run(path, as_of, charger=approve)
+
+        connection = sqlite3.connect(path)
+        invoices, subscriptions = connection.execute(
+            'SELECT COUNT(*), COUNT(DISTINCT subscription_id) FROM invoices').fetchone()
+        states = dict(connection.execute('SELECT status, COUNT(*) FROM invoices GROUP BY status'))
+        payments = connection.execute('SELECT COUNT(*) FROM payments').fetchone()[0]
+        left = connection.execute("SELECT COUNT(*) FROM subscriptions s WHERE status = 'active' AND ends_at <= ? "
+                                  "AND trial_ends_at IS NULL AND NOT EXISTS "
+                                  "(SELECT 1 FROM invoices i WHERE i.subscription_id = s.id)", (as_of,)).fetchone()[0]
+        connection.close()
+
+    print(f'  stopped after {first["invoices"]} invoices, peak Python memory {peak / 2 ** 20:.1f} MB')
+    print(f'  then crashed: {crash}')
+    print(f'  resumed: {second["invoices"] / elapsed:8.0f} subscriptions/s  '
+          f'({second["invoices"]} in {elapsed:.1f}s, including payments)')
+    print(f'  invoices: {invoices} for {subscriptions} subscriptions, {payments} payments, {states}')
+    print(f'  left unbilled for want of a tax region: {left}')
+    ok = invoices == subscriptions == due == payments and left == unknown and third['status'] == 'finished'
+    print(f'  every due subscription with a region invoiced and charged exactly once: {ok}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,97 @@
+
+import bisect
+import datetime
+import gc
+import random
+import sys
+import time
+from decimal import ROUND_HALF_UP, Decimal
+
+import tax_engine
+from tax_engine import TaxEngine, from_cents
+
+# Compares tax on a month-end batch of `count` line items computed the
+# straightforward way (look the rate up per row, multiply Decimals and
+# quantize) against TaxEngine's plain and vectorized paths, and checks that
+# all three agree to the cent. Ontario's rate changes mid-batch so the
+# effective dating is exercised too.
+
+rate_rows = [
+    {'region': 'CA_ON', 'rate': '0.1300', 'effective_from': '2016-07-01'},
+    {'region': 'CA_ON', 'rate': '0.1500', 'effective_from': '2025-06-15'},
+    {'region': 'CA_AB', 'rate': '0.0500', 'effective_from': '2008-01-01'},
+    {'region': 'US_NY', 'rate': '0.0400', 'effective_from': '2005-06-01'},
+    {'region': 'US_CA', 'rate': '0.0725', 'effective_from': '2017-01-01'},
+    {'region': 'US_TX', 'rate': '0.0625', 'effective_from': '1990-07-01'},
+    {'region': 'US_WA', 'rate': '0.0650', 'effective_from': '2003-04-01'},
+    {'region': 'US_OR', 'rate': '0.0000', 'effective_from': '1990-01-01'},
+]
+
+
+def synthetic_batch(count, seed=0):
+    rng = random.Random(seed)
+    regions = sorted({row['region'] for row in rate_rows})
+    days = [datetime.date(2025, 6, day).isoformat() for day in range(1, 31)]
+    # A few credits, and amounts ending in a half cent of tax
+    cents = [rng.randrange(-5000, 2000000) if rng.random() < 0.02 else rng.randrange(1, 2000000)
+             for _ in range(count)]
+    return cents, [rng.choice(regions) for _ in range(count)], [rng.choice(days) for _ in range(count)]
+
+
+def tax_decimal(cents, regions, days):
+    schedules = {}
+    for row in rate_rows:
+        schedules.setdefault(row['region'], []).append((row['effective_from'], Decimal(row['rate'])))
+    for schedule in schedules.values():
+        schedule.sort()
+    taxes = []
+    for amount, region, day in zip(cents, regions, days):
+        schedule = schedules[region]
+        rate = schedule[bisect.bisect_right(schedule, (day, Decimal('Infinity'))) - 1][1]
+        tax = (from_cents(amount) * rate).quantize(Decimal('0.01'), ROUND_HALF_UP)
+        taxes.append(int(tax * 100))
+    return taxes
+
+
+def timed(function, *args):
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        result = function(*args)
+        return time.perf_counter() - start, result
+    finally:
+        gc.enable()
+
+
+def main(count=1000000, repeat=3):
+    batch = synthetic_batch(count)
+    engine = TaxEngine(rate_rows)
+    runs = {'Decimal per row': lambda: tax_decimal(*batch),
+            'TaxEngine, plain': lambda: engine.calculate(*batch, vectorized=False)}
+    if tax_engine.numpy is not None:
+        runs['TaxEngine, NumPy'] = lambda: engine.calculate(*batch, vectorized=True)
+        # The same batch as columns, as read from an array-based source
+        arrays = (tax_engine.numpy.array(batch[0]), tax_engine.numpy.array(batch[1]),
+                  tax_engine.numpy.array(batch[2], dtype='datetime64[D]'))
+        runs['NumPy, arrays'] = lambda: engine.calculate(*arrays, vectorized=True)
+
+    best = dict.fromkeys(runs, float('inf'))
+    results = {}
+    for _ in range(repeat):
+        for name, run in runs.items():
+            seconds, results[name] = timed(run)
+            best[name] = min(best[name], seconds)
+
+    expected = results['Decimal per row']
+    print(f'{count} line items, best of {repeat} runs')
+    for name, seconds in best.items():
+        same = list(results[name]) == expected
+        print(f'  {name + ":":20} {seconds * 1e3:8.1f} ms  {seconds / count * 1e9:6.0f} ns/item  '
+              f'{best["Decimal per row"] / seconds:5.1f}x  identical: {same}')
+    if tax_engine.numpy is None:
+        print('  (NumPy is not installed, so the vectorized path was not run)')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
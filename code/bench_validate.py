@@ -0,0 +1,77 @@
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import validate
+from benchmark import benchmark_sections, generate_corpus
+from md_writer import SectionWriter
+from section_engine import render_section
+from section_specs import sections
+
+# Builds a synthetic corpus with `count` gateway files, drops a key from
+# the last item of the last one, and times how long until the problem is
+# reported: by rendering every section until one fails, as before inputs
+# were checked; by checking every input in one process and in parallel;
+# and by checking again with the outcomes cached.
+
+
+def render_until_failure():
+    for name, spec in sections.items():
+        try:
+            with SectionWriter(spec['output']) as md_file:
+                render_section(spec, md_file)
+        except KeyError as e:
+            return f'{spec["output"]}: KeyError {e}'
+
+
+def timed_validate(jobs, cache_dir):
+    checks = validate.CheckCache(cache_dir)
+    start = time.perf_counter()
+    problems = validate.validate(jobs=jobs, checks=checks)
+    return time.perf_counter() - start, problems
+
+
+def main(count=20, features=400):
+    tmp = tempfile.mkdtemp(prefix='billing-bench-')
+    cwd = os.getcwd()
+    saved = dict(sections)
+    try:
+        gateway_files = generate_corpus(tmp, gateways=count, features=features)
+        sections.update(benchmark_sections(gateway_files))
+        os.chdir(tmp)
+        path = os.path.join('search_results', gateway_files[-1])
+        with open(path, 'r') as f:
+            data = json.load(f)
+        del data['features'][-2]['items'][-1]['description']
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+        size = sum(os.path.getsize(os.path.join('search_results', name)) for name in os.listdir('search_results'))
+
+        start = time.perf_counter()
+        crash = render_until_failure()
+        rendering = time.perf_counter() - start
+        serial, problems = timed_validate(1, os.path.join(tmp, 'serial'))
+        parallel, _ = timed_validate(None, os.path.join(tmp, 'parallel'))
+        warm, _ = timed_validate(None, os.path.join(tmp, 'parallel'))
+    finally:
+        sections.clear()
+        sections.update(saved)
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+
+    print(f'{count} gateway files of {features} features, {size / (1 << 20):.1f} MB of inputs')
+    print(f'  render until it fails:  {rendering * 1000:8.1f}ms  ({crash})')
+    print(f'  check, one process:     {serial * 1000:8.1f}ms')
+    print(f'  check, in parallel:     {parallel * 1000:8.1f}ms')
+    print(f'  check, nothing changed: {warm * 1000:8.1f}ms')
+    for found in problems.values():
+        for problem in found:
+            print(f'    {problem}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,90 @@
+
+import os
+import queue
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import build
+from section_specs import sections
+from watch import Watcher
+
+# Edits one of the design documents merged into the final design `count`
+# times and measures how long it takes until the merged document and its
+# DOCX and PDF exports are rebuilt: with watch.py's Watcher picking up the
+# change through inotify and through polling, and with running build.py
+# by hand after each edit.
+
+
+def edit(rng, files):
+    path = rng.choice(files)
+    with open(path, 'a') as f:
+        f.write(f'\nEdited {rng.random()}.\n')
+
+
+def watched(files, count, poll):
+    rng = random.Random(0)
+    watcher = Watcher(poll=poll)
+    rebuilds = queue.Queue()
+    stop = threading.Event()
+    thread = threading.Thread(target=watcher.run, args=(stop, lambda *rebuild: rebuilds.put(rebuild)))
+    thread.start()
+    latencies = []
+    try:
+        for _ in range(count):
+            # Let the events of the last build's own writes go by
+            time.sleep(0.3)
+            start = time.perf_counter()
+            edit(rng, files)
+            rebuilt, failed, _ = rebuilds.get(timeout=30)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        stop.set()
+        thread.join()
+        watcher.close()
+    return sorted(latencies), len(rebuilt)
+
+
+def by_hand(files, count):
+    rng = random.Random(1)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build.py')
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        edit(rng, files)
+        subprocess.run([sys.executable, script], check=True, stdout=subprocess.DEVNULL)
+        latencies.append(time.perf_counter() - start)
+    return sorted(latencies)
+
+
+def main(count=10):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    tmp = tempfile.mkdtemp(prefix='billing-bench-')
+    cwd = os.getcwd()
+    try:
+        for directory in ['docs', 'design']:
+            shutil.copytree(os.path.join(root, directory), os.path.join(tmp, directory))
+        os.chdir(tmp)
+        spec = sections['final_design']
+        files = [os.path.join(spec['directory'], filename) for part in spec['body']
+                 for filename in part.get('concat', [])]
+        build.build()
+        results = [('inotify', watched(files, count, poll=False)), ('polling', watched(files, count, poll=True))]
+        manual = by_hand(files, count)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+
+    print(f'{count} edits to design/*.md, each rebuilding the final design and its exports')
+    for name, (latencies, stages) in results:
+        print(f'  watch ({name}):{" " * (9 - len(name))}median {latencies[len(latencies) // 2] * 1000:7.1f}ms, '
+              f'worst {latencies[-1] * 1000:7.1f}ms  ({stages} stages)')
+    print(f'  build.py by hand: median {manual[len(manual) // 2] * 1000:7.1f}ms, worst {manual[-1] * 1000:7.1f}ms')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
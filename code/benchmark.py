@@ -0,0 +1,295 @@
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import section_engine
+from md_writer import SectionWriter
+from parse_cache import ParseCache
+from section_specs import GATEWAY, sections
+
+# Times every section of section_specs.py against a synthetic search_results
+# corpus of configurable size and shape, and writes the timings as JSON so
+# runs from different commits can be compared:
+#
+#   python code/benchmark.py --features 2000 --output before.json
+#   ... change something ...
+#   python code/benchmark.py --features 2000 --compare before.json
+#
+# Each section is timed end to end (parse, render and write to disk) and,
+# when not streaming, per stage: `compile` turns the spec into code,
+# `load` parses the JSON inputs, `cached_load` loads them from a warm
+# parse_cache and `render` produces the markdown in memory.
+
+_words = ('invoice subscription payment gateway tax region ledger refund webhook '
+          'customer charge settlement currency compliance report').split()
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(_words) for _ in range(words)).capitalize() + '.'
+
+
+def _key(rng, i):
+    return f'{rng.choice(_words)}_{rng.choice(_words)}_{i}'
+
+
+def _nested(rng, depth, width, words):
+    # Specifications nested `depth` levels deep, like us_tax_requirements.json
+    if depth <= 1:
+        return _text(rng, words)
+    return {_key(rng, i): _nested(rng, depth - 1, width, words) for i in range(width)}
+
+
+def generate_corpus(root, gateways=7, features=50, items=10, depth=3, words=12, seed=0):
+    # Writes a search_results/ and design/ tree under `root` and returns the
+    # gateway file names, as the gateway count is part of the shape
+    rng = random.Random(seed)
+    results = os.path.join(root, 'search_results')
+    for path in [results, os.path.join(root, 'docs'), os.path.join(root, 'design')]:
+        os.makedirs(path, exist_ok=True)
+
+    def write(filename, data):
+        with open(os.path.join(results, filename), 'w') as f:
+            json.dump(data, f, indent=2)
+
+    def named(n, **extra):
+        return [dict({'name': f'{rng.choice(_words).title()} {i}', 'description': _text(rng, words)}, **extra)
+                for i in range(n)]
+
+    gateway_files = [f'gateway_{i}_api.json' for i in range(gateways)]
+    for filename in gateway_files:
+        write(filename, {
+            'extracted_information': _text(rng, words * 4),
+            'features': [
+                {'category': f'Category {i}', 'items': named(items)} if i % 2 == 0 else
+                {'category': f'Category {i}', 'capabilities': [_text(rng, words)] + named(items - 1)}
+                for i in range(features)
+            ]
+        })
+
+    tax_features = [{'category': f'Category {i}', 'details': [_text(rng, words) for _ in range(items)]}
+                    for i in range(features)]
+    for filename in ['hst_requirements_detailed.json', 'hst_remittance_details.json']:
+        write(filename, {
+            'extracted_information': _text(rng, words * 4),
+            'specifications': _nested(rng, min(depth, 2) + 1, features, words),
+            'features': tax_features
+        })
+    write('us_tax_requirements.json', {
+        'extracted_information': _text(rng, words * 4),
+        'specifications': _nested(rng, depth + 1, max(2, round(features ** (1 / depth))), words),
+        'features': tax_features
+    })
+
+    challenges = [f'Challenge {i}' for i in range(features)]
+    for filename in sections['billing_architecture']['body'][1]['sources']:
+        write(filename, {
+            'extracted_information': _text(rng, words * 4),
+            'specifications': {
+                'architectural_styles': {_key(rng, i): {'description': _text(rng, words), 'pros': _text(rng, words),
+                                                        'cons': _text(rng, words)} for i in range(features)},
+                'core_components': {_key(rng, i): {'responsibility': _text(rng, words)} for i in range(features)}
+            },
+            'features': [{'pattern_name': f'Pattern {i}', 'description': _text(rng, words),
+                          'use_cases': [_text(rng, words) for _ in range(items)],
+                          'shortcomings': [_text(rng, words) for _ in range(items)]} for i in range(features)],
+            'challenges': [{'challenge_name': name, 'description': _text(rng, words)} for name in challenges],
+            'solutions': [{'challenge_name': name, 'solution_description': _text(rng, words)} for name in challenges]
+        })
+
+    for filename in sections['standards_and_frameworks']['body'][1]['sources']:
+        write(filename, {
+            'extracted_information': _text(rng, words * 4),
+            'specifications': {
+                'properties': [{'property': _key(rng, i), 'expected_type': 'Text', 'description': _text(rng, words)}
+                               for i in range(features)],
+                'Entities': {f'Entity{i}': {'description': _text(rng, words),
+                                            'attributes': [_key(rng, j) for j in range(items)],
+                                            'relationships': [{'type': 'has many', 'entity': f'Entity{j}'}
+                                                              for j in range(3)]} for i in range(features)}
+            },
+            'features': named(features)
+        })
+
+    write('pci_dss_12_requirements.json', {
+        'extracted_information': _text(rng, words * 4),
+        'features': [{'requirement_number': i + 1, 'title': _text(rng, 4), 'description': _text(rng, words)}
+                     for i in range(features)]
+    })
+    write('stripe_pci_compliance.json', {'extracted_information': _text(rng, words * 4), 'features': named(features)})
+    write('payment_security_best_practices.json', {'features': named(features)})
+    write('ui_ux_trends_bizbot.json', {'features': named(features, tip_number=1)})
+    write('ui_ux_trends_ehousestudio.json', {
+        'features': [{'guideline_number': i + 1, 'title': _text(rng, 4), 'description': _text(rng, words)}
+                     for i in range(features)]
+    })
+    write('ui_ux_trends_brainhub.json', {
+        'features': [{'trend_name': _text(rng, 3), 'description': _text(rng, words)} for _ in range(features)]
+    })
+
+    for filename in sections['final_design']['body'][1]['concat']:
+        with open(os.path.join(root, 'design', filename), 'w') as f:
+            f.write(f'# {filename}\n\n')
+            for i in range(features):
+                f.write(f'## Part {i}\n\n{_text(rng, words * items)}\n\n')
+
+    return gateway_files
+
+
+def benchmark_sections(gateway_files):
+    # The real specs, with the gateway list swapped for the synthetic one
+    specs = dict(sections)
+    gateway = dict(specs['gateway_analysis'])
+    gateway['body'] = [part if part.get('do') is not GATEWAY else dict(part, sources=gateway_files)
+                       for part in gateway['body']]
+    specs['gateway_analysis'] = gateway
+    return specs
+
+
+def _size(paths):
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def time_section(spec, stream=False, cache=None):
+    timings = {}
+    source_parts = [part for part in spec['body'] if 'sources' in part]
+
+    if source_parts and not stream:
+        start = time.perf_counter()
+        for part in source_parts:
+            section_engine._compiled.pop(id(part['do']), None)
+            section_engine.compile_nodes(part['do'])
+        timings['compile'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        loaded = []
+        for part in source_parts:
+            for filename in part['sources']:
+                filepath = os.path.join(spec['directory'], filename)
+                if os.path.exists(filepath):
+                    with open(filepath, 'r') as json_file:
+                        loaded.append((part, filename, json.load(json_file)))
+        timings['load'] = time.perf_counter() - start
+
+        if cache is not None:
+            start = time.perf_counter()
+            for part, filename, data in loaded:
+                cache.load(os.path.join(spec['directory'], filename))
+            timings['cached_load'] = time.perf_counter() - start
+
+        parts = []
+        start = time.perf_counter()
+        for part, filename, data in loaded:
+            section_engine.compile_nodes(part['do'])(parts.append, lambda: None, data, filename)
+        timings['render'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with SectionWriter(spec['output']) as md_file:
+        section_engine.render_section(spec, md_file, stream=stream)
+    timings['total'] = time.perf_counter() - start
+    return timings
+
+
+def run(params, repeat=3, stream=False, keep=None):
+    root = keep or tempfile.mkdtemp(prefix='billing-bench-')
+    cwd = os.getcwd()
+    results = {}
+    try:
+        gateway_files = generate_corpus(root, **params)
+        os.chdir(root)
+        specs = benchmark_sections(gateway_files)
+        cache = ParseCache(os.path.join(root, '.cache'), max_size=1 << 40)
+        # Sections run in build order, so the merge stages read fresh output
+        for _ in range(repeat):
+            for name, spec in specs.items():
+                timings = time_section(spec, stream=stream, cache=cache)
+                best = results.setdefault(name, {})
+                for stage, seconds in timings.items():
+                    best[stage] = min(best.get(stage, seconds), seconds)
+        for name, spec in specs.items():
+            results[name]['input_bytes'] = _size(section_engine.section_inputs(spec))
+            results[name]['output_bytes'] = _size([spec['output']])
+    finally:
+        os.chdir(cwd)
+        if not keep:
+            shutil.rmtree(root)
+    return results
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(current, baseline, threshold):
+    # Prints the change in total time per section and returns the sections
+    # that got slower by more than `threshold`
+    regressions = []
+    print(f'\n{"section":28} {"baseline":>10} {"current":>10} {"change":>8}')
+    for name, timings in current['results'].items():
+        before = baseline['results'].get(name, {}).get('total')
+        if before is None:
+            continue
+        change = timings['total'] / before - 1 if before else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'{name:28} {before * 1e3:8.1f}ms {timings["total"] * 1e3:8.1f}ms {change:+7.1%}{flag}')
+    if baseline['params'] != current['params'] or baseline['stream'] != current['stream']:
+        print('Warning: the baseline was run with different parameters')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the section compilers on a synthetic corpus.')
+    parser.add_argument('--gateways', type=int, default=7, help='number of gateway API files')
+    parser.add_argument('--features', type=int, default=50, help='features (and other records) per file')
+    parser.add_argument('--items', type=int, default=10, help='items per feature')
+    parser.add_argument('--depth', type=int, default=3, help='nesting depth of the US tax specifications')
+    parser.add_argument('--words', type=int, default=12, help='words per description')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per section; the best is kept')
+    parser.add_argument('--stream', action='store_true', help='benchmark streaming ingestion')
+    parser.add_argument('--keep', metavar='DIR', help='generate the corpus in DIR and keep it')
+    parser.add_argument('--output', metavar='FILE', help='write the results as JSON')
+    parser.add_argument('--compare', metavar='FILE', help='compare against results from an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='slowdown reported as a regression by --compare (default: 0.10)')
+    args = parser.parse_args()
+
+    params = {'gateways': args.gateways, 'features': args.features, 'items': args.items,
+              'depth': args.depth, 'words': args.words, 'seed': args.seed}
+    current = {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'params': params,
+        'stream': args.stream,
+        'repeat': args.repeat,
+        'results': run(params, repeat=args.repeat, stream=args.stream, keep=args.keep)
+    }
+
+    stages = ['compile', 'load', 'cached_load', 'render', 'total']
+    print(f'{"section":28}' + ''.join(f'{stage:>12}' for stage in stages) + f'{"in":>10}{"out":>10}')
+    for name, timings in current['results'].items():
+        row = ''.join(f'{timings[stage] * 1e3:10.1f}ms' if stage in timings else f'{"-":>12}' for stage in stages)
+        print(f'{name:28}{row}{timings["input_bytes"] / 1024:8.0f}KB{timings["output_bytes"] / 1024:8.0f}KB')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(current, json.load(f), args.threshold)
+        sys.exit(1 if regressions else 0)
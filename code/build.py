@@ -0,0 +1,262 @@
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import export
+import generate_architecture_diagram
+import instrument
+import validate
+from parse_cache import ParseCache, format_stats
+from section_engine import build_section, section_inputs
+from section_specs import sections
+
+# The file recording the content hashes from the previous build
+state_file = '.build_state.json'
+
+# Stage name -> format, for the diagrams drawn from the component registry
+diagram_stages = {'architecture_diagram': 'mermaid', 'architecture_plantuml': 'plantuml'}
+
+# Stage name -> (document, format), for the DOCX and PDF exports of the
+# final documents
+export_stages = {f'{name}_{fmt}': (name, fmt) for name in export.documents for fmt in export.writers}
+
+# Code every section is rendered with; editing any of it rebuilds them all
+engine_files = ['section_engine.py', 'section_specs.py', 'md_writer.py', 'json_stream.py',
+                'parse_cache.py', 'instrument.py', 'validate.py']
+
+
+def build_stages():
+    # stage name -> (output file, input files). There is one stage per
+    # section in section_specs.py, the two architecture diagrams and the
+    # exports of the final documents. Dependencies between stages are
+    # worked out from these files.
+    here = os.path.dirname(os.path.abspath(__file__))
+    engine_inputs = [os.path.relpath(os.path.join(here, filename)) for filename in engine_files]
+    stages = {}
+    for name, spec in sections.items():
+        stages[name] = (spec['output'], engine_inputs + section_inputs(spec))
+    diagram_inputs = [os.path.relpath(generate_architecture_diagram.__file__),
+                      generate_architecture_diagram.registry_file]
+    for name, fmt in diagram_stages.items():
+        stages[name] = (generate_architecture_diagram.outputs[fmt], diagram_inputs)
+    export_inputs = [os.path.relpath(os.path.join(here, filename)) for filename in export.code_files]
+    for name, (document, fmt) in export_stages.items():
+        stages[name] = (export.output_path(document, fmt), export_inputs + [sections[document]['output']])
+    return stages
+
+
+def load_state():
+    if os.path.exists(state_file):
+        with open(state_file, 'r') as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                print(f'Ignoring corrupt build state in {state_file}')
+    return {'files': {}, 'stages': {}}
+
+
+def save_state(state):
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, state_file)
+
+
+def file_digest(path, state):
+    # Only re-hash a file when its size or mtime moved since the last build,
+    # so a no-op build is a handful of stat() calls.
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        state['files'].pop(path, None)
+        return None
+    known = state['files'].get(path)
+    if known and known[0] == st.st_mtime_ns and known[1] == st.st_size:
+        return known[2]
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+    state['files'][path] = [st.st_mtime_ns, st.st_size, digest]
+    return digest
+
+
+def stage_is_current(name, stage, state):
+    output, inputs = stage
+    record = state['stages'].get(name)
+    if record is None:
+        return False
+    if {path: file_digest(path, state) for path in inputs} != record['inputs']:
+        return False
+    digest = file_digest(output, state)
+    return digest is not None and digest == record['output']
+
+
+def record_stage(name, stage, state):
+    output, inputs = stage
+    state['stages'][name] = {
+        'inputs': {path: file_digest(path, state) for path in inputs},
+        'output': file_digest(output, state)
+    }
+
+
+def stage_dependencies(stages):
+    # A stage depends on every other stage whose output it reads
+    producers = {os.path.normpath(output): name for name, (output, inputs) in stages.items()}
+    dependencies = {}
+    for name, (output, inputs) in stages.items():
+        dependencies[name] = set()
+        for path in inputs:
+            producer = producers.get(os.path.normpath(path))
+            if producer and producer != name:
+                dependencies[name].add(producer)
+    return dependencies
+
+
+def run_stage(name, stream=False, use_cache=True, trace=False, cache=None, checks=None):
+    # Returns the number of parse cache hits and misses, and with `trace`
+    # what instrument recorded in this worker. `cache` and `checks` are a
+    # ParseCache and a validate.CheckCache to use instead of loading them,
+    # as watch.py keeps its own between builds.
+    if trace:
+        instrument.enable()
+    counts = 0, 0
+    with instrument.stage('build.stage', stage=name):
+        if name in diagram_stages:
+            generate_architecture_diagram.generate_architecture_diagram(formats=[diagram_stages[name]])
+        elif name in export_stages:
+            export.export(*export_stages[name])
+        else:
+            if cache is None and use_cache:
+                cache = ParseCache()
+            if checks is None and use_cache:
+                checks = validate.CheckCache()
+            try:
+                build_section(name, stream=stream, cache=cache, checks=checks)
+            finally:
+                if checks is not None:
+                    checks.save()
+            if cache is not None:
+                counts = cache.hits, cache.misses
+                cache.save()
+    instrument.count('parse_cache.hits', counts[0])
+    instrument.count('parse_cache.misses', counts[1])
+    return counts + (instrument.collect() if trace else None,)
+
+
+def build(selected=None, force=False, jobs=None, stream=False, use_cache=True,
+          show_cache_stats=False):
+    state = load_state()
+    stages = {name: stage for name, stage in build_stages().items()
+              if not selected or name in selected}
+    dependencies = stage_dependencies(stages)
+    pending = list(stages)
+    running = {}
+    finished = set()
+    failed = set()
+    rebuilt = []
+    cache_counts = [0, 0]
+    # The pool is only started once something actually needs rebuilding,
+    # so an up-to-date tree never pays for spawning workers.
+    pool = None
+
+    # The inputs of every section about to be rebuilt are checked first,
+    # so one that does not fit its spec fails its section before any
+    # output is written
+    stale = [name for name in stages if name in sections
+             and (force or not stage_is_current(name, stages[name], state))]
+    with instrument.stage('build.validate', items=len(stale)):
+        problems = validate.validate(stale, jobs=jobs, stream=stream) if stale else {}
+    for name, found in problems.items():
+        print(f'Error in the inputs of {stages[name][0]}:')
+        for problem in found:
+            print(f'  {problem}')
+        pending.remove(name)
+        failed.add(name)
+
+    while pending or running:
+        for name in list(pending):
+            if dependencies[name] & failed:
+                print(f'Skipping {stages[name][0]}: a dependency failed')
+                pending.remove(name)
+                failed.add(name)
+                continue
+            if not dependencies[name] <= finished:
+                continue
+            pending.remove(name)
+            with instrument.stage('build.check', stage=name):
+                current = not force and stage_is_current(name, stages[name], state)
+            if current:
+                finished.add(name)
+                continue
+            print(f'Building {stages[name][0]}')
+            if pool is None:
+                pool = ProcessPoolExecutor(max_workers=jobs)
+            running[pool.submit(run_stage, name, stream, use_cache, instrument.enabled)] = name
+
+        if not running:
+            if pending and not any(dependencies[name] <= finished | failed for name in pending):
+                raise RuntimeError(f'Dependency cycle between stages: {", ".join(pending)}')
+            continue
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = running.pop(future)
+            try:
+                hits, misses, recorded = future.result()
+            except Exception as e:
+                print(f'Error building {stages[name][0]}: {e}')
+                failed.add(name)
+                continue
+            if recorded is not None:
+                instrument.merge(recorded)
+            record_stage(name, stages[name], state)
+            cache_counts[0] += hits
+            cache_counts[1] += misses
+            finished.add(name)
+            rebuilt.append(name)
+
+    if pool is not None:
+        pool.shutdown()
+    save_state(state)
+    if not rebuilt and not failed:
+        print('Everything up to date')
+    if show_cache_stats:
+        print(f'Parse cache this build: {cache_counts[0]} hits, {cache_counts[1]} misses')
+        print(format_stats(ParseCache().stats()))
+    return rebuilt, failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the research and design documents.')
+    parser.add_argument('stages', nargs='*', help='only build these stages')
+    parser.add_argument('--force', action='store_true', help='rebuild even if up to date')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--stream', action='store_true',
+                        help='stream large JSON inputs instead of loading them whole')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='parse every JSON input instead of using the parse cache')
+    parser.add_argument('--cache-stats', action='store_true',
+                        help='report parse cache statistics after the build')
+    parser.add_argument('--instrument', metavar='PREFIX',
+                        help='time the stages and write PREFIX.json and PREFIX.trace.json')
+    parser.add_argument('--profile', action='store_true',
+                        help='with --instrument, also profile the main process into PREFIX.prof')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='with --instrument, also report peak Python memory of the main process')
+    args = parser.parse_args()
+    if args.instrument:
+        instrument.enable(profile=args.profile, trace_memory=args.trace_memory)
+    rebuilt, failed = build(args.stages, force=args.force, jobs=args.jobs,
+                            stream=args.stream, use_cache=not args.no_cache,
+                            show_cache_stats=args.cache_stats)
+    if args.instrument:
+        instrument.disable()
+        instrument.save(args.instrument)
+        print(instrument.format_report(instrument.report()))
+    sys.exit(1 if failed else 0)
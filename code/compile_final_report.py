@@ -1,28 +1,13 @@
 
-import os
+import sys
 
-# The directory containing the markdown files
-directory = 'docs'
+from section_engine import build_section
 
-# The output markdown file
-output_file = 'docs/comprehensive_billing_system_research.md'
+# The section is described declaratively in section_specs.py; this script
+# is kept so it can still be run on its own.
 
-# A list of the files to process in order
-files_to_process = [
-    'payment_gateway_analysis.md',
-    'tax_compliance.md',
-    'billing_system_architecture.md',
-    'standards_and_frameworks.md',
-    'security_and_compliance.md',
-    'ui_ux_trends.md'
-]
+def compile_final_report(stream=False):
+    build_section('final_report', stream=stream)
 
-with open(output_file, 'w') as md_file:
-    md_file.write('# Comprehensive Research Analysis: Multi-Payment Gateway Billing System\n\n')
-
-    for filename in files_to_process:
-        filepath = os.path.join(directory, filename)
-        if os.path.exists(filepath):
-            with open(filepath, 'r') as section_file:
-                md_file.write(section_file.read())
-                md_file.write('\n\n')
+if __name__ == '__main__':
+    compile_final_report(stream='--stream' in sys.argv[1:])
@@ -0,0 +1,193 @@
+
+import re
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+from markdown_blocks import parse
+
+# Writes .docx files (WordprocessingML in a zip) from Markdown with the
+# standard library alone. render() turns one section of Markdown into the
+# XML of its paragraphs and tables plus the links they use; assemble()
+# puts rendered sections together into a document, each starting on a new
+# page. Rendered sections do not depend on each other, so the exporter can
+# cache them and only render the sections that changed.
+
+_w = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+_r = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_hyperlink_type = _r + '/hyperlink'
+
+# Characters XML 1.0 does not allow
+_invalid = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f￾￿]')
+
+# Heading level -> font size in half points
+_heading_sizes = {1: 36, 2: 30, 3: 26, 4: 24, 5: 22, 6: 22}
+
+# The zip entries get a fixed date so the same document always produces
+# the same bytes
+_date_time = (1980, 1, 1, 0, 0, 0)
+
+_content_types = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>
+<Override PartName="/docProps/core.xml" ContentType="application/vnd.openxmlformats-package.core-properties+xml"/>
+</Types>'''
+
+_package_rels = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties" Target="docProps/core.xml"/>
+</Relationships>'''
+
+_core = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" xmlns:dc="http://purl.org/dc/elements/1.1/">
+<dc:title>{title}</dc:title>
+</cp:coreProperties>'''
+
+
+def _styles():
+    headings = ''.join(
+        f'<w:style w:type="paragraph" w:styleId="Heading{level}"><w:name w:val="heading {level}"/>'
+        f'<w:basedOn w:val="Normal"/><w:next w:val="Normal"/><w:qFormat/>'
+        f'<w:pPr><w:keepNext/><w:spacing w:before="{360 - level * 30}" w:after="120"/>'
+        f'<w:outlineLvl w:val="{level - 1}"/></w:pPr>'
+        f'<w:rPr><w:b/><w:color w:val="1F3864"/><w:sz w:val="{size}"/></w:rPr></w:style>'
+        for level, size in _heading_sizes.items())
+    return (
+        f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<w:styles xmlns:w="{_w}">'
+        '<w:docDefaults><w:rPrDefault><w:rPr><w:rFonts w:ascii="Calibri" w:hAnsi="Calibri" w:cs="Calibri"/>'
+        '<w:sz w:val="21"/></w:rPr></w:rPrDefault>'
+        '<w:pPrDefault><w:pPr><w:spacing w:after="120" w:line="264" w:lineRule="auto"/></w:pPr></w:pPrDefault>'
+        '</w:docDefaults>'
+        '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/><w:qFormat/></w:style>'
+        + headings +
+        '<w:style w:type="paragraph" w:styleId="ListParagraph"><w:name w:val="List Paragraph"/>'
+        '<w:basedOn w:val="Normal"/><w:pPr><w:spacing w:after="60"/></w:pPr></w:style>'
+        '<w:style w:type="paragraph" w:styleId="Code"><w:name w:val="Code"/><w:basedOn w:val="Normal"/>'
+        '<w:pPr><w:shd w:val="clear" w:color="auto" w:fill="F2F2F2"/><w:spacing w:after="120" w:line="240" '
+        'w:lineRule="auto"/></w:pPr><w:rPr><w:rFonts w:ascii="Consolas" w:hAnsi="Consolas" w:cs="Consolas"/>'
+        '<w:sz w:val="17"/></w:rPr></w:style>'
+        '<w:style w:type="character" w:styleId="Hyperlink"><w:name w:val="Hyperlink"/>'
+        '<w:rPr><w:color w:val="0563C1"/><w:u w:val="single"/></w:rPr></w:style>'
+        '<w:style w:type="character" w:styleId="InlineCode"><w:name w:val="Inline Code"/>'
+        '<w:rPr><w:rFonts w:ascii="Consolas" w:hAnsi="Consolas" w:cs="Consolas"/><w:sz w:val="19"/></w:rPr></w:style>'
+        '<w:style w:type="table" w:styleId="TableGrid"><w:name w:val="Table Grid"/><w:tblPr><w:tblBorders>'
+        + ''.join(f'<w:{side} w:val="single" w:sz="4" w:space="0" w:color="A6A6A6"/>'
+                  for side in ['top', 'left', 'bottom', 'right', 'insideH', 'insideV']) +
+        '</w:tblBorders><w:tblCellMar><w:left w:w="80" w:type="dxa"/><w:right w:w="80" w:type="dxa"/>'
+        '</w:tblCellMar></w:tblPr></w:style>'
+        '</w:styles>')
+
+
+def _text(text):
+    return escape(_invalid.sub('', text))
+
+
+def _runs(block_runs, links):
+    xml = []
+    for text, bold, italic, code, link in block_runs:
+        properties = ''
+        if code:
+            properties += '<w:rStyle w:val="InlineCode"/>'
+        elif link:
+            properties += '<w:rStyle w:val="Hyperlink"/>'
+        if bold:
+            properties += '<w:b/>'
+        if italic:
+            properties += '<w:i/>'
+        run = (f'<w:r>{"<w:rPr>" + properties + "</w:rPr>" if properties else ""}'
+               f'<w:t xml:space="preserve">{_text(text)}</w:t></w:r>')
+        if link:
+            if link not in links:
+                links.append(link)
+            run = f'<w:hyperlink r:id="{{rid}}{links.index(link)}">{run}</w:hyperlink>'
+        xml.append(run)
+    return ''.join(xml)
+
+
+def _paragraph(style, content, properties=''):
+    style = f'<w:pStyle w:val="{style}"/>' if style else ''
+    return f'<w:p><w:pPr>{style}{properties}</w:pPr>{content}</w:p>'
+
+
+def render(markdown):
+    # -> (body XML, link targets). The XML refers to the i-th link as
+    # r:id="{rid}i", for assemble() to fill in.
+    xml = []
+    links = []
+    for block in parse(markdown):
+        kind = block[0]
+        if kind == 'heading':
+            xml.append(_paragraph(f'Heading{block[1]}', _runs(block[2], links)))
+        elif kind == 'paragraph':
+            xml.append(_paragraph(None, _runs(block[1], links)))
+        elif kind == 'item':
+            _, level, marker, item_runs = block
+            indent = f'<w:ind w:left="{360 * (level + 1)}" w:hanging="360"/>'
+            content = f'<w:r><w:t xml:space="preserve">{_text(marker)}</w:t><w:tab/></w:r>'
+            xml.append(_paragraph('ListParagraph', content + _runs(item_runs, links),
+                                  f'<w:tabs><w:tab w:val="left" w:pos="{360 * (level + 1)}"/></w:tabs>' + indent))
+        elif kind == 'code':
+            lines = '<w:br/>'.join(f'<w:t xml:space="preserve">{_text(line)}</w:t>' for line in block[2])
+            xml.append(_paragraph('Code', f'<w:r>{lines}</w:r>'))
+        elif kind == 'table':
+            rows = block[1]
+            columns = max(len(row) for row in rows)
+            width = 9000 // columns
+            grid = ''.join(f'<w:gridCol w:w="{width}"/>' for _ in range(columns))
+            table = [f'<w:tbl><w:tblPr><w:tblStyle w:val="TableGrid"/><w:tblW w:w="{width * columns}" '
+                     f'w:type="dxa"/></w:tblPr><w:tblGrid>{grid}</w:tblGrid>']
+            for number, row in enumerate(rows):
+                cells = row + [[]] * (columns - len(row))
+                header = '<w:trPr><w:tblHeader/></w:trPr>' if number == 0 else ''
+                table.append(f'<w:tr>{header}')
+                for cell in cells:
+                    if number == 0:
+                        cell = [(text, True) + tuple(rest) for text, _, *rest in cell]
+                    shading = '<w:shd w:val="clear" w:color="auto" w:fill="D9E2F3"/>' if number == 0 else ''
+                    paragraph = _paragraph(None, _runs(cell, links), '<w:spacing w:after="0"/>')
+                    table.append(f'<w:tc><w:tcPr><w:tcW w:w="{width}" w:type="dxa"/>{shading}</w:tcPr>'
+                                 f'{paragraph}</w:tc>')
+                table.append('</w:tr>')
+            table.append('</w:tbl>')
+            # Word needs a paragraph between consecutive tables
+            xml.append(''.join(table) + _paragraph(None, ''))
+        elif kind == 'rule':
+            xml.append(_paragraph(None, '', '<w:pBdr><w:bottom w:val="single" w:sz="6" w:space="1" '
+                                            'w:color="A6A6A6"/></w:pBdr>'))
+    return ''.join(xml), links
+
+
+def assemble(path, sections, title=''):
+    # sections: (key, rendering) per section, the key unique to the
+    # section's content
+    body = []
+    relationships = ['<Relationship Id="rIdStyles" Type="http://schemas.openxmlformats.org/officeDocument/'
+                     '2006/relationships/styles" Target="styles.xml"/>']
+    seen = set()
+    for number, (key, (xml, links)) in enumerate(sections):
+        rid = f'rIdL{key[:12]}n'
+        if number:
+            body.append('<w:p><w:r><w:br w:type="page"/></w:r></w:p>')
+        body.append(xml.replace('{rid}', rid))
+        for i, link in enumerate(links):
+            if rid + str(i) not in seen:
+                seen.add(rid + str(i))
+                relationships.append(f'<Relationship Id="{rid}{i}" Type="{_hyperlink_type}" '
+                                     f'Target={quoteattr(link)} TargetMode="External"/>')
+    document = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                f'<w:document xmlns:w="{_w}" xmlns:r="{_r}"><w:body>{"".join(body)}'
+                '<w:sectPr><w:pgSz w:w="12240" w:h="15840"/>'
+                '<w:pgMar w:top="1440" w:right="1440" w:bottom="1440" w:left="1440" w:header="720" '
+                'w:footer="720" w:gutter="0"/></w:sectPr></w:body></w:document>')
+    document_rels = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<Relationships xmlns="http://'
+                     f'schemas.openxmlformats.org/package/2006/relationships">{"".join(relationships)}'
+                     '</Relationships>')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as docx:
+        for name, data in [('[Content_Types].xml', _content_types), ('_rels/.rels', _package_rels),
+                           ('docProps/core.xml', _core.format(title=_text(title))),
+                           ('word/document.xml', document), ('word/_rels/document.xml.rels', document_rels),
+                           ('word/styles.xml', _styles())]:
+            docx.writestr(zipfile.ZipInfo(name, _date_time), data, zipfile.ZIP_DEFLATED)
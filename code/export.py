@@ -0,0 +1,142 @@
+
+import argparse
+import hashlib
+import marshal
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import docx_writer
+import instrument
+import pdf_writer
+from markdown_blocks import split_sections, title
+from section_specs import sections
+
+# Exports the final research report and design document to .docx and .pdf
+# with nothing but the standard library. Each
+# document is split at its top-level headings and every section is
+# rendered on its own; renderings are cached as marshal blobs named after
+# the sha256 of the section's text, the format and the exporter's code, so
+# after an edit only the sections that changed are rendered again and the
+# document is put together from the cached parts. marshal's format is tied
+# to the Python version, hence the version in the path.
+cache_dir = os.path.join('.cache', 'export', f'py{sys.version_info[0]}{sys.version_info[1]}')
+
+# The exports go to <output_dir>/<path of the markdown>, not next to the
+# markdown: the .docx and .pdf in docs/ and design/ are the published
+# deliverables, which these exports (standard fonts, no embedding, only
+# cp1252 text in the PDFs) do not replace until they have been approved
+output_dir = 'exports'
+
+# Documents exported, by their stage in section_specs.py
+documents = ['final_report', 'final_design']
+
+writers = {'docx': docx_writer, 'pdf': pdf_writer}
+
+# Code a rendering depends on; editing any of it renders every section again
+code_files = ['export.py', 'markdown_blocks.py', 'docx_writer.py', 'pdf_writer.py']
+
+_here = os.path.dirname(os.path.abspath(__file__))
+_code_digest = hashlib.sha256()
+for _filename in code_files:
+    with open(os.path.join(_here, _filename), 'rb') as _f:
+        _code_digest.update(_f.read())
+_code_digest = _code_digest.digest()
+
+
+def output_path(name, fmt):
+    return os.path.join(output_dir, os.path.splitext(sections[name]['output'])[0] + '.' + fmt)
+
+
+def _read_blob(path):
+    try:
+        with open(path, 'rb') as f:
+            return marshal.load(f)
+    except (OSError, ValueError, EOFError, TypeError):
+        return None
+
+
+def _write_blob(path, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        marshal.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def export(name, fmt, directory=None):
+    # Writes one document in one format; returns the number of sections and
+    # how many of them came from the cache
+    writer = writers[fmt]
+    with open(sections[name]['output'], 'r', encoding='utf-8') as f:
+        text = f.read()
+    # Each document and format has its own directory of blobs, which only
+    # keeps the sections of the latest export
+    section_dir = os.path.join(directory or cache_dir, fmt, name)
+    os.makedirs(section_dir, exist_ok=True)
+    parts = []
+    reused = 0
+    with instrument.stage('export', document=name, format=fmt) as timer:
+        chunks = split_sections(text)
+        # The title is the first heading, so parse only as far as the first
+        # section with one; every section after the first starts with one
+        document_title = next(filter(None, map(title, chunks)), '')
+        for section in chunks:
+            key = hashlib.sha256(_code_digest + fmt.encode() + section.encode('utf-8')).hexdigest()
+            blob = os.path.join(section_dir, key + '.marshal')
+            rendering = _read_blob(blob)
+            if rendering is None:
+                with instrument.stage('export.render', format=fmt):
+                    rendering = writer.render(section)
+                _write_blob(blob, rendering)
+            else:
+                reused += 1
+            parts.append((key, rendering))
+        timer.add(len(parts))
+        output = output_path(name, fmt)
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        tmp_path = f'{output}.{os.getpid()}.tmp'
+        with instrument.stage('export.assemble', format=fmt):
+            writer.assemble(tmp_path, parts, document_title)
+        os.replace(tmp_path, output)
+    current = {key + '.marshal' for key, _ in parts}
+    for filename in os.listdir(section_dir):
+        if filename not in current and not filename.endswith('.tmp'):
+            os.remove(os.path.join(section_dir, filename))
+    instrument.count('export.sections_reused', reused)
+    return len(parts), reused
+
+
+def export_all(names=None, formats=None, jobs=None):
+    # Exports every document in every format, in parallel
+    tasks = [(name, fmt) for name in names or documents for fmt in formats or writers]
+    failed = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {(name, fmt): pool.submit(export, name, fmt) for name, fmt in tasks}
+        for (name, fmt), future in futures.items():
+            try:
+                count, reused = future.result()
+                print(f'Exported {output_path(name, fmt)}: {count} sections, {reused} unchanged')
+            except Exception as e:
+                print(f'Error exporting {output_path(name, fmt)}: {e}')
+                failed.append((name, fmt))
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the final documents to DOCX and PDF.')
+    parser.add_argument('documents', nargs='*', help=f'documents to export: {", ".join(documents)} (default: all)')
+    parser.add_argument('--formats', default=','.join(writers),
+                        help='comma-separated formats (default: docx,pdf)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs)')
+    args = parser.parse_args()
+    formats = args.formats.split(',')
+    unknown = [name for name in args.documents if name not in documents] + [fmt for fmt in formats
+                                                                             if fmt not in writers]
+    if unknown:
+        parser.error(f'unknown documents or formats: {", ".join(unknown)}')
+    start = time.perf_counter()
+    failed = export_all(args.documents, formats, args.jobs)
+    print(f'Done in {time.perf_counter() - start:.2f}s')
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,261 @@
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import urllib.parse
+
+import build
+from http_pool import ConnectionPool, ProtocolError
+from section_engine import section_inputs
+from section_specs import sections
+
+# Refreshes search_results/*.json from the URLs in a sources manifest,
+# all files at once, so a refresh takes as long as the slowest host rather
+# than the sum of them:
+#
+#   {
+#     "base_url": "https://research.example.com/search_results/",
+#     "sources": {"stripe_api.json": "https://mirror.example.com/stripe.json"},
+#     "hosts": {"research.example.com": {"concurrency": 4, "interval": 0.25}}
+#   }
+#
+# Files without an entry in `sources` are fetched from base_url plus their
+# name, and by default every search_results input named in section_specs.py
+# is refreshed. `hosts` caps concurrent requests per host and spaces them
+# at least `interval` seconds apart. Redirects are followed, up to five of
+# them, and the response is cached under the URL first asked for.
+#
+# Responses are cached under .cache/http with their ETag and Last-Modified,
+# which are sent back as If-None-Match / If-Modified-Since next time, and
+# a Cache-Control max-age is honoured without asking at all. A file is only
+# rewritten when its content changed, and never with a body that is not
+# JSON, so an incremental build after a refresh redoes only what changed:
+#
+#   python code/fetch_sources.py sources.json --build
+
+cache_dir = os.path.join('.cache', 'http')
+
+_max_age_re = re.compile(r'max-age=(\d+)')
+
+# Statuses worth retrying, with backoff
+_transient = {408, 429, 500, 502, 503, 504}
+
+_redirects = {301, 302, 303, 307, 308}
+
+
+def default_files():
+    # The search_results inputs named in section_specs.py, wherever they
+    # are being written to
+    files = []
+    for spec in sections.values():
+        if spec['directory'] == 'search_results':
+            for path in section_inputs(spec):
+                if os.path.basename(path) not in files:
+                    files.append(os.path.basename(path))
+    return files
+
+
+def source_urls(manifest, files):
+    urls = {}
+    for filename in files:
+        if filename in manifest.get('sources', {}):
+            urls[filename] = manifest['sources'][filename]
+        elif 'base_url' in manifest:
+            urls[filename] = urllib.parse.urljoin(manifest['base_url'], filename)
+        else:
+            raise ValueError(f'No URL for {filename}: give it a source or set base_url')
+    return urls
+
+
+class ResponseCache:
+    # url -> validators and the sha256 of the body, kept in index.json,
+    # with the bodies stored by digest alongside
+
+    def __init__(self, directory=None):
+        self.directory = directory or cache_dir
+        self.index_file = os.path.join(self.directory, 'index.json')
+        self.index = {}
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'r') as f:
+                try:
+                    self.index = json.load(f)
+                except json.JSONDecodeError:
+                    print(f'Ignoring corrupt response cache index in {self.index_file}')
+
+    def _body_path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def is_fresh(self, url):
+        entry = self.index.get(url)
+        return entry is not None and entry.get('expires', 0) > time.time()
+
+    def validators(self, url):
+        entry = self.index.get(url)
+        headers = {}
+        if entry and os.path.exists(self._body_path(entry['digest'])):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def body(self, url):
+        entry = self.index.get(url)
+        try:
+            with open(self._body_path(entry['digest']), 'rb') as f:
+                return f.read()
+        except (TypeError, OSError):
+            return None
+
+    def refresh(self, url, response):
+        # A 304 may come with new caching headers
+        entry = self.index[url]
+        match = _max_age_re.search(response.headers.get('cache-control', ''))
+        entry['expires'] = time.time() + int(match.group(1)) if match else 0
+
+    def store(self, url, response):
+        cache_control = response.headers.get('cache-control', '')
+        if 'no-store' in cache_control:
+            return
+        digest = hashlib.sha256(response.body).hexdigest()
+        path = self._body_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _write_atomic(path, response.body)
+        match = _max_age_re.search(cache_control)
+        self.index[url] = {
+            'etag': response.headers.get('etag'),
+            'last_modified': response.headers.get('last-modified'),
+            'digest': digest,
+            'expires': time.time() + int(match.group(1)) if match else 0
+        }
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        _write_atomic(self.index_file, json.dumps(self.index, indent=2).encode())
+
+
+def _write_atomic(path, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _update(path, body):
+    # Writes `body` to `path` unless it already holds exactly that
+    if os.path.exists(path) and os.path.getsize(path) == len(body):
+        with open(path, 'rb') as f:
+            if f.read() == body:
+                return 'unchanged'
+    _write_atomic(path, body)
+    return 'updated'
+
+
+async def _get(pool, cache, url, max_redirects):
+    # Returns the response, following redirects; the validators are those
+    # cached for `url`, whichever URL the body finally came from. Still a
+    # redirect after `max_redirects` of them, it is returned as it is.
+    target = url
+    for _ in range(max_redirects):
+        response = await pool.request('GET', target, headers=cache.validators(url))
+        if response.status not in _redirects or 'location' not in response.headers:
+            return response
+        target = urllib.parse.urljoin(target, response.headers['location'])
+    return await pool.request('GET', target, headers=cache.validators(url))
+
+
+async def fetch_file(pool, cache, url, path, retries=3, backoff=0.5, revalidate=False, max_redirects=5):
+    # Returns 'updated', 'unchanged' or an error message
+    if not revalidate and cache.is_fresh(url) and cache.body(url) is not None:
+        return _update(path, cache.body(url))
+
+    error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(backoff * 2 ** (attempt - 1))
+        try:
+            response = await _get(pool, cache, url, max_redirects)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ProtocolError) as e:
+            error = f'{type(e).__name__}: {e}'
+            continue
+
+        if response.status == 304:
+            body = cache.body(url)
+            if body is not None:
+                cache.refresh(url, response)
+                return _update(path, body)
+            # The cached body went missing; ask again unconditionally
+            cache.index.pop(url, None)
+            error = '304 without a cached body'
+            continue
+        if response.status == 200:
+            try:
+                json.loads(response.body)
+            except ValueError as e:
+                return f'not JSON ({e})'
+            cache.store(url, response)
+            return _update(path, response.body)
+        error = f'HTTP {response.status} {response.reason}'
+        if response.status not in _transient:
+            break
+        if response.headers.get('retry-after', '').isdigit():
+            await asyncio.sleep(int(response.headers['retry-after']))
+    return error
+
+
+async def refresh(urls, directory='search_results', hosts=None, limit_per_host=4, retries=3,
+                  timeout=30.0, revalidate=False):
+    # urls: file name -> URL. Returns file name -> status.
+    os.makedirs(directory, exist_ok=True)
+    cache = ResponseCache()
+    async with ConnectionPool(limit_per_host=limit_per_host, timeout=timeout) as pool:
+        for host, limits in (hosts or {}).items():
+            pool.limit_host(host, limits.get('concurrency'), limits.get('interval'))
+        filenames = list(urls)
+        results = await asyncio.gather(*[
+            fetch_file(pool, cache, urls[filename], os.path.join(directory, filename),
+                       retries=retries, revalidate=revalidate)
+            for filename in filenames
+        ])
+    cache.save()
+    return dict(zip(filenames, results))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Refresh the search_results inputs over HTTP.')
+    parser.add_argument('manifest', help='sources manifest (JSON)')
+    parser.add_argument('files', nargs='*', help='only refresh these files')
+    parser.add_argument('--directory', default='search_results', help='where to write the files')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='concurrent requests per host not listed in the manifest (default: 4)')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=30.0, help='seconds per request')
+    parser.add_argument('--revalidate', action='store_true',
+                        help='ask the server even when a cached response is still fresh')
+    parser.add_argument('--build', action='store_true', help='run an incremental build afterwards')
+    args = parser.parse_args()
+
+    with open(args.manifest, 'r') as f:
+        manifest = json.load(f)
+    urls = source_urls(manifest, args.files or default_files())
+    start = time.perf_counter()
+    results = asyncio.run(refresh(urls, args.directory, manifest.get('hosts'), args.concurrency,
+                                  args.retries, args.timeout, args.revalidate))
+    for filename, status in results.items():
+        if status != 'unchanged':
+            print(f'{filename}: {status}')
+    failed = [filename for filename, status in results.items() if status not in ('updated', 'unchanged')]
+    updated = sum(status == 'updated' for status in results.values())
+    print(f'Refreshed {len(results)} files in {time.perf_counter() - start:.2f}s: '
+          f'{updated} updated, {len(results) - updated - len(failed)} unchanged, {len(failed)} failed')
+
+    if args.build:
+        rebuilt, build_failed = build.build()
+        failed += sorted(build_failed)
+    sys.exit(1 if failed else 0)
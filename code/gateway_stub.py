@@ -0,0 +1,184 @@
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
+
+from stub_server import StubServer
+
+# Stand-ins for the Stripe, Square and PayPal endpoints gateways.py uses,
+# for testing renewal runs offline. Each server answers all three APIs in
+# their own request and error formats and keeps an idempotency key ->
+# response table as the real ones do. Requests can be slowed down, and
+# with --lose-rate some responses are replaced by a 503 *after* the charge
+# was made, so retries that were not idempotent would charge twice.
+# server.charges and server.refunds record what actually happened. Tokens
+# containing 'declined' are declined.
+#
+#   python code/gateway_stub.py --port 8101 --delay 0.02 --lose-rate 0.05
+
+
+def _stripe_error(status, message, code):
+    return status, {'error': {'type': 'card_error' if status == 402 else 'invalid_request_error',
+                              'code': code, 'message': message}}
+
+
+def stripe_payment_intent(server, form, headers):
+    if 'declined' in form.get('payment_method', ''):
+        return _stripe_error(402, 'Your card was declined.', 'card_declined')
+    return 200, {'id': server.record('pi', int(form['amount'])), 'object': 'payment_intent',
+                 'amount': int(form['amount']), 'status': 'succeeded'}
+
+
+def stripe_refund(server, form, headers):
+    if form.get('payment_intent') not in server.charges:
+        return _stripe_error(404, 'No such payment_intent', 'resource_missing')
+    return 200, {'id': server.record_refund('re', form['payment_intent']), 'status': 'succeeded'}
+
+
+def square_payment(server, body, headers):
+    if 'declined' in body.get('source_id', ''):
+        return 400, {'errors': [{'category': 'PAYMENT_METHOD_ERROR', 'code': 'CARD_DECLINED',
+                                 'detail': 'Card declined.'}]}
+    amount = body['amount_money']['amount']
+    return 200, {'payment': {'id': server.record('sq', amount), 'status': 'COMPLETED',
+                             'amount_money': body['amount_money']}}
+
+
+def square_refund(server, body, headers):
+    if body.get('payment_id') not in server.charges:
+        return 404, {'errors': [{'category': 'INVALID_REQUEST_ERROR', 'code': 'NOT_FOUND',
+                                 'detail': 'Payment not found.'}]}
+    return 200, {'refund': {'id': server.record_refund('sqr', body['payment_id']), 'status': 'PENDING'}}
+
+
+def paypal_order(server, body, headers):
+    if 'declined' in body['payment_source']['token']['id']:
+        return 422, {'name': 'UNPROCESSABLE_ENTITY', 'message': 'The instrument was declined.',
+                     'details': [{'issue': 'INSTRUMENT_DECLINED'}]}
+    amount = round(float(body['purchase_units'][0]['amount']['value']) * 100)
+    capture = server.record('cap', amount)
+    return 201, {'id': f'order-{capture}', 'status': 'COMPLETED',
+                 'purchase_units': [{'payments': {'captures': [{'id': capture, 'status': 'COMPLETED'}]}}]}
+
+
+def paypal_refund(server, body, headers, capture):
+    if capture not in server.charges:
+        return 404, {'name': 'RESOURCE_NOT_FOUND', 'message': 'Capture not found.'}
+    return 201, {'id': server.record_refund('ref', capture), 'status': 'COMPLETED'}
+
+
+# (path pattern, handler, body format, where the idempotency key is)
+routes = [
+    (re.compile(r'/v1/payment_intents'), stripe_payment_intent, 'form', 'Idempotency-Key'),
+    (re.compile(r'/v1/refunds'), stripe_refund, 'form', 'Idempotency-Key'),
+    (re.compile(r'/v2/payments'), square_payment, 'json', 'idempotency_key'),
+    (re.compile(r'/v2/refunds'), square_refund, 'json', 'idempotency_key'),
+    (re.compile(r'/v2/checkout/orders'), paypal_order, 'json', 'PayPal-Request-Id'),
+    (re.compile(r'/v2/payments/captures/([\w-]+)/refund'), paypal_refund, 'json', 'PayPal-Request-Id'),
+]
+
+
+class GatewayServer(StubServer):
+
+    def __init__(self, address, delay=0.0, lose_rate=0.0, verbose=False):
+        super().__init__(address, GatewayHandler)
+        self.delay = delay
+        self.lose_rate = lose_rate
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.lost = 0
+        # transaction id -> amount, refund id -> transaction id
+        self.charges = {}
+        self.refunds = {}
+        # (path, idempotency key) -> (status, response)
+        self.responses = {}
+
+    def record(self, prefix, amount):
+        transaction_id = f'{prefix}_{len(self.charges) + 1:08d}'
+        self.charges[transaction_id] = amount
+        return transaction_id
+
+    def record_refund(self, prefix, transaction_id):
+        refund_id = f'{prefix}_{len(self.refunds) + 1:08d}'
+        self.refunds[refund_id] = transaction_id
+        return refund_id
+
+
+class GatewayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes, which Nagle's algorithm
+    # would hold back for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        server = self.server
+        raw = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(server.delay)
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            return self._reply(401, {'error': 'missing credentials'})
+        for pattern, handler, body_format, key_location in routes:
+            match = pattern.fullmatch(self.path)
+            if match:
+                break
+        else:
+            return self._reply(404, {'error': f'no route for {self.path}'})
+
+        if body_format == 'form':
+            body = dict(urllib.parse.parse_qsl(raw.decode()))
+        else:
+            body = json.loads(raw or b'{}')
+        key = self.headers.get(key_location) or body.get(key_location)
+        with server.lock:
+            server.requests += 1
+            response = server.responses.get((self.path, key)) if key else None
+            if response is None:
+                response = handler(server, body, self.headers, *match.groups())
+                if key:
+                    server.responses[self.path, key] = response
+            lost = random.random() < server.lose_rate
+            if lost:
+                server.lost += 1
+        if lost:
+            return self._reply(503, {'error': 'upstream timeout'})
+        self._reply(*response)
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def serve(port=0, delay=0.0, lose_rate=0.0, verbose=False):
+    # Starts a server in a background thread and returns it; its base URL
+    # is f'http://127.0.0.1:{server.server_port}'. Stop it with shutdown().
+    server = GatewayServer(('127.0.0.1', port), delay, lose_rate, verbose)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stand-in Stripe, Square and PayPal API for testing.')
+    parser.add_argument('--port', type=int, default=8101)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to wait before each response')
+    parser.add_argument('--lose-rate', type=float, default=0.0,
+                        help='fraction of responses replaced by a 503 after the request was processed')
+    args = parser.parse_args()
+    server = serve(args.port, args.delay, args.lose_rate, verbose=True)
+    print(f'Serving stand-in gateways on http://127.0.0.1:{server.server_port}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
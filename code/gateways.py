@@ -0,0 +1,264 @@
+
+import asyncio
+import collections
+import json
+import random
+import urllib.parse
+import uuid
+from abc import ABC, abstractmethod
+
+import instrument
+from http_pool import ConnectionPool, ProtocolError
+from tax_engine import from_cents
+
+# An asyncio version of the PaymentGateway adapters in
+# design/payment_gateway_integration.md. Amounts are integer cents, as in
+# tax_engine.py, rather than floats.
+#
+# Each gateway has its own keep-alive connection pool, and at most
+# `concurrency` requests in flight. Every charge and refund carries an
+# idempotency key, and retries reuse it, so a retry after a lost response
+# never charges twice. Pass a key derived from the invoice (say
+# 'renewal-<invoice id>') and a renewal run that is restarted is safe too.
+# Connection errors, timeouts, 409, 429 and 5xx are retried with jittered
+# exponential backoff; declines and other 4xx are not.
+#
+# charge_batch() pushes a whole renewal run through one gateway with a
+# fixed number of workers, and charge_across() runs batches on several
+# gateways at once. The base URLs can point at gateway_stub.py for testing.
+
+_retryable_statuses = {409, 429, 500, 502, 503, 504}
+
+ChargeResult = collections.namedtuple('ChargeResult', 'key transaction_id error')
+
+
+class GatewayError(Exception):
+
+    def __init__(self, message, status=None, retryable=False):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+class CardDeclined(GatewayError):
+    pass
+
+
+class PaymentGateway(ABC):
+    name = None
+    base_url = None
+
+    def __init__(self, api_key, base_url=None, currency='CAD', concurrency=16, timeout=30.0,
+                 retries=4, backoff=0.25):
+        self.api_key = api_key
+        self.base_url = (base_url or self.base_url).rstrip('/')
+        self.currency = currency
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.pool = ConnectionPool(limit_per_host=concurrency, timeout=timeout)
+        self.requests = 0
+        self.retried = 0
+
+    @abstractmethod
+    async def charge(self, amount, token, idempotency_key=None):
+        # Returns the transaction id to refund against
+        pass
+
+    @abstractmethod
+    async def refund(self, transaction_id, amount, idempotency_key=None):
+        # Returns whether the refund was accepted
+        pass
+
+    def _declined(self, status, body):
+        return status == 402
+
+    def _message(self, body):
+        return body.get('message')
+
+    async def _post(self, path, body, headers):
+        url = self.base_url + path
+        headers = dict(headers, Authorization=f'Bearer {self.api_key}')
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.retried += 1
+                instrument.count(f'gateway.{self.name}.retries')
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            self.requests += 1
+            try:
+                response = await self.pool.request('POST', url, headers, body, idempotent=True)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ProtocolError) as e:
+                error = GatewayError(f'{self.name}: {type(e).__name__}: {e}', retryable=True)
+                continue
+            try:
+                data = response.json() if response.body else {}
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                data = {}
+            if 200 <= response.status < 300:
+                return data
+            message = f'{self.name}: HTTP {response.status}: {self._message(data) or response.reason}'
+            if self._declined(response.status, data):
+                raise CardDeclined(message, response.status)
+            error = GatewayError(message, response.status, response.status in _retryable_statuses)
+            if not error.retryable:
+                raise error
+            if response.headers.get('retry-after', '').isdigit():
+                await asyncio.sleep(int(response.headers['retry-after']))
+        raise error
+
+    async def charge_batch(self, charges, workers=None):
+        # charges: (idempotency key, amount, token) triples. Returns a
+        # ChargeResult per charge, in order; failures are returned, not raised.
+        # Anything other than a GatewayError (a malformed response, a
+        # connection error) fails only its own charge, as a GatewayError
+        # caused by it, so the other workers go on and every charge gets a
+        # result.
+        charges = list(charges)
+        results = [None] * len(charges)
+        pending = iter(enumerate(charges))
+
+        async def worker():
+            for i, (key, amount, token) in pending:
+                try:
+                    results[i] = ChargeResult(key, await self.charge(amount, token, key), None)
+                except GatewayError as e:
+                    results[i] = ChargeResult(key, None, e)
+                except Exception as e:
+                    error = GatewayError(f'{self.name}: {type(e).__name__}: {e}')
+                    error.__cause__ = e
+                    results[i] = ChargeResult(key, None, error)
+
+        with instrument.stage('gateway.charge_batch', items=len(charges), gateway=self.name):
+            await asyncio.gather(*[worker() for _ in range(min(workers or self.concurrency, len(charges)))])
+        instrument.count(f'gateway.{self.name}.failed', sum(result.error is not None for result in results))
+        return results
+
+    async def close(self):
+        await self.pool.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class StripeGateway(PaymentGateway):
+    name = 'stripe'
+    base_url = 'https://api.stripe.com'
+
+    def _message(self, body):
+        error = body.get('error')
+        return error.get('message') if isinstance(error, dict) else error
+
+    async def charge(self, amount, token, idempotency_key=None):
+        body = urllib.parse.urlencode({
+            'amount': amount, 'currency': self.currency.lower(), 'payment_method': token,
+            'confirm': 'true', 'off_session': 'true'
+        }).encode()
+        data = await self._post('/v1/payment_intents', body, {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Idempotency-Key': idempotency_key or str(uuid.uuid4())
+        })
+        if data.get('status') != 'succeeded':
+            raise GatewayError(f'stripe: payment intent {data.get("id")} is {data.get("status")}')
+        return data['id']
+
+    async def refund(self, transaction_id, amount, idempotency_key=None):
+        body = urllib.parse.urlencode({'payment_intent': transaction_id, 'amount': amount}).encode()
+        data = await self._post('/v1/refunds', body, {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Idempotency-Key': idempotency_key or str(uuid.uuid4())
+        })
+        return data.get('status') in ('succeeded', 'pending')
+
+
+class SquareGateway(PaymentGateway):
+    name = 'square'
+    base_url = 'https://connect.squareup.com'
+    version = '2024-06-04'
+
+    def _declined(self, status, body):
+        return any(error.get('category') == 'PAYMENT_METHOD_ERROR' for error in body.get('errors', []))
+
+    def _message(self, body):
+        return '; '.join(error.get('detail', error.get('code', '')) for error in body.get('errors', []))
+
+    async def charge(self, amount, token, idempotency_key=None):
+        body = json.dumps({
+            'idempotency_key': idempotency_key or str(uuid.uuid4()),
+            'source_id': token,
+            'amount_money': {'amount': amount, 'currency': self.currency},
+            'autocomplete': True
+        }).encode()
+        data = await self._post('/v2/payments', body, {'Content-Type': 'application/json',
+                                                       'Square-Version': self.version})
+        payment = data.get('payment', {})
+        if payment.get('status') != 'COMPLETED':
+            raise GatewayError(f'square: payment {payment.get("id")} is {payment.get("status")}')
+        return payment['id']
+
+    async def refund(self, transaction_id, amount, idempotency_key=None):
+        body = json.dumps({
+            'idempotency_key': idempotency_key or str(uuid.uuid4()),
+            'payment_id': transaction_id,
+            'amount_money': {'amount': amount, 'currency': self.currency}
+        }).encode()
+        data = await self._post('/v2/refunds', body, {'Content-Type': 'application/json',
+                                                      'Square-Version': self.version})
+        return data.get('refund', {}).get('status') in ('PENDING', 'COMPLETED')
+
+
+class PayPalGateway(PaymentGateway):
+    # `api_key` is an OAuth access token for the REST API. Charges are
+    # orders captured in one call against a vaulted billing agreement; the
+    # capture id is returned, as that is what refunds are made against.
+    name = 'paypal'
+    base_url = 'https://api-m.paypal.com'
+
+    def _declined(self, status, body):
+        return status == 422 and any(detail.get('issue') == 'INSTRUMENT_DECLINED'
+                                     for detail in body.get('details', []))
+
+    def _message(self, body):
+        return body.get('message')
+
+    def _amount(self, amount):
+        return {'currency_code': self.currency, 'value': str(from_cents(amount))}
+
+    async def charge(self, amount, token, idempotency_key=None):
+        body = json.dumps({
+            'intent': 'CAPTURE',
+            'purchase_units': [{'amount': self._amount(amount)}],
+            'payment_source': {'token': {'id': token, 'type': 'BILLING_AGREEMENT'}}
+        }).encode()
+        data = await self._post('/v2/checkout/orders', body, {
+            'Content-Type': 'application/json',
+            'PayPal-Request-Id': idempotency_key or str(uuid.uuid4())
+        })
+        try:
+            capture = data['purchase_units'][0]['payments']['captures'][0]
+        except (KeyError, IndexError):
+            raise GatewayError(f'paypal: order {data.get("id")} is {data.get("status")}')
+        if capture.get('status') != 'COMPLETED':
+            raise GatewayError(f'paypal: capture {capture.get("id")} is {capture.get("status")}')
+        return capture['id']
+
+    async def refund(self, transaction_id, amount, idempotency_key=None):
+        body = json.dumps({'amount': self._amount(amount)}).encode()
+        data = await self._post(f'/v2/payments/captures/{transaction_id}/refund', body, {
+            'Content-Type': 'application/json',
+            'PayPal-Request-Id': idempotency_key or str(uuid.uuid4())
+        })
+        return data.get('status') in ('PENDING', 'COMPLETED')
+
+
+async def charge_across(batches, workers=None):
+    # batches: gateway -> charges, as for charge_batch(). All gateways run
+    # at once; returns gateway -> results.
+    gateways = list(batches)
+    results = await asyncio.gather(*[gateway.charge_batch(batches[gateway], workers) for gateway in gateways])
+    return dict(zip(gateways, results))
@@ -1,62 +1,270 @@
 
+import argparse
+import hashlib
+import json
 import os
+import sys
+import time
+
+# The system architecture diagram is drawn from a registry of components,
+# design/architecture_registry.json, which lists them in groups (each of a
+# kind: frontend, service, store or gateway) and the links between them.
+# It is rendered as a Mermaid chart in markdown and as PlantUML. The
+# components get the node ids A, B, C, ... in registry order.
+#
+# Each deployment can have its own diagram. A tenant in a batch.py
+# manifest may carry an "architecture" key,
+#
+#   "architecture": {"gateways": ["stripe", "paypal"], "without": ["data_warehouse"]}
+#
+# which keeps only the listed components of gateway groups and drops the
+# ones named in "without", along with their links and any group left
+# empty. Renderings are cached under the sha256 of the registry they were
+# drawn from and of this script, so deployments set up alike share one
+# rendering, and an output last written from the same registry is not
+# rewritten at all.
+
+registry_file = 'design/architecture_registry.json'
+
+# The output files
+output_file = 'design/system_architecture_diagram.md'
+plantuml_file = 'design/system_architecture_diagram.puml'
+outputs = {'mermaid': output_file, 'plantuml': plantuml_file}
+
+cache_dir = os.path.join('.cache', 'diagrams')
+
+# The PlantUML element each kind of group's components are drawn as
+_plantuml_elements = {'frontend': 'component', 'service': 'node', 'store': 'database', 'gateway': 'cloud'}
+
+with open(__file__, 'rb') as _f:
+    _code_digest = hashlib.sha256(_f.read()).digest()
+
+
+class RegistryError(ValueError):
+    pass
+
+
+def load_registry(path=None):
+    with open(path or registry_file, 'r') as f:
+        registry = json.load(f)
+    _node_ids(registry)
+    return registry
+
+
+def _letters(n):
+    # 0 -> 'A', 25 -> 'Z', 26 -> 'AA'
+    name = ''
+    n += 1
+    while n:
+        n, r = divmod(n - 1, 26)
+        name = chr(ord('A') + r) + name
+    return name
+
+
+def _node_ids(registry):
+    # Component id -> node id; also checks the registry is consistent
+    ids = {}
+    for group in registry['groups']:
+        if group.get('kind') not in _plantuml_elements:
+            raise RegistryError(f'Group {group["name"]!r} has unknown kind {group.get("kind")!r}')
+        for component in group['components']:
+            if component['id'] in ids:
+                raise RegistryError(f'Component {component["id"]!r} is listed twice')
+            ids[component['id']] = _letters(len(ids))
+    for link in registry['links']:
+        unknown = [end for end in link if end not in ids]
+        if unknown:
+            raise RegistryError(f'Link {link[0]} -> {link[1]} names unknown components: {", ".join(unknown)}')
+    return ids
+
+
+def render_mermaid(registry):
+    ids = _node_ids(registry)
+    lines = ['```mermaid', '', f'graph {registry.get("direction", "TD")}']
+    for group in registry['groups']:
+        lines.append(f'    subgraph {group["name"]}')
+        lines += [f'        {ids[component["id"]]}[{component["name"]}]' for component in group['components']]
+        lines += ['    end', '']
+    lines += [f'    {ids[source]} --> {ids[target]}' for source, target in registry['links']]
+    lines += ['', '```']
+    return '\n'.join(lines)
+
+
+def render_plantuml(registry):
+    ids = _node_ids(registry)
+    lines = ['@startuml', '!theme materia']
+    if registry.get('title'):
+        lines.append(f'title {registry["title"]}')
+    if registry.get('direction') == 'LR':
+        lines.append('left to right direction')
+    lines.append('')
+    for group in registry['groups']:
+        element = _plantuml_elements[group['kind']]
+        lines.append(f'package "{group["name"]}" {{')
+        lines += [f'  {element} "{component["name"]}" as {ids[component["id"]]}'
+                  for component in group['components']]
+        lines += ['}', '']
+    lines += [f'{ids[source]} --> {ids[target]}' for source, target in registry['links']]
+    lines.append('@enduml')
+    return '\n'.join(lines) + '\n'
+
+
+# format -> (renderer, suffix of cached renderings)
+renderers = {'mermaid': (render_mermaid, '.md'), 'plantuml': (render_plantuml, '.puml')}
+
+
+def deployment_registry(registry, config):
+    # The registry as drawn for one deployment's "architecture" settings
+    gateways = config.get('gateways')
+    without = set(config.get('without', []))
+    known = {component['id'] for group in registry['groups'] for component in group['components']}
+    unknown = (set(gateways or []) | without) - known
+    if unknown:
+        raise RegistryError(f'Unknown components: {", ".join(sorted(unknown))}')
+    groups = []
+    for group in registry['groups']:
+        components = [component for component in group['components'] if component['id'] not in without
+                      and (gateways is None or group['kind'] != 'gateway' or component['id'] in gateways)]
+        if components:
+            groups.append(dict(group, components=components))
+    kept = {component['id'] for group in groups for component in group['components']}
+    links = [link for link in registry['links'] if link[0] in kept and link[1] in kept]
+    deployment = dict(registry, groups=groups, links=links)
+    if 'title' in config:
+        deployment['title'] = config['title']
+    return deployment
+
+
+def registry_digest(registry, fmt):
+    text = json.dumps([fmt, registry], sort_keys=True)
+    return hashlib.sha256(_code_digest + text.encode()).hexdigest()
+
+
+def _write_atomic(path, text):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class DiagramCache:
+    # Renderings are kept as <digest>.md / <digest>.puml. The index maps
+    # each output path to the digest it was written from and the mtime and
+    # size it was left with, so an output that is still as written is
+    # skipped with one stat(). An edited or deleted output is rewritten.
+
+    def __init__(self, directory=None):
+        self.directory = directory or cache_dir
+        self.index_file = os.path.join(self.directory, 'outputs.json')
+        self.outputs = {}
+        self.memo = {}
+        self.rendered = 0
+        self.written = 0
+        self.unchanged = 0
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'r') as f:
+                try:
+                    self.outputs = json.load(f)
+                except json.JSONDecodeError:
+                    pass
+
+    def rendering(self, registry, fmt, digest=None):
+        digest = digest or registry_digest(registry, fmt)
+        text = self.memo.get(digest)
+        if text is None:
+            render, suffix = renderers[fmt]
+            path = os.path.join(self.directory, digest + suffix)
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    text = f.read()
+            else:
+                text = render(registry)
+                os.makedirs(self.directory, exist_ok=True)
+                _write_atomic(path, text)
+                self.rendered += 1
+            self.memo[digest] = text
+        return digest, text
+
+    def write(self, path, registry, fmt, digest=None):
+        # Writes the diagram of `registry` to `path` unless it is already
+        # there; returns whether it wrote
+        digest = digest or registry_digest(registry, fmt)
+        try:
+            st = os.stat(path)
+            if self.outputs.get(path) == [digest, st.st_mtime_ns, st.st_size]:
+                self.unchanged += 1
+                return False
+        except FileNotFoundError:
+            pass
+        digest, text = self.rendering(registry, fmt, digest)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+        st = os.stat(path)
+        self.outputs[path] = [digest, st.st_mtime_ns, st.st_size]
+        self.written += 1
+        return True
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        _write_atomic(self.index_file, json.dumps(self.outputs, sort_keys=True))
+
+
+def generate_architecture_diagram(cache=None, formats=None):
+    registry = load_registry()
+    diagrams = cache or DiagramCache()
+    for fmt in formats or outputs:
+        diagrams.write(outputs[fmt], registry, fmt)
+    if cache is None:
+        diagrams.save()
+
+
+def generate_deployments(tenants, output, cache=None):
+    # tenants: name -> manifest entry, as in batch.py. Writes each one's
+    # diagrams to <output>/<tenant>/design/ and returns the tenants whose
+    # settings did not fit the registry.
+    registry = load_registry()
+    diagrams = cache or DiagramCache()
+    failed = set()
+    # Settings -> (registry, digest per format), as most deployments share
+    # their settings with others
+    drawn = {}
+    for tenant, config in tenants.items():
+        settings = json.dumps(config.get('architecture', {}), sort_keys=True)
+        if settings not in drawn:
+            try:
+                deployment = deployment_registry(registry, config.get('architecture', {}))
+            except RegistryError as e:
+                print(f'Error drawing the architecture of {tenant}: {e}')
+                failed.add(tenant)
+                continue
+            drawn[settings] = deployment, {fmt: registry_digest(deployment, fmt) for fmt in outputs}
+        deployment, digests = drawn[settings]
+        for fmt, path in outputs.items():
+            diagrams.write(os.path.join(output, tenant, 'design', os.path.basename(path)), deployment, fmt,
+                           digests[fmt])
+    if cache is None:
+        diagrams.save()
+    return failed
 
-def generate_architecture_diagram():
-    mermaid_syntax = """
-graph TD
-    subgraph Frontend
-        A[Admin Portal]
-        B[User Portal]
-    end
-
-    subgraph Backend
-        C[API Gateway]
-        D[Billing Service]
-        E[Payment Gateway Service]
-        F[Tax Service]
-        G[Notification Service]
-        H[User Service]
-    end
-
-    subgraph Data Stores
-        I[Primary Database]
-        J[Cache]
-        K[Data Warehouse]
-    end
-
-    subgraph Third-Party Services
-        L[Stripe]
-        M[Square]
-        N[PayPal]
-        O[BTC Pay]
-        P[Web3]
-    end
-
-    A --> C
-    B --> C
-    C --> D
-    C --> E
-    C --> F
-    C --> G
-    C --> H
-    D --> I
-    D --> J
-    E --> L
-    E --> M
-    E --> N
-    E --> O
-    E --> P
-    F --> I
-    G --> I
-    H --> I
-    D --> K
-"""
-
-    output_file = 'design/system_architecture_diagram.md'
-    with open(output_file, 'w') as f:
-        f.write('```mermaid\n')
-        f.write(mermaid_syntax)
-        f.write('\n```')
 
 if __name__ == '__main__':
-    generate_architecture_diagram()
+    parser = argparse.ArgumentParser(description='Draw the architecture diagram from the component registry.')
+    parser.add_argument('--manifest', help='also draw one per tenant of this batch.py manifest (JSON)')
+    parser.add_argument('-o', '--output', help='output directory for --manifest (default: the manifest\'s, '
+                                               'or tenants/)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    cache = DiagramCache()
+    generate_architecture_diagram(cache)
+    failed = set()
+    if args.manifest:
+        with open(args.manifest, 'r') as f:
+            manifest = json.load(f)
+        failed = generate_deployments(manifest['tenants'], args.output or manifest.get('output', 'tenants'), cache)
+        print(f'{len(manifest["tenants"])} deployments: {cache.written} diagrams written '
+              f'({cache.rendered} rendered), {cache.unchanged} unchanged, in {time.perf_counter() - start:.2f}s')
+    cache.save()
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,190 @@
+
+import asyncio
+import json
+import ssl
+import urllib.parse
+
+# A small HTTP/1.1 client for asyncio. Connections are kept alive and
+# pooled per host, requests to one host are capped at `limit_per_host` at
+# a time and can be spaced at least `interval` seconds apart. The scripts
+# have no third-party dependencies and the standard library has no async
+# HTTP client, so this covers just what fetch_sources.py needs: plain
+# requests with Content-Length or chunked bodies over http and https.
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class Response:
+
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        # Header names are lower-cased; repeated headers are comma-joined
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+    def __repr__(self):
+        return f'<Response {self.status} {self.reason} ({len(self.body)} bytes)>'
+
+
+async def _read_chunked(reader):
+    parts = []
+    while True:
+        line = await reader.readline()
+        try:
+            size = int(line.split(b';')[0].strip(), 16)
+        except ValueError:
+            raise ProtocolError(f'Bad chunk size {line!r}')
+        if size == 0:
+            break
+        parts.append(await reader.readexactly(size))
+        await reader.readexactly(2)
+    # Trailers, if any
+    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+        pass
+    return b''.join(parts)
+
+
+async def _read_response(reader, method):
+    # Returns the response and whether the connection can be reused
+    line = await reader.readline()
+    if not line:
+        raise ConnectionResetError('Connection closed by the server')
+    try:
+        version, status, *reason = line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+        status = int(status)
+    except ValueError:
+        raise ProtocolError(f'Bad status line {line!r}')
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        value = value.strip()
+        headers[name] = f'{headers[name]}, {value}' if name in headers else value
+
+    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+    if method == 'HEAD' or status in (204, 304) or status < 200:
+        body = b''
+    elif 'chunked' in headers.get('transfer-encoding', '').lower():
+        body = await _read_chunked(reader)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    else:
+        body = await reader.read()
+        keep_alive = False
+    return Response(status, reason[0] if reason else '', headers, body), keep_alive
+
+
+class ConnectionPool:
+
+    def __init__(self, limit_per_host=4, interval=0.0, timeout=30.0, ssl_context=None):
+        self.limit_per_host = limit_per_host
+        self.interval = interval
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.connections_opened = 0
+        # host -> (limit, interval) overriding the defaults, set with
+        # limit_host() before the first request to that host
+        self._host_limits = {}
+        self._semaphores = {}
+        self._next_start = {}
+        self._idle = {}
+
+    def limit_host(self, host, limit=None, interval=None):
+        # `host` is the URL's host[:port] as written in the URL
+        self._host_limits[host] = (limit or self.limit_per_host,
+                                   self.interval if interval is None else interval)
+
+    async def request(self, method, url, headers=None, body=None, idempotent=None):
+        # A request that fails on a reused keep-alive connection is sent
+        # again on a new one, since the server may just have closed it while
+        # idle. It may also have acted on the request first, so that is only
+        # done for GET and HEAD, or when the caller says the request is
+        # idempotent (it carries an idempotency key, say).
+        if idempotent is None:
+            idempotent = method in ('GET', 'HEAD')
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f'Unsupported URL {url!r}')
+        host = parts.netloc.rpartition('@')[2]
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+        target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        limit, interval = self._host_limits.get(host, (self.limit_per_host, self.interval))
+        semaphore = self._semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._semaphores[host] = asyncio.Semaphore(limit)
+
+        lines = [f'{method} {target} HTTP/1.1', f'Host: {host}']
+        sent = {'user-agent': 'billing-docs', 'accept-encoding': 'identity'}
+        sent.update({name.lower(): value for name, value in (headers or {}).items()})
+        if body is not None:
+            sent['content-length'] = str(len(body))
+        lines += [f'{name}: {value}' for name, value in sent.items()]
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b'')
+
+        async with semaphore:
+            if interval:
+                loop = asyncio.get_running_loop()
+                now = loop.time()
+                start = max(now, self._next_start.get(host, now))
+                self._next_start[host] = start + interval
+                if start > now:
+                    await asyncio.sleep(start - now)
+            return await asyncio.wait_for(self._exchange(key, method, request, idempotent),
+                                          self.timeout)
+
+    async def _connect(self, key):
+        scheme, hostname, port = key
+        context = None
+        if scheme == 'https':
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            context = self.ssl_context
+        self.connections_opened += 1
+        return await asyncio.open_connection(hostname, port, ssl=context)
+
+    async def _exchange(self, key, method, request, idempotent):
+        idle = self._idle.setdefault(key, [])
+        while True:
+            reused = bool(idle)
+            reader, writer = idle.pop() if reused else await self._connect(key)
+            try:
+                writer.write(request)
+                await writer.drain()
+                response, keep_alive = await _read_response(reader, method)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                # The server may have dropped an idle connection; only a
+                # fresh one failing is an error
+                if reused and idempotent:
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                idle.append((reader, writer))
+            else:
+                writer.close()
+            return response
+
+    async def close(self):
+        for connections in self._idle.values():
+            for reader, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,265 @@
+
+import atexit
+import cProfile
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Stage timers, item counters and memory figures for the build and billing
+# code, off unless enabled. The hot paths are wrapped as
+#
+#   with instrument.stage('render', file=filename) as timer:
+#       ...
+#       timer.add(len(rows))
+#
+#   instrument.count('parse_cache.hits')
+#
+# and while disabled stage() returns a shared do-nothing object and
+# count() returns at once, so the wrapping costs a function call and can
+# stay in production code.
+#
+# enable() starts recording: each stage's calls, seconds and items (and so
+# items/s), every timed interval with its process and thread, the peak
+# RSS, and optionally a cProfile profile and tracemalloc's peak and top
+# allocation sites. save(prefix) writes
+#
+#   <prefix>.json        summary and counters, as report() returns them
+#   <prefix>.trace.json  every interval in the Chrome trace event format,
+#                        for chrome://tracing, Perfetto or speedscope
+#   <prefix>.prof        the cProfile stats, when profiling
+#
+# Setting INSTRUMENT=<prefix> in the environment enables it for any script
+# and saves on exit; INSTRUMENT_PROFILE=1 and INSTRUMENT_MEMORY=1 add the
+# profile and tracemalloc. Worker processes record on their own and hand
+# their data back with collect() for the parent to merge().
+
+enabled = False
+
+# Intervals beyond this many are only added to the totals, so a long run
+# cannot grow the trace without bound
+max_events = 1 << 20
+
+_lock = threading.Lock()
+
+
+class _Null:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add(self, items):
+        pass
+
+
+_null = _Null()
+
+
+class _Stage:
+    __slots__ = ('name', 'args', 'items', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.items = args.pop('items', 0)
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        _record(self.name, self.start, time.perf_counter_ns(), self.items, self.args)
+        return False
+
+    def add(self, items):
+        self.items += items
+
+
+def _empty():
+    return {'start': time.perf_counter_ns(), 'stages': {}, 'counters': {}, 'events': [], 'dropped': 0,
+            'profile': None, 'trace_memory': False}
+
+
+_state = _empty()
+
+
+def _record(name, start, end, items, args):
+    if not enabled:
+        return
+    with _lock:
+        totals = _state['stages'].get(name)
+        if totals is None:
+            totals = _state['stages'][name] = [0, 0, 0]
+        totals[0] += 1
+        totals[1] += end - start
+        totals[2] += items
+        if len(_state['events']) < max_events:
+            if items:
+                args = dict(args, items=items)
+            _state['events'].append((name, start, end - start, os.getpid(), threading.get_native_id(), args))
+        else:
+            _state['dropped'] += 1
+
+
+def stage(name, **args):
+    # Times the block as one interval of stage `name`. `items`, if given,
+    # is the number of things the block handles; the rest of the keyword
+    # arguments are shown with the interval in the trace.
+    if not enabled:
+        return _null
+    return _Stage(name, args)
+
+
+def count(name, value=1):
+    if not enabled:
+        return
+    with _lock:
+        _state['counters'][name] = _state['counters'].get(name, 0) + value
+
+
+def enable(profile=False, trace_memory=False):
+    # Starts recording afresh. cProfile only sees the calling thread.
+    global enabled
+    disable()
+    _state.clear()
+    _state.update(_empty())
+    if trace_memory:
+        tracemalloc.start()
+        _state['trace_memory'] = True
+    if profile:
+        _state['profile'] = cProfile.Profile()
+        _state['profile'].enable()
+    enabled = True
+
+
+def disable():
+    # Stops recording but keeps what was recorded for report() and save()
+    global enabled
+    enabled = False
+    if _state.get('profile') is not None:
+        _state['profile'].disable()
+
+
+def peak_rss(children=False):
+    # Peak resident set size in bytes, of this process or of its finished
+    # child processes (the largest of them), or None where unknown
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in kilobytes, except on macOS
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+
+def collect():
+    # This process's recording so far as plain data, for merge() in the
+    # parent process; recording starts afresh
+    with _lock:
+        data = {'stages': _state['stages'], 'counters': _state['counters'], 'events': _state['events'],
+                'dropped': _state['dropped'], 'pid': os.getpid(), 'peak_rss': peak_rss()}
+        _state.update(stages={}, counters={}, events=[], dropped=0)
+    return data
+
+
+def merge(data):
+    with _lock:
+        for name, (calls, nanoseconds, items) in data['stages'].items():
+            totals = _state['stages'].setdefault(name, [0, 0, 0])
+            totals[0] += calls
+            totals[1] += nanoseconds
+            totals[2] += items
+        for name, value in data['counters'].items():
+            _state['counters'][name] = _state['counters'].get(name, 0) + value
+        room = max_events - len(_state['events'])
+        _state['events'].extend(data['events'][:room])
+        _state['dropped'] += data['dropped'] + max(0, len(data['events']) - room)
+        workers = _state.setdefault('workers', {})
+        workers[data['pid']] = max(workers.get(data['pid']) or 0, data['peak_rss'] or 0)
+
+
+def report():
+    # Totals per stage and counter, and the memory figures
+    with _lock:
+        stages = {name: {'calls': calls, 'seconds': nanoseconds / 1e9, 'items': items,
+                         'items_per_second': items * 1e9 / nanoseconds if items and nanoseconds else None}
+                  for name, (calls, nanoseconds, items) in sorted(_state['stages'].items())}
+        result = {'wall_seconds': (time.perf_counter_ns() - _state['start']) / 1e9, 'stages': stages,
+                  'counters': dict(sorted(_state['counters'].items())),
+                  'peak_rss': peak_rss(), 'peak_rss_children': peak_rss(children=True),
+                  'peak_rss_workers': _state.get('workers', {}), 'dropped_events': _state['dropped']}
+    if _state['trace_memory'] and tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        result['python_memory'] = {'current': current, 'peak': peak, 'top': [
+            {'where': str(stat.traceback[0]), 'bytes': stat.size, 'blocks': stat.count}
+            for stat in tracemalloc.take_snapshot().statistics('lineno')[:10]]}
+    return result
+
+
+def chrome_trace():
+    # The intervals as Chrome trace 'complete' events, in microseconds
+    with _lock:
+        start = min([event[1] for event in _state['events']] + [_state['start']])
+        events = [{'name': name, 'ph': 'X', 'ts': (begin - start) / 1000, 'dur': duration / 1000,
+                   'pid': pid, 'tid': tid, 'args': args}
+                  for name, begin, duration, pid, tid, args in _state['events']]
+        pids = sorted({event['pid'] for event in events} | {os.getpid()})
+    for pid in pids:
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+                       'args': {'name': 'main' if pid == os.getpid() else f'worker {pid}'}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def save(prefix):
+    # Writes <prefix>.json, <prefix>.trace.json and, when profiling,
+    # <prefix>.prof; returns the paths written
+    paths = [f'{prefix}.json', f'{prefix}.trace.json']
+    with open(paths[0], 'w') as f:
+        json.dump(report(), f, indent=2)
+    with open(paths[1], 'w') as f:
+        json.dump(chrome_trace(), f)
+    if _state.get('profile') is not None:
+        _state['profile'].create_stats()
+        _state['profile'].dump_stats(f'{prefix}.prof')
+        paths.append(f'{prefix}.prof')
+    return paths
+
+
+def format_report(data):
+    lines = [f'{"stage":<32} {"calls":>8} {"seconds":>9} {"items":>10} {"items/s":>10}']
+    for name, totals in data['stages'].items():
+        rate = f'{totals["items_per_second"]:10.0f}' if totals['items_per_second'] else f'{"":>10}'
+        items = totals['items'] or ''
+        lines.append(f'{name:<32} {totals["calls"]:>8} {totals["seconds"]:9.3f} {items:>10} {rate}')
+    for name, value in data['counters'].items():
+        lines.append(f'{name:<32} {value:>8}')
+    for label, key in [('peak RSS', 'peak_rss'), ('peak RSS of workers', 'peak_rss_children')]:
+        if data.get(key):
+            lines.append(f'{label}: {data[key] / 2 ** 20:.1f} MB')
+    if 'python_memory' in data:
+        lines.append(f'peak Python memory: {data["python_memory"]["peak"] / 2 ** 20:.1f} MB')
+    return '\n'.join(lines)
+
+
+def _save_at_exit(prefix):
+    disable()
+    paths = save(prefix)
+    print(f'Instrumentation written to {", ".join(paths)}', file=sys.stderr)
+
+
+# Worker processes started by spawn import this module afresh; they are
+# left to report through collect()
+if os.environ.get('INSTRUMENT') and multiprocessing.parent_process() is None:
+    enable(profile=os.environ.get('INSTRUMENT_PROFILE') == '1',
+           trace_memory=os.environ.get('INSTRUMENT_MEMORY') == '1')
+    atexit.register(_save_at_exit, os.environ['INSTRUMENT'])
@@ -0,0 +1,268 @@
+
+import json
+import re
+
+# How much of the file to read at a time
+chunk_size = 1 << 16
+
+_decoder = json.JSONDecoder()
+_non_whitespace = re.compile(r'[^ \t\n\r]')
+_delimiter = re.compile(r'[\s,:\]}]')
+
+# The most of a value the end of a buffer can cut off and leave an error
+# short of the end: '-Infinit'
+_cut_short = 8
+
+
+class _Reader:
+    # A cursor over a JSON text file that only ever holds the current chunk
+    # plus whatever single value is being decoded.
+
+    def __init__(self, fp, position=(0, 0)):
+        self.fp = fp
+        self.seek(position)
+
+    def seek(self, position):
+        # Positions are (tell() cookie of a chunk, offset into that chunk),
+        # which is how a text file can be returned to mid-chunk
+        cookie, offset = position
+        self.fp.seek(cookie)
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        # (buffer index, cookie) for each chunk still in the buffer
+        self.chunks = []
+        self.fill()
+        self.pos = offset
+
+    def position(self):
+        for start, cookie in reversed(self.chunks):
+            if start <= self.pos:
+                return cookie, self.pos - start
+        raise AssertionError('cursor before the buffered chunks')
+
+    def fill(self):
+        cookie = self.fp.tell()
+        chunk = self.fp.read(chunk_size)
+        self.chunks = [(start - self.pos, c) for start, c in self.chunks if start - self.pos + chunk_size > 0]
+        self.buf = self.buf[self.pos:] + chunk
+        self.chunks.append((len(self.buf) - len(chunk), cookie))
+        self.pos = 0
+        if not chunk:
+            self.eof = True
+
+    def error(self, msg):
+        raise json.JSONDecodeError(msg, self.buf, self.pos)
+
+    def peek(self):
+        while True:
+            match = _non_whitespace.search(self.buf, self.pos)
+            if match:
+                self.pos = match.start()
+                return self.buf[self.pos]
+            self.pos = len(self.buf)
+            if self.eof:
+                return ''
+            self.fill()
+
+    def expect(self, char):
+        if self.peek() != char:
+            self.error(f'Expecting {char!r}')
+        self.pos += 1
+
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                # Only an unterminated string, or an error at the very end of
+                # the buffer, can be the value running on into the next
+                # chunk. Anything else is malformed input, reported without
+                # reading the rest of the file.
+                if self.eof or not (e.msg.startswith('Unterminated string')
+                                    or len(self.buf) - e.pos <= _cut_short):
+                    raise
+                self.fill()
+                continue
+            # A number cut off by the end of the buffer (`1.5` of `1.5e3`)
+            # still decodes, so only trust values followed by a delimiter
+            if not self.eof and not _delimiter.search(self.buf, end):
+                self.fill()
+                continue
+            self.pos = end
+            return value
+
+    def array_items(self):
+        # Yields once per item with the cursor on it; the caller must decode
+        # or skip the item before asking for the next one.
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            char = self.peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                self.pos -= 1
+                self.error("Expecting ',' delimiter")
+
+    def object_members(self):
+        # Like array_items, yielding each member's key
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            if self.peek() != '"':
+                self.error('Expecting property name enclosed in double quotes')
+            key = self.decode()
+            self.expect(':')
+            yield key
+            char = self.peek()
+            self.pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                self.pos -= 1
+                self.error("Expecting ',' delimiter")
+
+    def decode_buffered(self):
+        # Decodes the container at the cursor if it ends within the current
+        # buffer, so small containers are parsed in C without holding more
+        # than one chunk. Returns None, leaving the cursor put, otherwise.
+        try:
+            value, end = _decoder.raw_decode(self.buf, self.pos)
+        except json.JSONDecodeError:
+            return None
+        self.pos = end
+        return value
+
+    def skip(self):
+        # Steps over one value without materialising it whole, returning its
+        # truthiness the way the decoded value would have it. Array items
+        # are decoded and dropped one at a time, which is much faster than
+        # tokenising them here and only ever holds a single item.
+        char = self.peek()
+        if char in '[{':
+            value = self.decode_buffered()
+            if value is not None:
+                return bool(value)
+        if char == '[':
+            empty = True
+            for _ in self.array_items():
+                self.decode()
+                empty = False
+            return not empty
+        if char == '{':
+            empty = True
+            for _ in self.object_members():
+                self.skip()
+                empty = False
+            return not empty
+        return bool(self.decode())
+
+
+class _Container:
+
+    def __init__(self, fp, position, nonempty):
+        self._fp = fp
+        self._position = position
+        self._nonempty = nonempty
+
+    def __bool__(self):
+        return self._nonempty
+
+
+class LazyArray(_Container):
+    # A JSON array that is read back from the file one item at a time each
+    # time it is iterated
+
+    def __iter__(self):
+        reader = _Reader(self._fp, self._position)
+        for _ in reader.array_items():
+            yield reader.decode()
+
+
+class LazyObject(_Container):
+    # A JSON object whose scalar and small members are kept in memory and
+    # whose large array and object members are returned as lazy views onto
+    # the file
+
+    def __init__(self, fp, position, nonempty=True):
+        super().__init__(fp, position, nonempty)
+        self._members = None
+
+    def _scan(self, reader=None):
+        if self._members is not None:
+            return self._members
+        self._members = {}
+        if reader is None:
+            reader = _Reader(self._fp, self._position)
+        for key in reader.object_members():
+            char = reader.peek()
+            position = reader.position()
+            # Members small enough to decode within one chunk are kept as
+            # plain values, which saves re-reading the file for them
+            value = reader.decode_buffered() if char in '[{' else None
+            if value is not None:
+                self._members[key] = (None, value)
+            elif char == '[':
+                self._members[key] = (LazyArray, (position, reader.skip()))
+            elif char == '{':
+                self._members[key] = (LazyObject, (position, reader.skip()))
+            else:
+                self._members[key] = (None, reader.decode())
+        return self._members
+
+    def __contains__(self, key):
+        return key in self._scan()
+
+    def __getitem__(self, key):
+        kind, value = self._scan()[key]
+        if kind is None:
+            return value
+        return kind(self._fp, *value)
+
+    def get(self, key, default=None):
+        if key in self._scan():
+            return self[key]
+        return default
+
+    def __iter__(self):
+        return iter(self._scan())
+
+    def __len__(self):
+        return len(self._scan())
+
+    def keys(self):
+        return self._scan().keys()
+
+    def items(self):
+        reader = _Reader(self._fp, self._position)
+        for key in reader.object_members():
+            yield key, reader.decode()
+
+
+def load(fp):
+    # A drop-in for json.load() on an open, seekable text file for documents
+    # too big to hold in memory. Objects and arrays are returned as lazy
+    # views that stream their members from `fp`, so it must stay open while
+    # they are used. Iterating a view yields fully decoded members. The
+    # whole document is syntax-checked up front, so malformed input raises
+    # json.JSONDecodeError here, as json.load() would.
+    reader = _Reader(fp)
+    char = reader.peek()
+    if char == '{':
+        root = LazyObject(fp, reader.position())
+        root._nonempty = bool(root._scan(reader))
+    elif char == '[':
+        root = LazyArray(fp, reader.position(), reader.skip())
+    else:
+        root = reader.decode()
+    if reader.peek():
+        reader.error('Extra data')
+    return root
@@ -0,0 +1,161 @@
+
+import re
+
+# Just enough Markdown for the documents the compile scripts produce:
+# headings, paragraphs, nested bullet and numbered lists, fenced code,
+# pipe tables and rules, with **bold**, *italic*, `code` and [links](url)
+# inline. parse() turns a text into blocks, each a tuple whose first item
+# is its kind:
+#
+#   ('heading', level, runs)        ('paragraph', runs)
+#   ('item', level, marker, runs)   ('code', language, lines)
+#   ('table', rows of cells of runs) ('rule',)
+#
+# and runs are (text, bold, italic, code, link) tuples. The exporters
+# draw these; anything else is kept as plain text.
+
+_heading = re.compile(r'(#{1,6})\s+(.*?)\s*#*\s*$')
+_item = re.compile(r'( *)([-*+]|\d+[.)])\s+(.*)')
+_rule = re.compile(r'\s{0,3}([-*_])(\s*\1){2,}\s*$')
+_table_rule = re.compile(r'\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$')
+_inline = re.compile(r'`([^`]+)`|\*\*(.+?)\*\*|__(.+?)__|\*(?![\s*])(.+?)\*|\[([^\]]+)\]\(([^)\s]+)[^)]*\)')
+
+
+def runs(text, bold=False, italic=False, link=None):
+    result = []
+    position = 0
+    for match in _inline.finditer(text):
+        if match.start() > position:
+            result.append((text[position:match.start()], bold, italic, False, link))
+        code, strong, strong2, emphasis, label, url = match.groups()
+        if code is not None:
+            result.append((code, bold, italic, True, link))
+        elif strong is not None or strong2 is not None:
+            result += runs(strong if strong is not None else strong2, True, italic, link)
+        elif emphasis is not None:
+            result += runs(emphasis, bold, True, link)
+        else:
+            result += runs(label, bold, italic, url)
+        position = match.end()
+    if position < len(text):
+        result.append((text[position:], bold, italic, False, link))
+    return result
+
+
+def plain(block_runs):
+    return ''.join(run[0] for run in block_runs)
+
+
+def _cells(line):
+    line = line.strip()
+    if line.startswith('|'):
+        line = line[1:]
+    if line.endswith('|'):
+        line = line[:-1]
+    return [runs(cell.strip()) for cell in line.split('|')]
+
+
+def parse(text):
+    blocks = []
+    lines = text.split('\n')
+    # The block that a following non-blank line continues, as
+    # [kind, ..., text]; None after a blank line or a block that cannot be
+    # continued
+    open_block = None
+    indents = []
+
+    def close():
+        nonlocal open_block
+        if open_block is not None:
+            kind = open_block[0]
+            if kind == 'paragraph':
+                blocks.append(('paragraph', runs(open_block[1])))
+            else:
+                blocks.append(('item', open_block[1], open_block[2], runs(open_block[3])))
+            open_block = None
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+        i += 1
+        if not stripped:
+            close()
+            continue
+        if stripped.startswith('```'):
+            close()
+            indents = []
+            language = stripped[3:].strip()
+            code = []
+            while i < len(lines) and not lines[i].strip().startswith('```'):
+                code.append(lines[i])
+                i += 1
+            i += 1
+            blocks.append(('code', language, code))
+            continue
+        heading = _heading.match(line)
+        if heading:
+            close()
+            indents = []
+            blocks.append(('heading', len(heading.group(1)), runs(heading.group(2))))
+            continue
+        if stripped.startswith('|') and i < len(lines) and _table_rule.match(lines[i]):
+            close()
+            indents = []
+            rows = [_cells(line)]
+            i += 1
+            while i < len(lines) and lines[i].strip().startswith('|'):
+                rows.append(_cells(lines[i]))
+                i += 1
+            blocks.append(('table', rows))
+            continue
+        if _rule.match(line):
+            close()
+            blocks.append(('rule',))
+            continue
+        item = _item.match(line)
+        if item:
+            close()
+            indent = len(item.group(1))
+            while indents and indent < indents[-1]:
+                indents.pop()
+            if not indents or indent > indents[-1]:
+                indents.append(indent)
+            marker = '•' if item.group(2) in '-*+' else item.group(2)
+            open_block = ['item', len(indents) - 1, marker, item.group(3)]
+            continue
+        if open_block is not None:
+            open_block[-1] += ' ' + stripped
+            continue
+        if not line.startswith(' '):
+            indents = []
+        open_block = ['paragraph', stripped]
+    close()
+    return blocks
+
+
+def title(text):
+    # The text of the first heading
+    for block in parse(text):
+        if block[0] == 'heading':
+            return plain(block[2])
+    return ''
+
+
+def split_sections(text):
+    # The text cut before each top-level heading outside fenced code; the
+    # exporters start each piece on a new page
+    sections = []
+    start = 0
+    position = 0
+    fenced = False
+    for line in text.splitlines(keepends=True):
+        if line.lstrip().startswith('```'):
+            fenced = not fenced
+        elif not fenced and line.startswith('# ') and position > start and text[start:position].strip():
+            sections.append(text[start:position])
+            start = position
+        position += len(line)
+    if text[start:].strip():
+        sections.append(text[start:])
+    return sections
@@ -0,0 +1,93 @@
+
+import functools
+import os
+import shutil
+
+# checkpoint() writes the buffer out once it holds this many fragments, so
+# streamed sections are written in big batches with bounded memory
+flush_parts = 1 << 16
+
+
+@functools.lru_cache(maxsize=None)
+def humanize(key):
+    # 'registration_threshold' -> 'Registration Threshold'. The same keys
+    # repeat across thousands of records, so the result is memoized.
+    return key.replace('_', ' ').title()
+
+
+class SectionWriter:
+    # A drop-in for `open(path, 'w')` in the compile scripts that collects
+    # write() fragments in a list and writes them out in one go on close,
+    # instead of going through the file layer once per bullet. write() is
+    # the list's own append, so buffering a fragment costs no Python call.
+
+    def __init__(self, path):
+        self.parts = []
+        self.write = self.parts.append
+        self.file = open(path, 'w')
+
+    def checkpoint(self):
+        # Called between records when streaming large inputs
+        if len(self.parts) >= flush_parts:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            self.file.write(''.join(self.parts))
+            self.parts.clear()
+
+    def copy_file(self, path):
+        # Appends the file at `path` byte for byte, copied by the kernel
+        # from one file to the other without passing through Python, and
+        # returns the (offset, length) it landed at in the output
+        self.flush()
+        self.file.flush()
+        fd = self.file.fileno()
+        offset = os.lseek(fd, 0, os.SEEK_CUR)
+        with open(path, 'rb') as source:
+            length = os.fstat(source.fileno()).st_size
+            _copy(source, fd, length)
+        # Move the text layer's notion of the position past the copy
+        self.file.seek(0, os.SEEK_END)
+        return offset, length
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _copy_file_range(source, fd, count):
+    return os.copy_file_range(source.fileno(), fd, count)
+
+
+def _sendfile(source, fd, count):
+    return os.sendfile(fd, source.fileno(), None, count)
+
+
+# In order of preference; copy_file_range() also needs Linux 4.5+ and
+# fails with OSError on some filesystem pairs
+_kernel_copies = [copy for copy, name in [(_copy_file_range, 'copy_file_range'), (_sendfile, 'sendfile')]
+                  if hasattr(os, name)]
+
+
+def _copy(source, fd, length):
+    # Each fallback continues from wherever the previous one left `source`
+    remaining = length
+    for copy in _kernel_copies:
+        try:
+            while remaining > 0:
+                copied = copy(source, fd, remaining)
+                if copied == 0:
+                    return
+                remaining -= copied
+            return
+        except OSError:
+            continue
+    with open(fd, 'wb', closefd=False) as target:
+        shutil.copyfileobj(source, target)
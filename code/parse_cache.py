@@ -0,0 +1,226 @@
+
+import argparse
+import contextlib
+import hashlib
+import json
+import marshal
+import mmap
+import os
+import sys
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Parsed search_results files are kept here as marshal blobs. marshal is
+# the fastest (de)serialiser for the plain dicts, lists and strings that
+# JSON produces, but its format is tied to the Python version, hence the
+# version in the path.
+cache_dir = os.path.join('.cache', 'parsed', f'py{sys.version_info[0]}{sys.version_info[1]}')
+
+# The blobs are evicted, least recently used first, beyond this size
+max_bytes = 256 << 20
+
+
+@contextlib.contextmanager
+def locked(directory):
+    # Holds an exclusive lock on <directory>/index.lock, so the processes
+    # sharing a cache read, merge and replace its index one at a time.
+    # Without fcntl (Windows) the index is not locked.
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'index.lock'), 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def write_index(path, index):
+    tmp_file = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_file, path)
+
+
+class ParseCache:
+    # Blobs are named after the sha256 of the JSON file they were parsed
+    # from, so identical or touched-but-unchanged files share a blob. The
+    # index maps each input path to the (mtime, size, sha256) it had when
+    # last seen, which lets a warm lookup skip reading the JSON file at all.
+    # A lost or stale index entry only costs re-hashing the file; it never
+    # serves the wrong data.
+
+    def __init__(self, directory=None, max_size=None):
+        self.directory = directory or cache_dir
+        self.max_size = max_bytes if max_size is None else max_size
+        self.index_file = os.path.join(self.directory, 'index.json')
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.dirty = False
+        self.index = {'paths': {}, 'blobs': {}, 'stats': {'hits': 0, 'misses': 0, 'evictions': 0}}
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'r') as f:
+                try:
+                    self.index = json.load(f)
+                except json.JSONDecodeError:
+                    print(f'Ignoring corrupt parse cache index in {self.index_file}')
+
+    def _blob_path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest + '.marshal')
+
+    def _read_blob(self, digest):
+        try:
+            with open(self._blob_path(digest), 'rb') as f:
+                # marshal reads straight out of the page cache
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as blob:
+                    return marshal.loads(blob)
+        except (OSError, ValueError, EOFError, TypeError):
+            return None
+
+    def _write_blob(self, digest, data):
+        path = self._blob_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        blob = marshal.dumps(data)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(blob)
+        os.replace(tmp_path, path)
+        return len(blob)
+
+    def load(self, path):
+        # Returns what json.load() would for `path`, raising
+        # json.JSONDecodeError the same way for malformed files
+        st = os.stat(path)
+        known = self.index['paths'].get(path)
+        if known and known[0] == st.st_mtime_ns and known[1] == st.st_size:
+            data = self._read_blob(known[2])
+            if data is not None:
+                self._hit(known[2])
+                return data
+
+        with open(path, 'rb') as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        self.index['paths'][path] = [st.st_mtime_ns, st.st_size, digest]
+        self.dirty = True
+        data = self._read_blob(digest)
+        if data is not None:
+            self._hit(digest)
+            return data
+
+        data = json.loads(raw)
+        self.misses += 1
+        self.index['blobs'][digest] = [self._write_blob(digest, data), time.time()]
+        self._evict()
+        return data
+
+    def _hit(self, digest):
+        self.hits += 1
+        entry = self.index['blobs'].get(digest)
+        if entry is None:
+            # Written by another process since this index was loaded
+            try:
+                entry = self.index['blobs'][digest] = [os.path.getsize(self._blob_path(digest)), 0]
+            except OSError:
+                return
+        entry[1] = time.time()
+        self.dirty = True
+
+    def size(self):
+        return sum(size for size, last_used in self.index['blobs'].values())
+
+    def _evict(self):
+        total = self.size()
+        for digest, (size, last_used) in sorted(self.index['blobs'].items(), key=lambda item: item[1][1]):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(self._blob_path(digest))
+            except FileNotFoundError:
+                pass
+            del self.index['blobs'][digest]
+            total -= size
+            self.evictions += 1
+
+    def save(self):
+        # Several build workers may share the cache, so merge with whatever
+        # the others saved in the meantime rather than overwriting it, under
+        # the lock so no two merges interleave
+        if not self.dirty and not (self.hits or self.misses):
+            return
+        with locked(self.directory):
+            on_disk = ParseCache(self.directory, self.max_size).index
+            for digest, entry in on_disk['blobs'].items():
+                mine = self.index['blobs'].get(digest)
+                if mine is None:
+                    if os.path.exists(self._blob_path(digest)):
+                        self.index['blobs'][digest] = entry
+                else:
+                    mine[1] = max(mine[1], entry[1])
+            # Blobs another process evicted
+            for digest in [digest for digest in self.index['blobs'] if digest not in on_disk['blobs']]:
+                if not os.path.exists(self._blob_path(digest)):
+                    del self.index['blobs'][digest]
+            for path, entry in on_disk['paths'].items():
+                self.index['paths'].setdefault(path, entry)
+            stats = on_disk['stats']
+            self.index['stats'] = {
+                'hits': stats['hits'] + self.hits,
+                'misses': stats['misses'] + self.misses,
+                'evictions': stats['evictions'] + self.evictions
+            }
+            self._evict()
+            write_index(self.index_file, self.index)
+        self.hits = self.misses = self.evictions = 0
+        self.dirty = False
+
+    def stats(self):
+        stats = self.index['stats']
+        return {
+            'entries': len(self.index['blobs']),
+            'bytes': self.size(),
+            'max_bytes': self.max_size,
+            'hits': stats['hits'] + self.hits,
+            'misses': stats['misses'] + self.misses,
+            'evictions': stats['evictions'] + self.evictions
+        }
+
+    def clear(self):
+        # Writes the empty index directly: save() would merge the old
+        # entries and statistics back in
+        with locked(self.directory):
+            on_disk = ParseCache(self.directory, self.max_size).index
+            for digest in set(self.index['blobs']) | set(on_disk['blobs']):
+                try:
+                    os.remove(self._blob_path(digest))
+                except FileNotFoundError:
+                    pass
+            self.index = {'paths': {}, 'blobs': {}, 'stats': {'hits': 0, 'misses': 0, 'evictions': 0}}
+            write_index(self.index_file, self.index)
+        self.hits = self.misses = self.evictions = 0
+        self.dirty = False
+
+
+def format_stats(stats):
+    lookups = stats['hits'] + stats['misses']
+    hit_rate = stats['hits'] / lookups if lookups else 0.0
+    return (f'Parse cache: {stats["entries"]} entries, '
+            f'{stats["bytes"] / 1024:.0f} KB of {stats["max_bytes"] / 1024:.0f} KB, '
+            f'{stats["hits"]} hits, {stats["misses"]} misses ({hit_rate:.0%} hit rate), '
+            f'{stats["evictions"]} evictions')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect or clear the parsed JSON cache.')
+    parser.add_argument('--clear', action='store_true', help='remove every cached blob')
+    parser.add_argument('--json', action='store_true', help='print the statistics as JSON')
+    args = parser.parse_args()
+    cache = ParseCache()
+    if args.clear:
+        cache.clear()
+    if args.json:
+        print(json.dumps(cache.stats(), indent=2))
+    else:
+        print(format_stats(cache.stats()))
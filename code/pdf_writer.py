@@ -0,0 +1,361 @@
+
+import re
+import zlib
+
+from markdown_blocks import parse, plain
+
+# Writes PDF files from Markdown with the standard library alone, using the
+# fonts every PDF reader has built in (Helvetica and Courier), so nothing
+# has to be embedded. render() lays out one section of Markdown on pages
+# of its own; assemble() puts rendered sections together into a document
+# with page numbers and an outline of the headings. Rendered sections do
+# not depend on each other, so the exporter can cache them and only render
+# the sections that changed.
+
+# US Letter, in points, with one inch margins
+page_width = 612
+page_height = 792
+margin = 72
+_top = page_height - margin
+_bottom = margin
+_text_width = page_width - 2 * margin
+
+# Font resource -> base font. F1-F4 are Helvetica regular, bold, oblique
+# and bold oblique; F5 is Courier, for code.
+_fonts = {'F1': 'Helvetica', 'F2': 'Helvetica-Bold', 'F3': 'Helvetica-Oblique',
+          'F4': 'Helvetica-BoldOblique', 'F5': 'Courier'}
+
+# Advance widths of ' ' to '~' in thousandths of the font size, from the
+# Adobe font metrics; the oblique faces have the same widths as upright
+_helvetica = (
+    '278 278 355 556 556 889 667 191 333 333 389 584 278 333 278 278 556 556 556 556 556 556 556 556 556 556 '
+    '278 278 584 584 584 556 1015 667 667 722 722 667 611 778 722 278 500 667 556 833 722 778 667 778 722 667 '
+    '611 722 667 944 667 667 611 278 278 278 469 556 333 556 556 500 556 556 278 556 556 222 222 500 222 833 '
+    '556 556 556 556 333 500 278 556 500 722 500 500 500 334 260 334 584')
+_helvetica_bold = (
+    '278 333 474 556 556 889 722 238 333 333 389 584 278 333 278 278 556 556 556 556 556 556 556 556 556 556 '
+    '333 333 584 584 584 611 975 722 722 722 722 667 611 778 722 278 556 722 611 833 722 778 667 778 722 667 '
+    '611 722 667 944 667 667 611 333 278 333 584 556 333 556 611 556 611 556 333 611 611 278 278 556 278 889 '
+    '611 611 611 611 389 556 333 611 556 778 556 556 500 389 280 389 584')
+
+
+def _width_table(widths, extra):
+    table = {chr(32 + i): int(width) for i, width in enumerate(widths.split())}
+    table.update(extra)
+    return table
+
+
+_regular_widths = _width_table(_helvetica, {'•': 350, '–': 556, '—': 1000, '‘': 222, '’': 222, '“': 333,
+                                            '”': 333, '…': 1000, 'é': 556})
+_bold_widths = _width_table(_helvetica_bold, {'•': 350, '–': 556, '—': 1000, '‘': 278, '’': 278, '“': 500,
+                                              '”': 500, '…': 1000, 'é': 556})
+_widths = {'F1': _regular_widths, 'F2': _bold_widths, 'F3': _regular_widths, 'F4': _bold_widths}
+
+# The fonts use WinAnsiEncoding (cp1252); anything outside it is spelled
+# out where there is an obvious way, else drawn as '?'
+_spelled_out = str.maketrans({'≤': '<=', '≥': '>=', '→': '->', '←': '<-', '✓': 'v', '×': 'x', '\t': '    '})
+
+_body_size = 10
+_body_leading = 13
+_code_size = 8.5
+_code_leading = 10.5
+_table_size = 9
+_table_leading = 11
+_heading_sizes = {1: 20, 2: 16, 3: 13}
+_indent = 18
+
+_link_colour = '0.02 0.39 0.76 rg'
+_heading_colour = '0.12 0.22 0.39 rg'
+
+
+def _encode(text):
+    return text.translate(_spelled_out).encode('cp1252', 'replace').decode('latin-1')
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)').replace('\r', '')
+
+
+def _width(text, font, size):
+    if font == 'F5':
+        return len(text) * 600 * size / 1000
+    widths = _widths[font]
+    return sum(widths.get(char, 556) for char in text) * size / 1000
+
+
+def _pieces(block_runs, size, bold=False):
+    # Runs -> [text, font, size, link] word and space pieces
+    pieces = []
+    for text, run_bold, italic, code, link in block_runs:
+        if code:
+            font, piece_size = 'F5', size * 0.95
+        else:
+            font = 'F' + str(1 + (bold or run_bold) + 2 * italic)
+            piece_size = size
+        for part in re.findall(r'\S+|\s+', _encode(text)):
+            pieces.append([' ' if part.isspace() else part, font, piece_size, link])
+    return pieces
+
+
+def _wrap(pieces, width):
+    # Greedy line filling; a word wider than a whole line is cut
+    lines = []
+    line = []
+    used = 0
+    for text, font, size, link in pieces:
+        if text == ' ':
+            if line:
+                line.append([text, font, size, link])
+                used += _width(text, font, size)
+            continue
+        word_width = _width(text, font, size)
+        if line and used + word_width > width:
+            while line and line[-1][0] == ' ':
+                line.pop()
+            lines.append(line)
+            line, used = [], 0
+        while word_width > width:
+            cut = len(text)
+            while cut > 1 and _width(text[:cut], font, size) > width:
+                cut -= 1
+            lines.append([[text[:cut], font, size, link]])
+            text = text[cut:]
+            word_width = _width(text, font, size)
+        line.append([text, font, size, link])
+        used += word_width
+    while line and line[-1][0] == ' ':
+        line.pop()
+    if line:
+        lines.append(line)
+    return lines
+
+
+class _Layout:
+
+    def __init__(self):
+        self.pages = []
+        self.outline = []
+        self._new_page()
+
+    def _new_page(self):
+        self.ops = []
+        self.links = []
+        self.pages.append((self.ops, self.links))
+        self.y = _top
+
+    def room(self, height):
+        # Starts a new page unless `height` more points fit on this one
+        if self.y - height < _bottom and self.y < _top:
+            self._new_page()
+
+    def space(self, height):
+        if self.y < _top:
+            self.y -= height
+
+    def line(self, pieces, x, leading, colour=None):
+        self.room(leading)
+        self.y -= leading
+        self.draw(pieces, x, self.y + leading * 0.25, colour)
+
+    def draw(self, pieces, x, baseline, colour=None):
+        # Neighbouring pieces in the same style are drawn as one string
+        merged = []
+        for text, font, size, link in pieces:
+            if merged and merged[-1][1:] == [font, size, link]:
+                merged[-1][0] += text
+            else:
+                merged.append([text, font, size, link])
+        for text, font, size, link in merged:
+            width = _width(text, font, size)
+            fill = _link_colour if link else colour
+            self.ops.append(f'{fill + " " if fill else ""}BT /{font} {size:g} Tf {x:.2f} {baseline:.2f} Td '
+                            f'({_escape(text)}) Tj ET{" 0 g" if fill else ""}\n')
+            if link:
+                self.links.append((round(x, 2), round(baseline - 2, 2), round(x + width, 2),
+                                   round(baseline + size, 2), link))
+            x += width
+
+    def flow(self, pieces, x, leading, colour=None):
+        for line in _wrap(pieces, margin + _text_width - x):
+            self.line(line, x, leading, colour)
+
+    def heading(self, level, block_runs):
+        size = _heading_sizes.get(level, 11)
+        leading = size * 1.3
+        self.space(size * 0.8)
+        # Keep a heading with at least two lines of what follows it
+        self.room(leading + 2 * _body_leading)
+        self.outline.append((level, plain(block_runs), len(self.pages) - 1, round(self.y, 2)))
+        self.flow(_pieces(block_runs, size, bold=True), margin, leading, _heading_colour)
+        self.y -= 4
+
+    def code(self, lines):
+        columns = int(_text_width // (_code_size * 0.6)) - 1
+        self.space(2)
+        for source in lines:
+            source = _encode(source.rstrip())
+            for start in range(0, max(len(source), 1), columns):
+                self.room(_code_leading)
+                self.y -= _code_leading
+                self.ops.append(f'0.95 g {margin - 4} {self.y:.2f} {_text_width + 8} {_code_leading} re f 0 g\n'
+                                f'BT /F5 {_code_size:g} Tf {margin} {self.y + 2.8:.2f} Td '
+                                f'({_escape(source[start:start + columns])}) Tj ET\n')
+        self.y -= 8
+
+    def table(self, rows):
+        columns = max(len(row) for row in rows)
+        rows = [row + [[]] * (columns - len(row)) for row in rows]
+        natural = [8 + max(_width(_encode(plain(row[i])), 'F2', _table_size) for row in rows)
+                   for i in range(columns)]
+        total = sum(natural)
+        widths = natural if total <= _text_width else [_text_width * width / total for width in natural]
+        self.space(2)
+        for number, row in enumerate(rows):
+            cells = [_wrap(_pieces(cell, _table_size, bold=number == 0), width - 8)
+                     for cell, width in zip(row, widths)]
+            height = max(len(lines) for lines in cells) * _table_leading + 6
+            self.room(height)
+            top = self.y
+            x = margin
+            for lines, width in zip(cells, widths):
+                if number == 0:
+                    self.ops.append(f'0.85 0.89 0.95 rg {x:.2f} {top - height:.2f} {width:.2f} {height} re f 0 g\n')
+                self.ops.append(f'0.65 G 0.5 w {x:.2f} {top - height:.2f} {width:.2f} {height} re S 0 G\n')
+                self.y = top - 3
+                for line in lines:
+                    self.y -= _table_leading
+                    self.draw(line, x + 4, self.y + _table_leading * 0.25)
+                x += width
+            self.y = top - height
+        self.y -= 8
+
+
+def render(markdown):
+    # -> (pages, outline): pages as (zlib-compressed content stream,
+    # links as (x1, y1, x2, y2, url)), and the headings as (level, title,
+    # page, y) with the page counted from the section's first
+    layout = _Layout()
+    for block in parse(markdown):
+        kind = block[0]
+        if kind == 'heading':
+            layout.heading(block[1], block[2])
+        elif kind == 'paragraph':
+            layout.flow(_pieces(block[1], _body_size), margin, _body_leading)
+            layout.y -= 6
+        elif kind == 'item':
+            _, level, marker, item_runs = block
+            x = margin + _indent * (level + 1)
+            layout.room(_body_leading)
+            layout.ops.append(f'BT /F1 {_body_size} Tf {x - 12 if marker == "•" else x - 16:.2f} '
+                              f'{layout.y - _body_leading * 0.75:.2f} Td ({_escape(_encode(marker))}) Tj ET\n')
+            layout.flow(_pieces(item_runs, _body_size), x, _body_leading)
+            layout.y -= 2
+        elif kind == 'code':
+            layout.code(block[2])
+        elif kind == 'table':
+            layout.table(block[1])
+        elif kind == 'rule':
+            layout.room(12)
+            layout.y -= 6
+            layout.ops.append(f'0.65 G 0.5 w {margin} {layout.y:.2f} m {margin + _text_width} {layout.y:.2f} l S 0 G\n')
+            layout.y -= 6
+    pages = [(zlib.compress(''.join(ops).encode('latin-1'), 6), tuple(links)) for ops, links in layout.pages]
+    return pages, layout.outline
+
+
+def _text_string(text):
+    # PDF text strings outside content streams, as UTF-16BE
+    return '<FEFF' + text.encode('utf-16-be').hex().upper() + '>'
+
+
+def assemble(path, sections, title=''):
+    # sections: (key, rendering) per section
+    objects = {}
+    page_count = sum(len(pages) for _, (pages, _) in sections)
+    font_ids = {}
+    next_id = 5
+    for name, base in _fonts.items():
+        objects[next_id] = (f'<< /Type /Font /Subtype /Type1 /BaseFont /{base} '
+                            f'{"/Encoding /WinAnsiEncoding " if name != "F5" else ""}>>').encode()
+        font_ids[name] = next_id
+        next_id += 1
+    fonts = ' '.join(f'/{name} {object_id} 0 R' for name, object_id in font_ids.items())
+    page_ids = []
+    outline = []
+    for _, (pages, headings) in sections:
+        first = len(page_ids)
+        for stream, links in pages:
+            page_id, content_id, footer_id = next_id, next_id + 1, next_id + 2
+            next_id += 3
+            page_ids.append(page_id)
+            footer = f'Page {len(page_ids)} of {page_count}'
+            x = (page_width - _width(footer, 'F1', 8)) / 2
+            objects[footer_id] = _stream(f'0.4 g BT /F1 8 Tf {x:.2f} 40 Td ({footer}) Tj ET 0 g'.encode())
+            objects[content_id] = _stream(stream, compressed=True)
+            annotations = []
+            for x1, y1, x2, y2, url in links:
+                objects[next_id] = (f'<< /Type /Annot /Subtype /Link /Rect [{x1:g} {y1:g} {x2:g} {y2:g}] '
+                                    f'/Border [0 0 0] /A << /S /URI /URI ({_escape(_encode(url))}) >> >>').encode()
+                annotations.append(f'{next_id} 0 R')
+                next_id += 1
+            annots = f' /Annots [{" ".join(annotations)}]' if annotations else ''
+            objects[page_id] = (f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width} {page_height}] '
+                                f'/Resources << /Font << {fonts} >> >> /Contents [{content_id} 0 R {footer_id} 0 R]'
+                                f'{annots} >>').encode()
+        outline += [(level, text, first + page, y) for level, text, page, y in headings]
+
+    # The outline, as a tree nesting each heading under the last one
+    # of a higher level
+    items = []
+    stack = [{'id': 3, 'children': [], 'level': 0}]
+    for level, text, page, y in outline:
+        while stack[-1]['level'] >= level:
+            stack.pop()
+        item = {'id': next_id, 'children': [], 'level': level, 'text': text, 'page': page, 'y': y,
+                'parent': stack[-1]}
+        next_id += 1
+        stack[-1]['children'].append(item)
+        stack.append(item)
+        items.append(item)
+    for item in items:
+        siblings = item['parent']['children']
+        position = siblings.index(item)
+        fields = [f'/Title {_text_string(item["text"])}', f'/Parent {item["parent"]["id"]} 0 R',
+                  f'/Dest [{page_ids[item["page"]]} 0 R /XYZ {margin} {item["y"]:g} 0]']
+        if position:
+            fields.append(f'/Prev {siblings[position - 1]["id"]} 0 R')
+        if position + 1 < len(siblings):
+            fields.append(f'/Next {siblings[position + 1]["id"]} 0 R')
+        if item['children']:
+            fields.append(f'/First {item["children"][0]["id"]} 0 R /Last {item["children"][-1]["id"]} 0 R '
+                          f'/Count -{_descendants(item)}')
+        objects[item['id']] = f'<< {" ".join(fields)} >>'.encode()
+    top = stack[0]['children']
+    objects[3] = (f'<< /Type /Outlines /First {top[0]["id"]} 0 R /Last {top[-1]["id"]} 0 R /Count {len(top)} >>'
+                  if top else '<< /Type /Outlines /Count 0 >>').encode()
+    objects[1] = b'<< /Type /Catalog /Pages 2 0 R /Outlines 3 0 R /PageMode /UseOutlines >>'
+    objects[2] = (f'<< /Type /Pages /Kids [{" ".join(f"{page_id} 0 R" for page_id in page_ids)}] '
+                  f'/Count {len(page_ids)} >>').encode()
+    objects[4] = f'<< /Title {_text_string(title)} /Producer (pdf_writer.py) >>'.encode()
+
+    output = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(output)
+        output += b'%d 0 obj\n' % object_id + objects[object_id] + b'\nendobj\n'
+    xref = len(output)
+    output += b'xref\n0 %d\n0000000000 65535 f \n' % (next_id)
+    for object_id in range(1, next_id):
+        output += b'%010d 00000 n \n' % offsets[object_id]
+    output += b'trailer\n<< /Size %d /Root 1 0 R /Info 4 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (next_id, xref)
+    with open(path, 'wb') as f:
+        f.write(output)
+
+
+def _descendants(item):
+    return sum(1 + _descendants(child) for child in item['children'])
+
+
+def _stream(data, compressed=False):
+    return (b'<< /Length %d%s >>\nstream\n' % (len(data), b' /Filter /FlateDecode' if compressed else b'')
+            + data + b'\nendstream')
@@ -0,0 +1,407 @@
+
+import argparse
+import datetime
+import decimal
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+
+import instrument
+
+# Exports the billing entities of design/database_schema.md as linked data,
+# as described in design/extensible_ontology_framework.md: every tenant,
+# user, product, subscription, invoice and payment gets the URI
+# <base_uri><table>/<id> and is described with the ontology's classes and
+# properties (and FOAF and Dublin Core terms where they fit), in Turtle,
+# N-Triples or JSON-LD.
+#
+# Each tenant is exported to its own file, by its own worker process, so a
+# nightly dump of tens of millions of triples is spread over the CPUs. A
+# worker reads one table at a time through a cursor, `chunk_size` rows at
+# a time, and writes each chunk as soon as it is serialized; nothing but
+# the current chunk is held in memory. All of a tenant's tables are read
+# in one transaction, so its file is a consistent snapshot.
+#
+# An incremental export only writes the entities whose updated_at is at or
+# after the start of the last export for that tenant and format, recorded
+# in the rdf_exports table once its file is complete. Rows written during
+# an export are thus picked up by the next one, possibly twice, which the
+# graph store does not mind: a changed entity is always written out whole,
+# so the loader can replace every triple of its subject. Deleted rows are
+# not reported, as the schema keeps no trace of them.
+
+base_uri = 'https://api.example.com/'
+
+chunk_size = 1000
+
+prefixes = {
+    '': f'{base_uri}ontology#',
+    'foaf': 'http://xmlns.com/foaf/0.1/',
+    'dcterms': 'http://purl.org/dc/terms/',
+    'xsd': 'http://www.w3.org/2001/XMLSchema#',
+}
+
+# Table -> its class, how its rows belong to a tenant and the property each
+# column is exported as, with the column's kind: 'string', 'decimal',
+# 'dateTime', 'mailto', or the table a foreign key points to. Columns
+# missing from the database are left out, as are password hashes.
+entities = {
+    'tenants': {
+        'class': ':Tenant',
+        'from': 'tenants t',
+        'tenant': 't.id',
+        'properties': {
+            'name': ('foaf:name', 'string'),
+        },
+    },
+    'users': {
+        'class': ':User',
+        'from': 'users t',
+        'tenant': 't.tenant_id',
+        'properties': {
+            'tenant_id': (':tenant', 'tenants'),
+            'email': ('foaf:mbox', 'mailto'),
+            'first_name': ('foaf:firstName', 'string'),
+            'last_name': ('foaf:lastName', 'string'),
+            'region': (':taxRegion', 'string'),
+        },
+    },
+    'products': {
+        'class': ':Product',
+        'from': 'products t',
+        'tenant': 't.tenant_id',
+        'properties': {
+            'tenant_id': (':tenant', 'tenants'),
+            'name': ('foaf:name', 'string'),
+            'description': ('dcterms:description', 'string'),
+            'price': (':price', 'decimal'),
+            'currency': (':currency', 'string'),
+        },
+    },
+    'subscriptions': {
+        'class': ':Subscription',
+        'from': 'subscriptions t JOIN users u ON u.id = t.user_id',
+        'tenant': 'u.tenant_id',
+        'properties': {
+            'user_id': (':subscriber', 'users'),
+            'product_id': (':product', 'products'),
+            'status': (':status', 'string'),
+            'trial_ends_at': (':trialEndsAt', 'dateTime'),
+            'starts_at': (':startsAt', 'dateTime'),
+            'ends_at': (':endsAt', 'dateTime'),
+        },
+    },
+    'invoices': {
+        'class': ':Invoice',
+        'from': 'invoices t JOIN users u ON u.id = t.user_id',
+        'tenant': 'u.tenant_id',
+        'properties': {
+            'user_id': (':customer', 'users'),
+            'subscription_id': (':subscription', 'subscriptions'),
+            'status': (':status', 'string'),
+            'total': (':total', 'decimal'),
+            'tax': (':tax', 'decimal'),
+            'currency': (':currency', 'string'),
+            'due_at': (':dueAt', 'dateTime'),
+            'paid_at': (':paidAt', 'dateTime'),
+        },
+    },
+    'payments': {
+        'class': ':Payment',
+        'from': 'payments t JOIN invoices i ON i.id = t.invoice_id JOIN users u ON u.id = i.user_id',
+        'tenant': 'u.tenant_id',
+        'properties': {
+            'invoice_id': (':invoice', 'invoices'),
+            'payment_gateway': (':paymentGateway', 'string'),
+            'transaction_id': (':transactionId', 'string'),
+            'amount': (':amount', 'decimal'),
+            'currency': (':currency', 'string'),
+            'status': (':status', 'string'),
+        },
+    },
+}
+
+# Every table's timestamps
+_timestamps = {
+    'created_at': ('dcterms:created', 'dateTime'),
+    'updated_at': ('dcterms:modified', 'dateTime'),
+}
+
+formats = {'turtle': '.ttl', 'ntriples': '.nt', 'jsonld': '.jsonld'}
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS rdf_exports (
+    tenant_id TEXT NOT NULL,
+    format TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    triples INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (tenant_id, format)
+)
+'''
+
+# Escapes for string literals, the same in Turtle and N-Triples
+_escapes = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r'})
+
+_plain_re = re.compile(r'[\w.~-]+', re.ASCII)
+
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def _expand(name):
+    # 'foaf:name' -> 'http://xmlns.com/foaf/0.1/name'
+    prefix, local = name.split(':', 1)
+    return prefixes[prefix] + local
+
+
+def _uri(table, id):
+    id = str(id)
+    # UUIDs and other plain ids need no escaping, and quote() is slow
+    if not _plain_re.fullmatch(id):
+        id = quote(id, safe='')
+    return f'{base_uri}{table}/{id}'
+
+
+def _term(name, fmt):
+    # A class or property as written in `fmt`
+    if fmt == 'ntriples':
+        return f'<{_expand(name)}>'
+    if fmt == 'jsonld':
+        return name[1:] if name.startswith(':') else name
+    return name
+
+
+def _datetime(value):
+    # Timestamps are text ('2025-06-01 00:00:00'), but a TIMESTAMP column
+    # may hold a Unix time written by something else
+    if isinstance(value, str):
+        return value.replace(' ', 'T', 1)
+    if isinstance(value, (int, float)):
+        return datetime.datetime.fromtimestamp(value, datetime.timezone.utc).isoformat()
+    return str(value)
+
+
+def _decimal(value):
+    # str() writes small and large floats with an exponent, which
+    # xsd:decimal does not allow
+    if isinstance(value, float):
+        return format(decimal.Decimal(repr(value)), 'f')
+    return str(value)
+
+
+def _object(kind, fmt):
+    # -> function writing a column value as an object term of `fmt`
+    datatype = {'decimal': 'xsd:decimal', 'dateTime': 'xsd:dateTime'}.get(kind)
+    if fmt == 'jsonld':
+        if kind == 'string':
+            return str
+        if kind == 'mailto':
+            return lambda value: {'@id': f'mailto:{quote(value, safe="@+")}'}
+        if datatype:
+            convert = _datetime if kind == 'dateTime' else _decimal
+            return lambda value: {'@value': convert(value), '@type': datatype}
+        return lambda value: {'@id': _uri(kind, value)}
+    if kind == 'string':
+        return lambda value: f'"{str(value).translate(_escapes)}"'
+    if kind == 'mailto':
+        return lambda value: f'<mailto:{quote(value, safe="@+")}>'
+    if datatype:
+        suffix = f'^^{_term(datatype, fmt)}'
+        convert = _datetime if kind == 'dateTime' else _decimal
+        return lambda value: f'"{convert(value)}"{suffix}'
+    return lambda value: f'<{_uri(kind, value)}>'
+
+
+def _columns(connection, table):
+    # The exported columns of `table` that the database has, or None if
+    # it has no such table
+    present = {row[1] for row in connection.execute(f'PRAGMA table_info({table})')}
+    if not present:
+        return None
+    properties = entities[table]['properties'] | _timestamps
+    return [column for column in properties if column in present]
+
+
+def _serializer(table, columns, fmt):
+    # -> function(row) returning (text, triples) for a row of
+    # (id, *columns); empty columns are left out
+    entity = entities[table]
+    properties = entity['properties'] | _timestamps
+    objects = [(i, _term(properties[column][0], fmt), _object(properties[column][1], fmt))
+               for i, column in enumerate(columns, 1)]
+    type_term = _term(entity['class'], fmt)
+
+    if fmt == 'jsonld':
+        def serialize(row):
+            node = {'@id': _uri(table, row[0]), '@type': type_term}
+            for i, predicate, convert in objects:
+                value = row[i]
+                if value is not None and value != '':
+                    node[predicate] = convert(value)
+            return _encoder.encode(node), len(node) - 1
+    elif fmt == 'ntriples':
+        rdf_type = '<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>'
+
+        def serialize(row):
+            subject = f'<{_uri(table, row[0])}>'
+            lines = [f'{subject} {rdf_type} {type_term} .\n']
+            for i, predicate, convert in objects:
+                value = row[i]
+                if value is not None and value != '':
+                    lines.append(f'{subject} {predicate} {convert(value)} .\n')
+            return ''.join(lines), len(lines)
+    else:
+        def serialize(row):
+            parts = [f'<{_uri(table, row[0])}> a {type_term}']
+            for i, predicate, convert in objects:
+                value = row[i]
+                if value is not None and value != '':
+                    parts.append(f'{predicate} {convert(value)}')
+            return ' ;\n    '.join(parts) + ' .\n\n', len(parts)
+    return serialize
+
+
+def _header(fmt):
+    if fmt == 'turtle':
+        return ''.join(f'@prefix {prefix}: <{uri}> .\n' for prefix, uri in prefixes.items()) + '\n'
+    if fmt == 'jsonld':
+        context = {'@vocab': prefixes['']} | {prefix: uri for prefix, uri in prefixes.items() if prefix}
+        return f'{{"@context":{json.dumps(context, separators=(",", ":"))},"@graph":[\n'
+    return ''
+
+
+def _connect(database):
+    # Autocommit mode, so export_tenant() can hold a read transaction
+    connection = sqlite3.connect(database, timeout=60, isolation_level=None)
+    connection.execute('PRAGMA query_only = ON')
+    return connection
+
+
+def export_tenant(database, tenant_id, path, fmt='turtle', since=None):
+    # Writes the entities of one tenant (those updated at or after `since`,
+    # if given) to `path`; -> (entities, triples). Runs in the workers.
+    connection = _connect(database)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    counts = [0, 0]
+    try:
+        connection.execute('BEGIN')
+        with open(tmp_path, 'w', encoding='utf-8', buffering=1 << 20) as f:
+            f.write(_header(fmt))
+            separator = ''
+            for table, entity in entities.items():
+                columns = _columns(connection, table)
+                if columns is None:
+                    continue
+                serialize = _serializer(table, columns, fmt)
+                sql = (f'SELECT t.id, {", ".join(f"t.{column}" for column in columns)} '
+                       f'FROM {entity["from"]} WHERE {entity["tenant"]} = ?')
+                parameters = [tenant_id]
+                if since is not None:
+                    sql += ' AND t.updated_at >= ?'
+                    parameters.append(since)
+                cursor = connection.execute(sql, parameters)
+                while True:
+                    with instrument.stage('rdf.select', table=table) as timer:
+                        rows = cursor.fetchmany(chunk_size)
+                        timer.add(len(rows))
+                    if not rows:
+                        break
+                    with instrument.stage('rdf.serialize', items=len(rows)):
+                        texts = []
+                        for row in rows:
+                            text, triples = serialize(row)
+                            texts.append(text)
+                            counts[1] += triples
+                        counts[0] += len(rows)
+                    if fmt == 'jsonld':
+                        f.write(separator + ',\n'.join(texts))
+                        separator = ',\n'
+                    else:
+                        f.writelines(texts)
+            if fmt == 'jsonld':
+                f.write('\n]}\n')
+        os.replace(tmp_path, path)
+    finally:
+        connection.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return tuple(counts)
+
+
+def tenants(database):
+    connection = _connect(database)
+    try:
+        return [row[0] for row in connection.execute('SELECT id FROM tenants ORDER BY id')]
+    finally:
+        connection.close()
+
+
+def export(database, output, fmt='turtle', tenant_ids=None, incremental=False, jobs=None):
+    # Exports each tenant (default: all) to <output>/<tenant>.<ext>, or,
+    # when incremental, what changed since its last export to
+    # <output>/<tenant>.<start time>.<ext>; -> {tenant: (path, entities,
+    # triples)} for the tenants exported, after printing the ones that
+    # failed
+    if fmt not in formats:
+        raise ValueError(f'Unknown format {fmt!r}, expected one of {", ".join(formats)}')
+    connection = sqlite3.connect(database, timeout=60)
+    connection.execute(_schema)
+    connection.commit()
+    tenant_ids = tenant_ids or tenants(database)
+    started = datetime.datetime.now().isoformat(' ', 'seconds')
+    since = {}
+    if incremental:
+        since = dict(connection.execute('SELECT tenant_id, started_at FROM rdf_exports WHERE format = ?', (fmt,)))
+    os.makedirs(output, exist_ok=True)
+    stamp = f'.{started.replace("-", "").replace(":", "").replace(" ", "T")}' if incremental else ''
+    paths = {tenant_id: os.path.join(output, f'{quote(tenant_id, safe="")}{stamp}{formats[fmt]}')
+             for tenant_id in tenant_ids}
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {tenant_id: pool.submit(export_tenant, database, tenant_id, paths[tenant_id], fmt,
+                                          since.get(tenant_id))
+                   for tenant_id in tenant_ids}
+        for tenant_id, future in futures.items():
+            try:
+                counts = future.result()
+            except Exception as e:
+                print(f'Error exporting tenant {tenant_id}: {e}')
+                continue
+            results[tenant_id] = (paths[tenant_id],) + counts
+            with connection:
+                connection.execute('INSERT OR REPLACE INTO rdf_exports (tenant_id, format, started_at, triples, '
+                                   'path) VALUES (?, ?, ?, ?, ?)',
+                                   (tenant_id, fmt, started, counts[1], paths[tenant_id]))
+    connection.close()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the billing entities as RDF, one file per tenant.')
+    parser.add_argument('database', help='SQLite database with the tables of design/database_schema.md')
+    parser.add_argument('-o', '--output', default='rdf', help='output directory (default: rdf)')
+    parser.add_argument('-f', '--format', choices=list(formats), default='turtle',
+                        help='serialization (default: turtle)')
+    parser.add_argument('--tenant', action='append', help='only this tenant id (repeatable)')
+    parser.add_argument('--incremental', action='store_true',
+                        help="only the entities updated since the tenant's last export in this format")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs)')
+    args = parser.parse_args()
+    start = time.perf_counter()
+    known = tenants(args.database)
+    unknown = [tenant_id for tenant_id in args.tenant or [] if tenant_id not in known]
+    if unknown:
+        parser.error(f'unknown tenants: {", ".join(unknown)}')
+    tenant_ids = args.tenant or known
+    results = export(args.database, args.output, args.format, tenant_ids, args.incremental, args.jobs)
+    triples = sum(result[2] for result in results.values())
+    print(f'Exported {sum(result[1] for result in results.values())} entities ({triples} triples) '
+          f'of {len(results)} tenants to {args.output} in {time.perf_counter() - start:.1f}s')
+    sys.exit(0 if len(results) == len(tenant_ids) else 1)
@@ -0,0 +1,344 @@
+
+import asyncio
+import calendar
+import datetime
+import functools
+import hashlib
+import queue
+import sqlite3
+import threading
+import uuid
+
+import instrument
+from tax_engine import RateNotFound, TaxEngine, to_cents
+
+# Bills every active subscription whose current period (ending at ends_at)
+# is over, against the tables in design/database_schema.md:
+#
+#   subscriptions --due_subscriptions()--> rows --price()--> invoices
+#       --store()--> invoices table --bounded queue--> payment thread
+#
+# The stages are generators, each pulling the next chunk only when it is
+# ready for it. Subscriptions are read in keyset-paginated chunks
+# (`id > last id ORDER BY id LIMIT n`), so memory stays at a few chunks
+# however many subscribers there are. Payments run in their own thread
+# behind a queue of at most `queue_size` chunks; when the gateways fall
+# behind, invoicing waits for them.
+#
+# Each chunk is committed in one transaction that inserts its invoices,
+# moves each subscription's ends_at on by a month and records the last
+# subscription id in renewal_runs. An interrupted run resumes after that
+# id, and re-running it is harmless anyway: billed subscriptions are no
+# longer due. Invoices start as 'open' and become 'paid' or, when the
+# charge fails, 'unpaid'. Open invoices left by an interrupted run are
+# charged first on resume. Invoice ids are derived from the subscription
+# and period, and serve as the gateways' idempotency keys, so nothing is
+# invoiced or charged twice.
+#
+# Amounts are kept as exact decimal strings, as SQLite has no decimal
+# type. With an audit.AuditLog, every invoice and payment is also recorded
+# as an audit event; logging only buffers the event, so it does not slow
+# the run down.
+
+chunk_size = 5000
+
+_invoice_namespace = uuid.UUID('6f1f3b0e-8a52-4d7e-9c43-2b8f0d6a9e11')
+
+_due_sql = '''
+    SELECT s.id, s.user_id, s.ends_at, p.price, p.currency, u.region
+    FROM subscriptions s
+    JOIN products p ON p.id = s.product_id
+    JOIN users u ON u.id = s.user_id
+    WHERE s.id > ? AND s.status = 'active' AND s.ends_at <= ?
+      AND (s.trial_ends_at IS NULL OR s.trial_ends_at <= ?)
+    ORDER BY s.id
+    LIMIT ?
+'''
+
+_open_sql = '''
+    SELECT id, user_id, subscription_id, status, total, tax, currency
+    FROM invoices WHERE id > ? AND status = 'open' ORDER BY id LIMIT ?
+'''
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS renewal_runs (
+    id TEXT PRIMARY KEY,
+    as_of TEXT NOT NULL,
+    last_subscription_id TEXT NOT NULL DEFAULT '',
+    invoices INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+)
+'''
+
+
+@functools.lru_cache(maxsize=4096)
+def next_period(ends_at):
+    # '2025-01-31 00:00:00' -> '2025-02-28 00:00:00'
+    end = datetime.datetime.fromisoformat(ends_at)
+    year, month = divmod(end.month, 12)
+    year += end.year
+    day = min(end.day, calendar.monthrange(year, month + 1)[1])
+    return end.replace(year=year, month=month + 1, day=day).isoformat(' ')
+
+
+@functools.lru_cache(maxsize=4096)
+def _cents(price):
+    return to_cents(price)
+
+
+def _money(cents):
+    # 1999 -> '19.99', as str(tax_engine.from_cents()) but without Decimal
+    sign = '-' if cents < 0 else ''
+    return f'{sign}{abs(cents) // 100}.{abs(cents) % 100:02d}'
+
+
+def _id(name):
+    # uuid.uuid5(_invoice_namespace, name), without building UUID objects
+    digest = bytearray(hashlib.sha1(_invoice_namespace.bytes + name.encode()).digest()[:16])
+    digest[6] = digest[6] & 0x0f | 0x50
+    digest[8] = digest[8] & 0x3f | 0x80
+    h = digest.hex()
+    return f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}'
+
+
+def _connect(database):
+    # With WAL, synchronous=NORMAL skips the fsync per commit. A crash can
+    # then lose the last few chunks but not corrupt the database, and a
+    # lost chunk is just billed again on resume, under the same ids.
+    connection = sqlite3.connect(database, timeout=60)
+    connection.execute('PRAGMA journal_mode = WAL')
+    connection.execute('PRAGMA synchronous = NORMAL')
+    return connection
+
+
+def due_subscriptions(connection, as_of, after=''):
+    # Yields lists of up to chunk_size due subscriptions, with their
+    # product's price and currency and their user's tax region
+    while True:
+        with instrument.stage('renewals.select') as timer:
+            rows = connection.execute(_due_sql, (after, as_of, as_of, chunk_size)).fetchall()
+            timer.add(len(rows))
+        if not rows:
+            return
+        yield rows
+        after = rows[-1][0]
+
+
+def _taxable(engine, rows):
+    # The rows whose region has a tax rate when their new period starts, and
+    # the others
+    known = {}
+    for row in rows:
+        key = row[5], row[2]
+        if key not in known:
+            try:
+                engine.rate(*key)
+                known[key] = True
+            except RateNotFound:
+                known[key] = False
+    return [row for row in rows if known[row[5], row[2]]], [row for row in rows if not known[row[5], row[2]]]
+
+
+def price(chunks, engine, as_of, now):
+    # Yields (last subscription id, invoice rows, subscription updates,
+    # skipped rows). Tax is charged at the rate in force when the new period
+    # starts. Subscriptions whose user's region has no rate then (say, no
+    # region at all) are skipped instead of failing the chunk; they stay
+    # due and are billed by a later run once the region is fixed.
+    for chunk in chunks:
+        with instrument.stage('renewals.price', items=len(chunk)):
+            rows = chunk
+            skipped = []
+            cents = [_cents(row[3]) for row in rows]
+            try:
+                taxes = engine.calculate(cents, [row[5] for row in rows], [row[2] for row in rows])
+            except RateNotFound:
+                rows, skipped = _taxable(engine, rows)
+                cents = [_cents(row[3]) for row in rows]
+                taxes = engine.calculate(cents, [row[5] for row in rows], [row[2] for row in rows]) if rows else []
+            if not isinstance(taxes, list):
+                taxes = taxes.tolist()
+            invoices = []
+            renewals = []
+            for (subscription_id, user_id, ends_at, _, currency, _), amount, tax in zip(rows, cents, taxes):
+                invoice_id = _id(f'{subscription_id}/{ends_at}')
+                invoices.append((invoice_id, user_id, subscription_id, 'open', _money(amount + tax), _money(tax),
+                                 currency, as_of, None, now, now))
+                renewals.append((next_period(ends_at), now, subscription_id))
+            # Inserting in key order keeps the writes to the invoices index local
+            invoices.sort()
+        yield chunk[-1][0], invoices, renewals, skipped
+
+
+def store(connection, priced, run_id, now):
+    # Commits each chunk with the run's checkpoint and yields its invoices
+    # and skipped rows
+    for last_id, invoices, renewals, skipped in priced:
+        with instrument.stage('renewals.store', items=len(invoices)), connection:
+            connection.executemany('INSERT OR IGNORE INTO invoices (id, user_id, subscription_id, status, total, '
+                                   'tax, currency, due_at, paid_at, created_at, updated_at) '
+                                   'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', invoices)
+            connection.executemany('UPDATE subscriptions SET ends_at = ?, updated_at = ? WHERE id = ?', renewals)
+            connection.execute('UPDATE renewal_runs SET last_subscription_id = ?, invoices = invoices + ?, '
+                               'updated_at = ? WHERE id = ?', (last_id, len(invoices), now, run_id))
+        yield [invoice[:7] for invoice in invoices], skipped
+
+
+def open_invoices(connection):
+    # Invoices an interrupted run created but did not get to charge
+    after = ''
+    while True:
+        rows = connection.execute(_open_sql, (after, chunk_size)).fetchall()
+        if not rows:
+            return
+        yield rows
+        after = rows[-1][0]
+
+
+def gateway_charger(gateway, token_for):
+    # A charger for run() that charges through a gateways.PaymentGateway.
+    # token_for(invoice) returns the saved payment token of the invoice's
+    # subscription. The invoice id is the idempotency key.
+    loop = None
+
+    def charge(invoices):
+        nonlocal loop
+        if loop is None:
+            loop = asyncio.new_event_loop()
+        charges = [(invoice[0], to_cents(invoice[4]), token_for(invoice)) for invoice in invoices]
+        results = loop.run_until_complete(gateway.charge_batch(charges))
+        return [(gateway.name, result.transaction_id) for result in results]
+
+    return charge
+
+
+def _pay(database, work, charger, stats, audit=None):
+    # The payment thread: charger(invoices) returns a (gateway name,
+    # transaction id or None) pair per invoice
+    connection = _connect(database)
+    try:
+        while True:
+            invoices = work.get()
+            if invoices is None:
+                return
+            with instrument.stage('renewals.charge', items=len(invoices)):
+                results = charger(invoices)
+            now = datetime.datetime.now().isoformat(' ', 'seconds')
+            payments = []
+            statuses = []
+            for invoice, (gateway, transaction_id) in zip(invoices, results):
+                status = 'successful' if transaction_id else 'failed'
+                payments.append((_id(f'{invoice[0]}/{gateway}'), invoice[0],
+                                 gateway, transaction_id, invoice[4], invoice[6], status, now, now))
+                statuses.append(('paid' if transaction_id else 'unpaid', now if transaction_id else None,
+                                 now, invoice[0]))
+            with instrument.stage('renewals.record_payments', items=len(payments)), connection:
+                connection.executemany('INSERT OR IGNORE INTO payments (id, invoice_id, payment_gateway, '
+                                       'transaction_id, amount, currency, status, created_at, updated_at) '
+                                       'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', payments)
+                connection.executemany('UPDATE invoices SET status = ?, paid_at = ?, updated_at = ? WHERE id = ?',
+                                       statuses)
+            if audit is not None:
+                for invoice, payment in zip(invoices, payments):
+                    audit.log(invoice[1], f'payment_{payment[6]}',
+                              {'invoice_id': invoice[0], 'payment_id': payment[0], 'gateway': payment[2],
+                               'transaction_id': payment[3], 'amount': payment[4], 'currency': payment[5]})
+            stats['paid'] += sum(status[0] == 'paid' for status in statuses)
+            stats['unpaid'] += sum(status[0] == 'unpaid' for status in statuses)
+    except BaseException as e:
+        stats['error'] = e
+    finally:
+        connection.close()
+
+
+def _put(work, item, thread):
+    # Blocks while the payment stage is behind, unless it died
+    while True:
+        try:
+            work.put(item, timeout=1)
+            return
+        except queue.Full:
+            if not thread.is_alive():
+                return
+
+
+def run(database, as_of, engine=None, charger=None, run_id=None, queue_size=4, max_chunks=None, audit=None):
+    # Bills everything due at `as_of` ('YYYY-MM-DD HH:MM:SS') and returns
+    # counts. Without a charger the invoices are left open. `max_chunks`
+    # stops early, as an interruption would. A run that stops early or
+    # raises is left 'running' in renewal_runs and resumes from its last
+    # chunk when called again. Flushing or closing `audit` is left to the
+    # caller.
+    connection = _connect(database)
+    connection.execute(_schema)
+    engine = engine or TaxEngine.from_sqlite(connection)
+    run_id = run_id or f'renewal {as_of}'
+    now = datetime.datetime.now().isoformat(' ', 'seconds')
+    stats = {'run': run_id, 'invoices': 0, 'chunks': 0, 'resumed_after': None, 'paid': 0, 'unpaid': 0,
+             'skipped': 0}
+
+    record = connection.execute('SELECT last_subscription_id, status FROM renewal_runs WHERE id = ?',
+                                (run_id,)).fetchone()
+    if record and record[1] == 'finished':
+        connection.close()
+        stats['status'] = 'finished'
+        return stats
+    with connection:
+        if record:
+            stats['resumed_after'] = record[0]
+        else:
+            connection.execute('INSERT INTO renewal_runs (id, as_of, status, started_at, updated_at) '
+                               'VALUES (?, ?, ?, ?, ?)', (run_id, as_of, 'running', now, now))
+    after = record[0] if record else ''
+
+    thread = None
+    if charger is not None:
+        work = queue.Queue(maxsize=queue_size)
+        thread = threading.Thread(target=_pay, args=(database, work, charger, stats, audit), daemon=True)
+        thread.start()
+        for invoices in open_invoices(connection):
+            _put(work, invoices, thread)
+
+    # Only a loop that runs to the end finishes the run; breaking out of it
+    # or an exception leaves it to be resumed
+    status = 'interrupted'
+    try:
+        stored = store(connection, price(due_subscriptions(connection, as_of, after), engine, as_of, now),
+                       run_id, now)
+        for invoices, skipped in stored:
+            stats['invoices'] += len(invoices)
+            stats['skipped'] += len(skipped)
+            stats['chunks'] += 1
+            if audit is not None:
+                for invoice in invoices:
+                    audit.log(invoice[1], 'created_invoice',
+                              {'invoice_id': invoice[0], 'subscription_id': invoice[2], 'total': invoice[4],
+                               'tax': invoice[5], 'currency': invoice[6]})
+                for row in skipped:
+                    audit.log(row[1], 'skipped_renewal',
+                              {'subscription_id': row[0], 'region': row[5], 'reason': 'no tax rate'})
+            if thread is not None:
+                _put(work, invoices, thread)
+                if 'error' in stats:
+                    break
+            if max_chunks is not None and stats['chunks'] >= max_chunks:
+                break
+        else:
+            status = 'finished'
+    finally:
+        if thread is not None:
+            _put(work, None, thread)
+            thread.join()
+        if 'error' in stats:
+            status = 'interrupted'
+        if status == 'finished':
+            with connection:
+                connection.execute('UPDATE renewal_runs SET status = ?, updated_at = ? WHERE id = ?',
+                                   (status, now, run_id))
+        connection.close()
+    if 'error' in stats:
+        raise stats['error']
+    stats['status'] = status
+    return stats
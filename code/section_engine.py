@@ -0,0 +1,525 @@
+
+import argparse
+import json
+import os
+import re
+import string
+
+import instrument
+import json_stream
+from md_writer import SectionWriter, humanize
+from section_specs import sections
+
+# The spec node lists are translated into plain Python functions, once per
+# node list, and those functions are what render every input file. The
+# generated code is the same loop a hand-written compile script would run,
+# so the engine costs nothing per item over the scripts it replaced.
+
+# Containers as returned by json.load() and by json_stream.load()
+_dict_types = (dict, json_stream.LazyObject)
+_list_types = (list, json_stream.LazyArray)
+
+_type_names = {'dict': '_dict_types', 'list': '_list_types', 'str': 'str'}
+
+_filters = {
+    'humanize': lambda expr, arg: f'humanize({expr})',
+    'join': lambda expr, arg: f"', '.join({expr})",
+    'drop': lambda expr, arg: f"{expr}.replace({arg!r}, '')",
+}
+
+_globals = {
+    'humanize': humanize,
+    '_dict_types': _dict_types,
+    '_list_types': _list_types,
+}
+
+_filter_re = re.compile(r'(\w+)(?:\((.*)\))?')
+_is_re = re.compile(r'(\S+) is (\w+)')
+_for_re = re.compile(r'(\w+)(?:\s*,\s*(\w+))?\s+in\s+(\S+?)(\?)?')
+
+# id(node list) -> (node list, compiled function)
+_compiled = {}
+
+
+class SpecError(ValueError):
+    pass
+
+
+def _path(text, scope):
+    # 'feature.name' -> ('feature', ['name']), checking the variable is bound
+    var, *keys = text.strip().split('.')
+    if var not in scope:
+        raise SpecError(f'Unknown variable {var!r} in {text!r}')
+    return var, keys
+
+
+def _lookup(var, keys):
+    return var + ''.join(f'[{key!r}]' for key in keys)
+
+
+def _exists(var, keys):
+    return ' and '.join(f'{key!r} in {_lookup(var, keys[:i])}' for i, key in enumerate(keys))
+
+
+def _test(text, scope):
+    text = text.strip()
+    if ' == ' in text:
+        left, right = text.split(' == ')
+        return f'{_lookup(*_path(left, scope))} == {_lookup(*_path(right, scope))}'
+    match = _is_re.fullmatch(text)
+    if match:
+        if match.group(2) not in _type_names:
+            raise SpecError(f'Unknown type in {text!r}')
+        return f'isinstance({_lookup(*_path(match.group(1), scope))}, {_type_names[match.group(2)]})'
+    if text.endswith('?'):
+        var, keys = _path(text[:-1], scope)
+        return f'({_exists(var, keys)})' if keys else 'True'
+    var, keys = _path(text, scope)
+    if not keys:
+        return var
+    return f'({_exists(var, keys)} and {_lookup(var, keys)})'
+
+
+def _condition(text, scope):
+    if text is None:
+        return 'True'
+    return ' and '.join(_test(test, scope) for test in text.split(' and '))
+
+
+def _field(text, scope):
+    path, *filters = text.split('|')
+    expr = _lookup(*_path(path, scope))
+    for spec in filters:
+        match = _filter_re.fullmatch(spec.strip())
+        if not match or match.group(1) not in _filters:
+            raise SpecError(f'Unknown filter {spec!r}')
+        expr = _filters[match.group(1)](expr, match.group(2))
+    return expr
+
+
+def _template(template, scope, lines, indent):
+    # Fields are evaluated into locals first, then written with one f-string
+    literals = []
+    pieces = []
+    for i, (literal, field, format_spec, conversion) in enumerate(string.Formatter().parse(template)):
+        literals.append(literal)
+        pieces.append(literal.replace('{', '{{').replace('}', '}}'))
+        if field is None:
+            continue
+        if format_spec or conversion:
+            raise SpecError(f'Format specs are not supported: {template!r}')
+        expr = _field(field, scope)
+        if not expr.isidentifier():
+            lines.append(f'{indent}_v{i} = {expr}')
+            expr = f'_v{i}'
+        pieces.append(f'{{{expr}}}')
+    if len(pieces) == len(literals):
+        lines.append(f'{indent}write({"".join(literals)!r})')
+    else:
+        lines.append(f'{indent}write(f{"".join(pieces)!r})')
+
+
+def _nodes(nodes, scope, lines, depth):
+    indent = '    ' * depth
+    start = len(lines)
+    pending = []
+    for node in list(nodes) + [None]:
+        # Runs of text nodes are written with a single template
+        if node is not None and 'text' in node:
+            pending.append(node['text'])
+            continue
+        if pending:
+            _template(''.join(pending), scope, lines, indent)
+            pending = []
+        if node is None:
+            break
+        if 'if' in node:
+            lines.append(f'{indent}if {_condition(node["if"], scope)}:')
+            _nodes(node['then'], scope, lines, depth + 1)
+            if node.get('else'):
+                lines.append(f'{indent}else:')
+                _nodes(node['else'], scope, lines, depth + 1)
+        elif 'choose' in node:
+            keyword = 'if'
+            for condition, branch in node['choose']:
+                if condition is None:
+                    lines.append(f'{indent}else:')
+                else:
+                    lines.append(f'{indent}{keyword} {_condition(condition, scope)}:')
+                _nodes(branch, scope, lines, depth + 1)
+                keyword = 'elif'
+        elif 'for' in node:
+            match = _for_re.fullmatch(node['for'].strip())
+            if not match:
+                raise SpecError(f'Cannot parse loop {node["for"]!r}')
+            first, second, path, optional = match.groups()
+            var, keys = _path(path, scope)
+            iterable = _lookup(var, keys)
+            if second:
+                iterable += '.items()'
+            if optional:
+                iterable = f'({iterable} if {_exists(var, keys)} else ())'
+            targets = f'{first}, {second}' if second else first
+            lines.append(f'{indent}for {targets} in {iterable}:')
+            # Loops over the top level of an input may be streaming, so let
+            # the writer empty its buffer between records
+            if var == 'data':
+                lines.append(f'{indent}    checkpoint()')
+            _nodes(node['do'], scope | {first, second} - {None}, lines, depth + 1)
+        else:
+            raise SpecError(f'Unknown node {node!r}')
+    if len(lines) == start:
+        lines.append(f'{indent}pass')
+
+
+def source_code(nodes):
+    lines = ['def render(write, checkpoint, data, filename):']
+    _nodes(nodes, {'data', 'filename'}, lines, 1)
+    return '\n'.join(lines) + '\n'
+
+
+def compile_nodes(nodes):
+    cached = _compiled.get(id(nodes))
+    if cached is not None:
+        return cached[1]
+    namespace = dict(_globals)
+    exec(compile(source_code(nodes), '<section spec>', 'exec'), namespace)
+    _compiled[id(nodes)] = (nodes, namespace['render'])
+    return namespace['render']
+
+
+# The same node lists also compile into checkers: functions that follow the
+# render's branches and loops over a parsed file without writing anything,
+# and report every field, loop or condition the render would fail on
+# (a missing key, a loop over something that is not a list) along with
+# where in the file it is. A source's schema is thus exactly what its
+# spec reads from it.
+
+# id(node list) -> (node list, compiled checker)
+_compiled_checkers = {}
+
+# Problems reported per file before the rest are only counted
+max_problems = 20
+
+
+def _describe(text, scope):
+    # f-string source naming where a path is, 'data.features[{_i1}].name'
+    var, keys = _path(text, scope)
+    return scope[var] + ''.join(f'.{key}' for key in keys)
+
+
+def _guarded(lines, indent, statements, where, fallback=None):
+    lines.append(f'{indent}try:')
+    lines += [f'{indent}    {statement}' for statement in statements]
+    lines.append(f'{indent}except Exception as e:')
+    lines.append(f'{indent}    problem(f{where!r}, e)')
+    if fallback:
+        lines.append(f'{indent}    {fallback}')
+
+
+def _check_condition(text, scope, lines, indent):
+    if text is None:
+        return 'True'
+    condition = _condition(text, scope)
+    tests = [_is_re.fullmatch(test.strip()) for test in text.split(' and ')]
+    if all(test and '.' not in test.group(1) for test in tests):
+        # isinstance() of a variable cannot fail
+        return condition
+    path = re.match(r'[\w.]+', text.split(' and ')[0].strip()).group(0)
+    _guarded(lines, indent, [f'_c = {condition}'], _describe(path, scope), '_c = False')
+    return '_c'
+
+
+def _check_fields(fields, scope, strings, lines, indent):
+    # All the fields of a run of text in one try; only when that fails is
+    # each one tried on its own, to report every failing field. Fields that
+    # cannot fail (a bare variable, or filters on a key or the filename) are
+    # left out.
+    checks = []
+    for field in fields:
+        path, *filters = field.split('|')
+        var, keys = _path(path, scope)
+        if not keys and (not filters or var in strings):
+            continue
+        checks.append((_field(field, scope), _describe(path, scope)))
+    if not checks:
+        return
+    lines.append(f'{indent}try:')
+    lines.append(f'{indent}    {", ".join(expr for expr, _ in checks)},')
+    lines.append(f'{indent}except Exception:')
+    for expr, where in checks:
+        _guarded(lines, indent + '    ', [expr], where)
+
+
+def _check_nodes(nodes, scope, strings, lines, depth, counter):
+    # `scope` maps each variable to the f-string source of its location;
+    # `strings` are the variables known to be strings
+    indent = '    ' * depth
+    start = len(lines)
+    fields = []
+    for node in list(nodes) + [None]:
+        if node is not None and 'text' in node:
+            fields += [field for _, field, _, _ in string.Formatter().parse(node['text']) if field is not None]
+            continue
+        _check_fields(fields, scope, strings, lines, indent)
+        fields = []
+        if node is None:
+            break
+        elif 'if' in node:
+            lines.append(f'{indent}if {_check_condition(node["if"], scope, lines, indent)}:')
+            _check_nodes(node['then'], scope, strings, lines, depth + 1, counter)
+            if node.get('else'):
+                lines.append(f'{indent}else:')
+                _check_nodes(node['else'], scope, strings, lines, depth + 1, counter)
+        elif 'choose' in node:
+            # Each condition is only evaluated when the ones before it
+            # failed, as in the render
+            level = depth
+            for condition, branch in node['choose']:
+                inner = '    ' * level
+                if condition is None:
+                    _check_nodes(branch, scope, strings, lines, level, counter)
+                    break
+                lines.append(f'{inner}if {_check_condition(condition, scope, lines, inner)}:')
+                _check_nodes(branch, scope, strings, lines, level + 1, counter)
+                lines.append(f'{inner}else:')
+                level += 1
+            else:
+                lines.append(f'{"    " * level}pass')
+        elif 'for' in node:
+            match = _for_re.fullmatch(node['for'].strip())
+            if not match:
+                raise SpecError(f'Cannot parse loop {node["for"]!r}')
+            first, second, path, optional = match.groups()
+            var, keys = _path(path, scope)
+            counter[0] += 1
+            n = counter[0]
+            iterable = _lookup(var, keys)
+            empty = '{}' if second else '()'
+            if optional:
+                iterable = f'({iterable} if {_exists(var, keys)} else {empty})'
+            kind, types = ('an object', '_dict_types') if second else ('a list', '_list_types + (tuple,)')
+            _guarded(lines, indent, [
+                f'_l{n} = {iterable}',
+                f'if not isinstance(_l{n}, {types}):',
+                f"    raise TypeError(f'is {{type(_l{n}).__name__}}, not {kind}')",
+            ], _describe(path, scope), f'_l{n} = {empty}')
+            where = _describe(path, scope)
+            if second:
+                loop = f'{indent}for {first}, {second} in _l{n}.items():'
+                inner = scope | {first: where, second: f'{where}.{{{first}}}'}
+                known = (strings | {first}) - {second}
+            else:
+                loop = f'{indent}for _i{n}, {first} in enumerate(_l{n}):'
+                inner = scope | {first: f'{where}[{{_i{n}}}]'}
+                known = strings - {first}
+            body = []
+            _check_nodes(node['do'], inner, known, body, depth + 1, counter)
+            if body != [f'{indent}    pass']:
+                # Loops with nothing to check in their items are left out
+                lines += [loop] + body
+        else:
+            raise SpecError(f'Unknown node {node!r}')
+    if len(lines) == start:
+        lines.append(f'{indent}pass')
+
+
+def checker_code(nodes):
+    lines = ['def check(problem, data, filename):']
+    _check_nodes(nodes, {'data': 'data', 'filename': 'filename'}, {'filename'}, lines, 1, [0])
+    return '\n'.join(lines) + '\n'
+
+
+def compile_checker(nodes):
+    cached = _compiled_checkers.get(id(nodes))
+    if cached is not None:
+        return cached[1]
+    namespace = dict(_globals)
+    exec(compile(checker_code(nodes), '<section checker>', 'exec'), namespace)
+    _compiled_checkers[id(nodes)] = (nodes, namespace['check'])
+    return namespace['check']
+
+
+def _explain(error):
+    if isinstance(error, KeyError):
+        return 'missing'
+    if isinstance(error, TypeError) and any(text in str(error) for text in
+                                            ('indices must be', 'not subscriptable', 'is not iterable')):
+        return 'is not an object'
+    return str(error)
+
+
+def check_data(nodes, data, filename):
+    # The problems the render of `nodes` would run into on `data`, as
+    # messages; past `max_problems` they are only counted
+    problems = []
+
+    def problem(where, error):
+        problems.append(f'{filename}: {where}: {_explain(error)}')
+
+    compile_checker(nodes)(problem, data, filename)
+    if len(problems) > max_problems:
+        problems[max_problems:] = [f'{filename}: ... and {len(problems) - max_problems} more problems']
+    return problems
+
+
+class SchemaError(ValueError):
+
+    def __init__(self, problems):
+        super().__init__('\n'.join(problems))
+        self.problems = problems
+
+
+def check_file(nodes, filepath, stream=False, cache=None):
+    # check_data() on the file as the render would load it; raises
+    # json.JSONDecodeError
+    filename = os.path.basename(filepath)
+    with instrument.stage('section.check', file=filename):
+        if cache is not None and not stream:
+            return check_data(nodes, cache.load(filepath), filename)
+        with open(filepath, 'r') as json_file:
+            data = json_stream.load(json_file) if stream else json.load(json_file)
+            return check_data(nodes, data, filename)
+
+
+def check_section(spec, stream=False, cache=None, checks=None):
+    # Raises SchemaError if any source of `spec` does not fit what the spec
+    # reads from it. `checks` is an optional validate.CheckCache that
+    # remembers the outcome per file content. Files that are missing or
+    # not JSON at all are left to the render, which skips them.
+    problems = []
+    for part in spec['body']:
+        if 'sources' not in part:
+            continue
+        for filename in part['sources']:
+            filepath = os.path.join(spec['directory'], filename)
+            if not os.path.exists(filepath):
+                continue
+            if checks is not None:
+                key, found = checks.get(filepath, part['do'])
+                if found is not None:
+                    problems += found
+                    continue
+            try:
+                found = check_file(part['do'], filepath, stream, cache)
+            except json.JSONDecodeError:
+                found = []
+            if checks is not None:
+                checks.put(key, found)
+            problems += found
+    if problems:
+        raise SchemaError(problems)
+
+
+def section_inputs(spec):
+    inputs = []
+    for part in spec['body']:
+        for filename in part.get('sources', []) + part.get('concat', []):
+            inputs.append(os.path.join(spec['directory'], filename))
+    return inputs
+
+
+def _title(filepath):
+    # The text of the first line if it is a markdown heading. Only this line
+    # is read; the rest of the file is copied without being looked at.
+    with open(filepath, 'rb') as f:
+        line = f.readline(4096).decode('utf-8', 'replace').strip()
+    return line.lstrip('#').strip() if line.startswith('#') else None
+
+
+def render_section(spec, md_file, stream=False, cache=None):
+    # `cache` is an optional parse_cache.ParseCache to load JSON through.
+    # Returns the table of contents of the concatenated files, each with
+    # its byte offset and length in the output.
+    contents = []
+    for part in spec['body']:
+        if 'text' in part:
+            md_file.write(part['text'])
+        elif 'sources' in part:
+            md_file.write(part.get('heading', ''))
+            with instrument.stage('section.compile'):
+                render = compile_nodes(part['do'])
+            for filename in part['sources']:
+                filepath = os.path.join(spec['directory'], filename)
+                if not os.path.exists(filepath):
+                    instrument.count('section.missing_sources')
+                    continue
+                if cache is not None and not stream:
+                    try:
+                        with instrument.stage('section.load', file=filename):
+                            data = cache.load(filepath)
+                    except json.JSONDecodeError:
+                        print(f'Error decoding JSON from {filename}')
+                        instrument.count('section.bad_sources')
+                        continue
+                    with instrument.stage('section.render', file=filename, items=1):
+                        render(md_file.write, md_file.checkpoint, data, filename)
+                    continue
+                with open(filepath, 'r') as json_file:
+                    try:
+                        # Streamed files are parsed as they are rendered
+                        with instrument.stage('section.load', file=filename):
+                            data = json_stream.load(json_file) if stream else json.load(json_file)
+                        with instrument.stage('section.render', file=filename, items=1):
+                            render(md_file.write, md_file.checkpoint, data, filename)
+                    except json.JSONDecodeError:
+                        print(f'Error decoding JSON from {filename}')
+                        instrument.count('section.bad_sources')
+        elif 'concat' in part:
+            for filename in part['concat']:
+                filepath = os.path.join(spec['directory'], filename)
+                if os.path.exists(filepath):
+                    with instrument.stage('section.concat', file=filename) as timer:
+                        offset, length = md_file.copy_file(filepath)
+                        timer.add(length)
+                    md_file.write('\n\n')
+                    contents.append({'file': filename, 'title': _title(filepath),
+                                     'offset': offset, 'length': length})
+        else:
+            raise SpecError(f'Unknown part {part!r}')
+    return contents
+
+
+def write_section(spec, stream=False, cache=None, checks=None):
+    # The sources are checked before the output is opened, so a bad input
+    # fails the section without leaving it half written
+    with instrument.stage('section', output=spec['output']):
+        check_section(spec, stream=stream, cache=cache, checks=checks)
+        with SectionWriter(spec['output']) as md_file:
+            contents = render_section(spec, md_file, stream=stream, cache=cache)
+        if spec.get('toc'):
+            with open(spec['toc'], 'w') as toc_file:
+                json.dump({'output': spec['output'], 'sections': contents}, toc_file, indent=2)
+
+
+def build_section(name, stream=False, cache=None, checks=None):
+    write_section(sections[name], stream=stream, cache=cache, checks=checks)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render sections from section_specs.py.')
+    parser.add_argument('sections', nargs='*', help='sections to render (default: all)')
+    parser.add_argument('--stream', action='store_true',
+                        help='stream large JSON inputs instead of loading them whole')
+    parser.add_argument('--show-code', action='store_true',
+                        help='print the code generated for each section instead of rendering')
+    parser.add_argument('--instrument', metavar='PREFIX',
+                        help='time the stages and write PREFIX.json and PREFIX.trace.json')
+    parser.add_argument('--profile', action='store_true', help='with --instrument, also write PREFIX.prof')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='with --instrument, also report peak Python memory')
+    args = parser.parse_args()
+    if args.instrument:
+        instrument.enable(profile=args.profile, trace_memory=args.trace_memory)
+    for name in args.sections or sections:
+        if args.show_code:
+            for part in sections[name]['body']:
+                if 'do' in part:
+                    print(f'# {name}: {", ".join(part["sources"])}')
+                    print(source_code(part['do']))
+        else:
+            build_section(name, stream=args.stream)
+    if args.instrument:
+        instrument.disable()
+        instrument.save(args.instrument)
+        print(instrument.format_report(instrument.report()))
@@ -0,0 +1,424 @@
+
+# Declarative specs for every generated document. Each section names its
+# output file, the directory its inputs live in, optionally a `toc` file
+# and a body, which is a list of parts rendered in order:
+#
+#   {'text': '...'}                       literal text
+#   {'sources': [files], 'do': nodes}     render `nodes` for each JSON file
+#                                         that exists, with the parsed file
+#                                         bound to `data` and its name to
+#                                         `filename`, after the part's
+#                                         optional 'heading' text
+#   {'concat': [files]}                   copy each markdown file that
+#                                         exists, followed by a blank line,
+#                                         and list it in the `toc` file with
+#                                         its title and byte offset
+#
+# Nodes describe how one parsed file becomes markdown:
+#
+#   {'text': 'template'}                       write the template
+#   {'if': cond, 'then': nodes, 'else': nodes} 'else' is optional
+#   {'choose': [(cond, nodes), ...]}           first matching branch; a
+#                                              None cond always matches
+#   {'for': 'x in path', 'do': nodes}          loop over a list
+#   {'for': 'k, v in path', 'do': nodes}       loop over an object's items
+#
+# Templates use {path} fields, where a path is a variable followed by
+# object keys (`feature.name`), optionally piped through filters
+# (`{key|humanize}`, `{details.attributes|join}`, `{filename|drop(.json)}`).
+# A condition is one or more tests joined with ' and ':
+#
+#   path            the path exists and is truthy
+#   path?           the path exists
+#   path is dict    also `is list` / `is str`
+#   path == path
+#
+# A loop over `path?` runs zero times when the path does not exist.
+#
+# Adding a gateway, a research source or a tax region is a matter of
+# adding its file to the relevant `sources` list here.
+
+# Shared node lists
+
+TITLE = [
+    {'text': '## {filename|drop(.json)|humanize}\n\n'},
+]
+
+EXTRACTED = [
+    {'if': 'data.extracted_information', 'then': [
+        {'text': '{data.extracted_information}\n\n'},
+    ]},
+]
+
+GATEWAY = [
+    {'text': '## {filename|drop(_api.json)|humanize}\n\n'},
+    {'if': 'data.extracted_information', 'then': [
+        {'text': '**Summary:** {data.extracted_information}\n\n'},
+    ]},
+    {'if': 'data.features', 'then': [
+        {'text': '**Key Features:**\n\n'},
+        {'for': 'feature in data.features', 'do': [
+            {'choose': [
+                ('feature.category? and feature.items?', [
+                    {'text': '*   **{feature.category}**\n'},
+                    {'for': 'item in feature.items', 'do': [
+                        {'text': '    *   {item.name}: {item.description}\n'},
+                    ]},
+                ]),
+                ('feature.category? and feature.capabilities?', [
+                    {'text': '*   **{feature.category}**\n'},
+                    {'for': 'capability in feature.capabilities', 'do': [
+                        {'if': 'capability is dict and capability.name? and capability.description?', 'then': [
+                            {'text': '    *   {capability.name}: {capability.description}\n'},
+                        ], 'else': [
+                            {'text': '    *   {capability}\n'},
+                        ]},
+                    ]},
+                ]),
+            ]},
+        ]},
+        {'text': '\n'},
+    ]},
+]
+
+HST_FEATURES = [
+    {'if': 'data.features', 'then': [
+        {'for': 'feature in data.features', 'do': [
+            {'if': 'feature.category? and feature.details?', 'then': [
+                {'text': '### {feature.category}\n'},
+                {'for': 'detail in feature.details', 'do': [
+                    {'text': '*   {detail}\n'},
+                ]},
+                {'text': '\n'},
+            ]},
+        ]},
+    ]},
+]
+
+US_TAX_FEATURES = [
+    {'if': 'data.features', 'then': [
+        {'for': 'feature in data.features', 'do': [
+            {'if': 'feature.category? and feature.details?', 'then': [
+                {'text': '### {feature.category}\n'},
+                {'if': 'feature.details is list', 'then': [
+                    {'for': 'detail in feature.details', 'do': [
+                        {'text': '*   {detail}\n'},
+                    ]},
+                ], 'else': [
+                    {'text': '*   {feature.details}\n'},
+                ]},
+                {'text': '\n'},
+            ]},
+        ]},
+    ]},
+]
+
+HST = EXTRACTED + [
+    {'if': 'data.specifications', 'then': [
+        {'for': 'key, value in data.specifications', 'do': [
+            {'if': 'value is dict', 'then': [
+                {'text': '**{key|humanize}:**\n'},
+                {'for': 'sub_key, sub_value in value', 'do': [
+                    {'text': '*   {sub_key|humanize}: {sub_value}\n'},
+                ]},
+            ], 'else': [
+                {'text': '**{key|humanize}:** {value}\n'},
+            ]},
+        ]},
+        {'text': '\n'},
+    ]},
+] + HST_FEATURES
+
+US_TAX = EXTRACTED + [
+    {'if': 'data.specifications', 'then': [
+        {'for': 'key, value in data.specifications', 'do': [
+            {'if': 'value is dict', 'then': [
+                {'text': '**{key|humanize}:**\n'},
+                {'for': 'sub_key, sub_value in value', 'do': [
+                    {'if': 'sub_value is dict', 'then': [
+                        {'text': '*   **{sub_key|humanize}:**\n'},
+                        {'for': 's_sub_key, s_sub_value in sub_value', 'do': [
+                            {'text': '    *   {s_sub_key|humanize}: {s_sub_value}\n'},
+                        ]},
+                    ], 'else': [
+                        {'text': '*   {sub_key|humanize}: {sub_value}\n'},
+                    ]},
+                ]},
+            ], 'else': [
+                {'text': '**{key|humanize}:** {value}\n'},
+            ]},
+        ]},
+        {'text': '\n'},
+    ]},
+] + US_TAX_FEATURES
+
+BILLING_ARCHITECTURE = [
+    {'if': 'data.extracted_information', 'then': [
+        {'text': '## {filename|drop(.json)|humanize}\n\n'},
+        {'text': '{data.extracted_information}\n\n'},
+    ]},
+    {'if': 'data.specifications', 'then': [
+        {'if': 'data.specifications.architectural_styles?', 'then': [
+            {'text': '### Architectural Styles\n\n'},
+            {'for': 'style, details in data.specifications.architectural_styles', 'do': [
+                {'text': '#### {style|humanize}\n'},
+                {'text': '*   **Description:** {details.description}\n'},
+                {'text': '*   **Pros:** {details.pros}\n'},
+                {'if': 'details.cons?', 'then': [
+                    {'text': '*   **Cons:** {details.cons}\n'},
+                ]},
+                {'text': '\n'},
+            ]},
+        ]},
+        {'if': 'data.specifications.core_components?', 'then': [
+            {'text': '### Core Components\n\n'},
+            {'for': 'component, details in data.specifications.core_components', 'do': [
+                {'text': '*   **{component|humanize}:** {details.responsibility}\n'},
+            ]},
+            {'text': '\n'},
+        ]},
+    ]},
+    {'if': 'data.features', 'then': [
+        {'text': '### Key Features & Patterns\n\n'},
+        {'for': 'feature in data.features', 'do': [
+            {'choose': [
+                ('feature.pattern_name?', [
+                    {'text': '#### {feature.pattern_name}\n'},
+                    {'text': '*   **Description:** {feature.description}\n'},
+                    {'if': 'feature.use_cases?', 'then': [
+                        {'text': '*   **Use Cases:**\n'},
+                        {'for': 'case in feature.use_cases', 'do': [
+                            {'text': '    *   {case}\n'},
+                        ]},
+                    ]},
+                    {'if': 'feature.shortcomings?', 'then': [
+                        {'text': '*   **Shortcomings:**\n'},
+                        {'for': 'shortcoming in feature.shortcomings', 'do': [
+                            {'text': '    *   {shortcoming}\n'},
+                        ]},
+                    ]},
+                    {'text': '\n'},
+                ]),
+                ('feature.name? and feature.description?', [
+                    {'text': '*   **{feature.name}**: {feature.description}\n'},
+                ]),
+            ]},
+        ]},
+        {'text': '\n'},
+    ]},
+    {'if': 'data.challenges', 'then': [
+        {'text': '### Challenges and Solutions in EDA\n\n'},
+        {'for': 'challenge in data.challenges', 'do': [
+            {'text': '*   **Challenge:** {challenge.challenge_name}\n'},
+            {'text': '    *   **Description:** {challenge.description}\n'},
+            {'for': 'solution in data.solutions?', 'do': [
+                {'if': 'solution.challenge_name == challenge.challenge_name', 'then': [
+                    {'text': '    *   **Solution:** {solution.solution_description}\n'},
+                ]},
+            ]},
+        ]},
+        {'text': '\n'},
+    ]},
+]
+
+STANDARDS = TITLE + EXTRACTED + [
+    {'if': 'data.specifications', 'then': [
+        {'if': 'data.specifications.properties?', 'then': [
+            {'text': '### Invoice Properties (Schema.org)\n\n'},
+            {'for': 'prop in data.specifications.properties', 'do': [
+                {'text': '*   **{prop.property}** ({prop.expected_type}): {prop.description}\n'},
+            ]},
+            {'text': '\n'},
+        ]},
+        {'if': 'data.specifications.Entities?', 'then': [
+            {'text': '### Billing System Entities (Vertabelo)\n\n'},
+            {'for': 'entity, details in data.specifications.Entities', 'do': [
+                {'text': '#### {entity}\n'},
+                {'text': '*   **Description:** {details.description}\n'},
+                {'text': '*   **Attributes:** {details.attributes|join}\n'},
+                {'if': 'details.relationships?', 'then': [
+                    {'text': '*   **Relationships:**\n'},
+                    {'for': 'rel in details.relationships', 'do': [
+                        {'text': '    *   {rel.type} {rel.entity}\n'},
+                    ]},
+                ]},
+            ]},
+            {'text': '\n'},
+        ]},
+    ]},
+    {'if': 'data.features', 'then': [
+        {'text': '### Key Features\n\n'},
+        {'for': 'feature in data.features', 'do': [
+            {'if': 'feature is dict and feature.name? and feature.description?', 'then': [
+                {'text': '*   **{feature.name}**: {feature.description}\n'},
+            ], 'else': [
+                {'text': '*   {feature}\n'},
+            ]},
+        ]},
+        {'text': '\n'},
+    ]},
+]
+
+
+def _numbered_features(heading, number, title):
+    # The '**N. Title**' followed by a description paragraph used by the
+    # PCI requirements and the UI/UX tip lists
+    return TITLE + EXTRACTED + [
+        {'if': 'data.features', 'then': [
+            {'text': heading},
+            {'for': 'feature in data.features', 'do': [
+                {'text': '**{feature.%s}. {feature.%s}**\n' % (number, title)},
+                {'text': '{feature.description}\n\n'},
+            ]},
+        ]},
+    ]
+
+
+def _named_features(heading):
+    return TITLE + EXTRACTED + [
+        {'if': 'data.features', 'then': [
+            {'text': heading},
+            {'for': 'feature in data.features', 'do': [
+                {'text': '**{feature.name}**\n'},
+                {'text': '{feature.description}\n\n'},
+            ]},
+        ]},
+    ]
+
+
+# The sections, keyed by name
+
+sections = {
+    'gateway_analysis': {
+        'output': 'docs/payment_gateway_analysis.md',
+        'directory': 'search_results',
+        'body': [
+            {'text': '# Payment Gateway API Analysis\n\n'},
+            {'sources': [
+                'btcpay_api.json',
+                'woocommerce_api.json',
+                'revenuecat_api.json',
+                'lemonsqueezy_api.json',
+                'helcim_api.json',
+                'square_api.json',
+                'stripe_api.json'
+            ], 'do': GATEWAY},
+        ],
+    },
+    'tax_compliance': {
+        'output': 'docs/tax_compliance.md',
+        'directory': 'search_results',
+        'body': [
+            {'text': '# Tax Compliance Requirements\n\n'},
+            {'heading': '## HST Compliance (Toronto, Ontario)\n\n', 'sources': [
+                'hst_requirements_detailed.json',
+                'hst_remittance_details.json'
+            ], 'do': HST},
+            {'heading': '## US Tax Reporting Standards\n\n', 'sources': ['us_tax_requirements.json'],
+             'do': US_TAX},
+        ],
+    },
+    'billing_architecture': {
+        'output': 'docs/billing_system_architecture.md',
+        'directory': 'search_results',
+        'body': [
+            {'text': '# Modern Billing System Architecture\n\n'},
+            {'sources': [
+                'billing_architecture_orb.json',
+                'billing_architecture_thoughtworks.json',
+                'software_architecture_patterns_simform.json'
+            ], 'do': BILLING_ARCHITECTURE},
+        ],
+    },
+    'standards_and_frameworks': {
+        'output': 'docs/standards_and_frameworks.md',
+        'directory': 'search_results',
+        'body': [
+            {'text': '# Standards-Based Formats and Extensible Frameworks\n\n'},
+            {'sources': [
+                'json_schema_billing.json',
+                'openapi_subscription.json',
+                'schema_org_invoice.json',
+                'billing_data_model_vertabelo.json',
+                'protege_ontology.json'
+            ], 'do': STANDARDS},
+        ],
+    },
+    'security_and_compliance': {
+        'output': 'docs/security_and_compliance.md',
+        'directory': 'search_results',
+        'body': [
+            {'text': '# Security and PCI Compliance\n\n'},
+            {'sources': ['pci_dss_12_requirements.json'], 'do': _numbered_features(
+                '### The 12 PCI DSS Requirements\n\n', 'requirement_number', 'title')},
+            {'sources': ['stripe_pci_compliance.json'], 'do': TITLE + EXTRACTED + [
+                {'if': 'data.features', 'then': [
+                    {'text': '### Stripe and PCI Compliance\n\n'},
+                    {'for': 'feature in data.features', 'do': [
+                        {'text': '*   **{feature.name}**: {feature.description}\n'},
+                    ]},
+                    {'text': '\n'},
+                ]},
+            ]},
+            {'sources': ['payment_security_best_practices.json'], 'do': _named_features(
+                '### Security Best Practices\n\n')},
+        ],
+    },
+    'ui_ux_trends': {
+        'output': 'docs/ui_ux_trends.md',
+        'directory': 'search_results',
+        'body': [
+            {'text': '# Modern UI/UX Trends for Billing Portals\n\n'},
+            {'sources': ['ui_ux_trends_bizbot.json'], 'do': _numbered_features(
+                '### 10 Design Tips for a User-Friendly Subscription Management Experience\n\n',
+                'tip_number', 'name')},
+            {'sources': ['ui_ux_trends_ehousestudio.json'], 'do': _numbered_features(
+                '### 6 UX Guidelines for a Better Subscription Management Experience\n\n',
+                'guideline_number', 'title')},
+            {'sources': ['ui_ux_trends_brainhub.json'], 'do': TITLE + EXTRACTED + [
+                {'if': 'data.features', 'then': [
+                    {'text': '### Key Fintech UX Design Trends for 2025\n\n'},
+                    {'for': 'feature in data.features', 'do': [
+                        {'text': '**{feature.trend_name}**\n'},
+                        {'text': '{feature.description}\n\n'},
+                    ]},
+                ]},
+            ]},
+        ],
+    },
+    'final_report': {
+        'output': 'docs/comprehensive_billing_system_research.md',
+        'toc': 'docs/comprehensive_billing_system_research.toc.json',
+        'directory': 'docs',
+        'body': [
+            {'text': '# Comprehensive Research Analysis: Multi-Payment Gateway Billing System\n\n'},
+            {'concat': [
+                'payment_gateway_analysis.md',
+                'tax_compliance.md',
+                'billing_system_architecture.md',
+                'standards_and_frameworks.md',
+                'security_and_compliance.md',
+                'ui_ux_trends.md'
+            ]},
+        ],
+    },
+    'final_design': {
+        'output': 'design/comprehensive_billing_system_design.md',
+        'toc': 'design/comprehensive_billing_system_design.toc.json',
+        'directory': 'design',
+        'body': [
+            {'text': '# Comprehensive Design: Multi-Payment Gateway Billing System\n\n'},
+            {'concat': [
+                'system_architecture.md',
+                'database_schema.md',
+                'api_design.md',
+                'payment_gateway_integration.md',
+                'tax_compliance.md',
+                'security_architecture.md',
+                'extensible_ontology_framework.md',
+                'ui_ux_wireframes.md',
+                'technology_stack.md'
+            ]},
+        ],
+    },
+}
@@ -0,0 +1,122 @@
+
+import argparse
+import hashlib
+import os
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Serves a directory of JSON files the way the research host does, so
+# fetch_sources.py can be tried and timed offline. Responses carry ETag
+# and Last-Modified and honour conditional requests. Each request can be
+# slowed down, the first few requests for each file can fail with 503 to
+# exercise retries, and files can be redirected elsewhere. Run one per
+# simulated host:
+#
+#   python code/stub_server.py search_results --port 8001 --delay 0.5
+#   python code/stub_server.py search_results --port 8002 --delay 0.1 \
+#       --redirect stripe_api.json http://127.0.0.1:8001/stripe_api.json
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops bursts of concurrent connections,
+    # which then wait a second for the SYN to be retried
+    request_queue_size = 128
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes, which Nagle's algorithm
+    # would hold back for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            count = server.counts[self.path] = server.counts.get(self.path, 0) + 1
+        time.sleep(server.delay)
+        if count <= server.fail_first:
+            return self._reply(503, b'Unavailable\n', {'Retry-After': '0'})
+
+        name = os.path.basename(self.path.split('?')[0])
+        if name in server.redirects:
+            return self._reply(301, b'', {'Location': server.redirects[name]})
+        path = os.path.join(server.directory, name)
+        if not os.path.isfile(path):
+            return self._reply(404, b'Not found\n')
+        with open(path, 'rb') as f:
+            body = f.read()
+        mtime = int(os.path.getmtime(path))
+        headers = {
+            'ETag': f'"{hashlib.sha256(body).hexdigest()[:16]}"',
+            'Last-Modified': formatdate(mtime, usegmt=True),
+            'Content-Type': 'application/json'
+        }
+        if server.max_age is not None:
+            headers['Cache-Control'] = f'max-age={server.max_age}'
+
+        if 'If-None-Match' in self.headers:
+            if headers['ETag'] in [tag.strip() for tag in self.headers['If-None-Match'].split(',')]:
+                return self._reply(304, b'', headers)
+        elif 'If-Modified-Since' in self.headers:
+            try:
+                since = parsedate_to_datetime(self.headers['If-Modified-Since']).timestamp()
+            except (TypeError, ValueError):
+                since = None
+            if since is not None and mtime <= since:
+                return self._reply(304, b'', headers)
+        self._reply(200, body, headers)
+
+    def _reply(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def serve(directory, port=0, delay=0.0, fail_first=0, max_age=None, redirects=None, verbose=False):
+    # Starts a server in a background thread and returns it; its URL is
+    # f'http://127.0.0.1:{server.server_port}/'. `redirects` maps file
+    # names to the URLs they moved to. Stop it with shutdown().
+    server = StubServer(('127.0.0.1', port), StubHandler)
+    server.directory = directory
+    server.delay = delay
+    server.fail_first = fail_first
+    server.max_age = max_age
+    server.redirects = dict(redirects or {})
+    server.verbose = verbose
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.counts = {}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve JSON files like the research host, for testing.')
+    parser.add_argument('directory', help='directory to serve')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to wait before each response')
+    parser.add_argument('--fail-first', type=int, default=0, metavar='N',
+                        help='answer the first N requests for each file with 503')
+    parser.add_argument('--max-age', type=int, default=None, help='send Cache-Control: max-age')
+    parser.add_argument('--redirect', nargs=2, action='append', default=[], metavar=('FILE', 'URL'),
+                        help='answer requests for FILE with a 301 to URL')
+    args = parser.parse_args()
+    server = serve(args.directory, args.port, args.delay, args.fail_first, args.max_age, dict(args.redirect),
+                   verbose=True)
+    print(f'Serving {args.directory} on http://127.0.0.1:{server.server_port}/')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,195 @@
+
+import bisect
+import datetime
+import numbers
+from decimal import ROUND_HALF_UP, Decimal
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The Tax Service of design/tax_compliance.md: tax per line item from the
+# tax_rates table, for whole invoice batches at once.
+#
+# Amounts are DECIMAL(10,2) and rates DECIMAL(5,4), so everything is done
+# in integers: amounts in cents, rates in ten-thousandths. The tax on a line
+# is cents * rate / 10000 rounded half up (away from zero for credits),
+# which is exactly Decimal's quantize(Decimal('0.01'), ROUND_HALF_UP) on
+# amount * rate. With NumPy installed a batch is computed in a few array
+# operations; without it, a plain loop that looks each (region, date)
+# up only once.
+#
+# A rate applies from its effective_from date (created_at for rows without
+# one) until the next rate for the same region.
+
+# Keys of the rate index are region_id * _region_stride + date ordinal
+_region_stride = 1 << 22
+
+# date.toordinal() of 1970-01-01, the zero of numpy.datetime64
+_epoch_ordinal = 719163
+
+
+class RateNotFound(LookupError):
+    pass
+
+
+def to_cents(amount):
+    # '19.99', Decimal('19.99') or 19.99 -> 1999
+    cents = (Decimal(str(amount)) * 100).quantize(Decimal(1), ROUND_HALF_UP)
+    return int(cents)
+
+
+def from_cents(cents):
+    return Decimal(int(cents)).scaleb(-2)
+
+
+def _ordinal(day):
+    # A date, datetime, numpy.datetime64, ISO 8601 string or date ordinal
+    # as a date ordinal, the same on both paths
+    if isinstance(day, numbers.Integral):
+        return int(day)
+    if numpy is not None and isinstance(day, numpy.datetime64):
+        return int(day.astype('datetime64[D]').astype(numpy.int64)) + _epoch_ordinal
+    if isinstance(day, str):
+        day = datetime.date.fromisoformat(day[:10])
+    elif isinstance(day, datetime.datetime):
+        day = day.date()
+    return day.toordinal()
+
+
+def _rate_units(rate):
+    units = Decimal(str(rate)) * 10000
+    if units != units.to_integral_value():
+        raise ValueError(f'Tax rate {rate} has more than 4 decimal places')
+    return int(units)
+
+
+def _encode(values, convert):
+    # convert() applied to each value as an int64 array, calling convert()
+    # once per distinct value only: a batch holds few distinct regions and
+    # dates. An array is reduced with numpy.unique(), with no Python work
+    # per row. A list is mapped through a dictionary instead, as building
+    # an array from Python strings, before even sorting it, already costs
+    # more than one dictionary lookup per row.
+    if isinstance(values, numpy.ndarray):
+        uniques, inverse = numpy.unique(values, return_inverse=True)
+        converted = numpy.fromiter(map(convert, uniques.tolist()), dtype=numpy.int64, count=len(uniques))
+        return converted[inverse.reshape(-1)]
+    memo = {value: convert(value) for value in set(values)}
+    return numpy.fromiter(map(memo.__getitem__, values), dtype=numpy.int64, count=len(values))
+
+
+class TaxEngine:
+
+    def __init__(self, rows):
+        # rows: mappings with region, rate and effective_from or created_at,
+        # as read from the tax_rates table
+        by_region = {}
+        for row in rows:
+            start = row.get('effective_from') or row['created_at']
+            by_region.setdefault(row['region'], []).append((_ordinal(start), _rate_units(row['rate'])))
+
+        self.regions = sorted(by_region)
+        self._region_ids = {region: i for i, region in enumerate(self.regions)}
+        # region -> ([start ordinals], [rates]) for bisecting
+        self._schedules = {}
+        keys = []
+        rates = []
+        for i, region in enumerate(self.regions):
+            schedule = sorted(by_region[region])
+            starts = [start for start, rate in schedule]
+            if len(set(starts)) != len(starts):
+                raise ValueError(f'Two tax rates for {region} take effect on the same day')
+            self._schedules[region] = (starts, [rate for start, rate in schedule])
+            keys += [i * _region_stride + start for start in starts]
+            rates += [rate for start, rate in schedule]
+        if numpy is not None:
+            self._keys = numpy.array(keys, dtype=numpy.int64)
+            self._rates = numpy.array(rates, dtype=numpy.int64)
+
+    @classmethod
+    def from_sqlite(cls, connection, table='tax_rates'):
+        cursor = connection.execute(f'SELECT * FROM {table}')
+        columns = [column[0] for column in cursor.description]
+        return cls(dict(zip(columns, row)) for row in cursor)
+
+    def _rate_units(self, region, day):
+        schedule = self._schedules.get(region)
+        i = bisect.bisect_right(schedule[0], _ordinal(day)) - 1 if schedule else -1
+        if i < 0:
+            raise RateNotFound(f'No tax rate for {region} on {day}')
+        return schedule[1][i]
+
+    def rate(self, region, day):
+        return Decimal(self._rate_units(region, day)).scaleb(-4)
+
+    def calculate(self, cents, regions, days, vectorized=None):
+        # Tax in cents for each line item, given its amount in cents, region
+        # and date. Returns a NumPy int64 array on the vectorized path and a
+        # list otherwise; `vectorized` defaults to whether NumPy is present.
+        if vectorized is None:
+            vectorized = numpy is not None
+        if vectorized:
+            return self._calculate_arrays(cents, regions, days)
+        taxes = []
+        append = taxes.append
+        memo = {}
+        for amount, region, day in zip(cents, regions, days):
+            rate = memo.get((region, day))
+            if rate is None:
+                rate = memo[region, day] = self._rate_units(region, day)
+            if amount >= 0:
+                append((amount * rate + 5000) // 10000)
+            else:
+                append(-((-amount * rate + 5000) // 10000))
+        return taxes
+
+    def _region_id(self, region):
+        try:
+            return self._region_ids[region]
+        except KeyError:
+            raise RateNotFound(f'No tax rate for {region}')
+
+    def _calculate_arrays(self, cents, regions, days):
+        cents = numpy.asarray(cents, dtype=numpy.int64)
+        region_ids = _encode(regions, self._region_id)
+        if isinstance(days, numpy.ndarray) and days.dtype.kind == 'M':
+            days = days.astype('datetime64[D]').astype(numpy.int64) + _epoch_ordinal
+        elif isinstance(days, numpy.ndarray) and days.dtype.kind in 'iu':
+            days = days.astype(numpy.int64)
+        else:
+            days = _encode(days, _ordinal)
+
+        keys = region_ids * _region_stride + days
+        index = numpy.searchsorted(self._keys, keys, side='right') - 1
+        missing = (index < 0) | (self._keys[numpy.maximum(index, 0)] // _region_stride != region_ids)
+        if missing.any():
+            row = int(numpy.argmax(missing))
+            region = self.regions[region_ids[row]]
+            day = datetime.date.fromordinal(int(days[row]))
+            raise RateNotFound(f'No tax rate for {region} on {day}')
+
+        magnitude = (numpy.abs(cents) * self._rates[index] + 5000) // 10000
+        return numpy.where(cents < 0, -magnitude, magnitude)
+
+    def totals(self, regions, taxes):
+        # Tax collected per region, in cents, for the tax reports. A region
+        # without rates could not have been taxed, so it raises RateNotFound.
+        totals = dict.fromkeys(self.regions, 0)
+        if numpy is not None and isinstance(taxes, numpy.ndarray):
+            names, index = numpy.unique(numpy.asarray(regions), return_inverse=True)
+            sums = numpy.zeros(len(names), dtype=numpy.int64)
+            numpy.add.at(sums, index, taxes)
+            for name, total in zip(names.tolist(), sums.tolist()):
+                try:
+                    totals[name] += total
+                except KeyError:
+                    raise RateNotFound(f'No tax rate for {name}')
+            return totals
+        for region, tax in zip(regions, taxes):
+            try:
+                totals[region] += tax
+            except KeyError:
+                raise RateNotFound(f'No tax rate for {region}')
+        return totals
@@ -0,0 +1,169 @@
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import section_engine
+from parse_cache import locked, write_index
+from section_specs import sections
+
+# Checks the search_results inputs of the sections against what their
+# specs read from them (see section_engine.check_section) before anything
+# is rendered, so a file missing a key fails its section at the start of a
+# build rather than partway through writing it. build.py runs this over
+# every section it is about to rebuild, in parallel, and stops those whose
+# inputs do not fit; each section also checks its own inputs before it
+# opens its output.
+#
+# Outcomes are cached by the sha256 of the file and of the checker it was
+# checked with, so an unchanged corpus is checked with one stat() per file.
+cache_dir = os.path.join('.cache', 'checked')
+
+with open(section_engine.__file__, 'rb') as _f:
+    _engine_digest = hashlib.sha256(_f.read()).digest()
+
+# id(node list) -> digest of the checker compiled from it
+_checker_digests = {}
+
+
+def checker_digest(nodes):
+    digest = _checker_digests.get(id(nodes))
+    if digest is None:
+        code = section_engine.checker_code(nodes).encode()
+        digest = _checker_digests[id(nodes)] = hashlib.sha256(_engine_digest + code).hexdigest()
+    return digest
+
+
+class CheckCache:
+    # The index maps each input path to the (mtime, size, sha256) it had
+    # when last seen, and each file and checker digest pair to the problems
+    # found, so a warm lookup does not read the file at all.
+
+    def __init__(self, directory=None):
+        self.directory = directory or cache_dir
+        self.index_file = os.path.join(self.directory, 'index.json')
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self.index = {'paths': {}, 'results': {}}
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'r') as f:
+                try:
+                    self.index = json.load(f)
+                except json.JSONDecodeError:
+                    print(f'Ignoring corrupt check cache index in {self.index_file}')
+
+    def get(self, path, nodes):
+        # -> (key, problems), with problems None if this content has not
+        # been checked against these nodes
+        st = os.stat(path)
+        known = self.index['paths'].get(path)
+        if not (known and known[0] == st.st_mtime_ns and known[1] == st.st_size):
+            h = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+            known = self.index['paths'][path] = [st.st_mtime_ns, st.st_size, h.hexdigest()]
+            self.dirty = True
+        key = f'{known[2]}:{checker_digest(nodes)}'
+        problems = self.index['results'].get(key)
+        if problems is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return key, problems
+
+    def put(self, key, problems):
+        self.index['results'][key] = problems
+        self.dirty = True
+
+    def save(self):
+        # Merges with what other processes saved in the meantime, under the
+        # index lock, keeping only the outcomes for the files as they are now
+        if not self.dirty:
+            return
+        with locked(self.directory):
+            on_disk = CheckCache(self.directory).index
+            for path, entry in on_disk['paths'].items():
+                self.index['paths'].setdefault(path, entry)
+            for key, problems in on_disk['results'].items():
+                self.index['results'].setdefault(key, problems)
+            current = {entry[2] for entry in self.index['paths'].values()}
+            self.index['results'] = {key: problems for key, problems in self.index['results'].items()
+                                     if key.split(':')[0] in current}
+            write_index(self.index_file, self.index)
+        self.dirty = False
+
+
+def _source_files(name):
+    # -> (path, index of the part reading it) for the inputs that exist
+    spec = sections[name]
+    for i, part in enumerate(spec['body']):
+        for filename in part.get('sources', []):
+            filepath = os.path.join(spec['directory'], filename)
+            if os.path.exists(filepath):
+                yield filepath, i
+
+
+def _check_file(name, part, filepath, stream):
+    # The problems in one input of section `name`; runs in the workers
+    try:
+        return section_engine.check_file(sections[name]['body'][part]['do'], filepath, stream)
+    except json.JSONDecodeError:
+        # Left to the render, which reports and skips it
+        return []
+
+
+def validate(names=None, jobs=None, stream=False, checks=None):
+    # Checks the inputs of the named sections (default: all), the ones not
+    # already checked in parallel; -> {section: problems} for the sections
+    # with any
+    checks = checks or CheckCache()
+    problems = {}
+    unchecked = []
+    for name in names or sections:
+        for filepath, part in _source_files(name):
+            key, found = checks.get(filepath, sections[name]['body'][part]['do'])
+            if found is None:
+                unchecked.append((key, name, part, filepath))
+            elif found:
+                problems.setdefault(name, []).extend(found)
+    if len(unchecked) > 1 and jobs != 1:
+        with ProcessPoolExecutor(max_workers=min(jobs or os.cpu_count(), len(unchecked))) as pool:
+            outcomes = list(pool.map(_check_file, *list(zip(*unchecked))[1:], [stream] * len(unchecked)))
+    else:
+        outcomes = [_check_file(name, part, filepath, stream) for _, name, part, filepath in unchecked]
+    for (key, name, _, _), found in zip(unchecked, outcomes):
+        checks.put(key, found)
+        if found:
+            problems.setdefault(name, []).extend(found)
+    checks.save()
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the JSON inputs of the sections against their specs.')
+    parser.add_argument('sections', nargs='*', help='sections to check (default: all)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--stream', action='store_true',
+                        help='stream large JSON inputs instead of loading them whole')
+    args = parser.parse_args()
+    unknown = [name for name in args.sections if name not in sections]
+    if unknown:
+        parser.error(f'unknown sections: {", ".join(unknown)}')
+    start = time.perf_counter()
+    checks = CheckCache()
+    problems = validate(args.sections, jobs=args.jobs, stream=args.stream, checks=checks)
+    for name, found in problems.items():
+        print(f'{sections[name]["output"]}:')
+        for problem in found:
+            print(f'  {problem}')
+    print(f'Checked {checks.hits + checks.misses} inputs ({checks.hits} unchanged) in '
+          f'{(time.perf_counter() - start) * 1000:.0f}ms: '
+          f'{sum(len(found) for found in problems.values())} problems')
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,293 @@
+
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+import build
+from parse_cache import ParseCache
+from validate import CheckCache
+
+# Watches the inputs of every build stage and rebuilds what depends on the
+# ones that change, in this one long-running process: the modules, the
+# compiled section specs and the parse cache stay loaded between builds,
+# so an edit reaches the outputs without paying for a fresh interpreter.
+#
+# Changes are picked up with inotify (called through ctypes, Linux only)
+# on the directories the inputs are in, or else by stat()ing every input
+# a few times a second. A burst of events, such as an editor saving
+# several files or a script rewriting a directory, is collected until it
+# has been quiet for `debounce` seconds and then built as one. Editing the
+# build's own code restarts the process, as already loaded modules would
+# otherwise keep running the old code.
+
+# Seconds without further changes before a burst is built
+debounce = 0.05
+
+# Seconds between scans when polling
+poll_interval = 0.25
+
+# From <sys/inotify.h>
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_DELETE = 0x200
+_IN_Q_OVERFLOW = 0x4000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_event = struct.Struct('iIII')
+
+
+class Inotify:
+    # Reports the files changed among `paths` via inotify watches on their
+    # directories. Raises OSError where inotify is not available.
+
+    def __init__(self, paths):
+        self.paths = set(paths)
+        name = ctypes.util.find_library('c')
+        libc = ctypes.CDLL(name, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self._libc = libc
+        self.fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.directories = {}
+        mask = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_DELETE
+        for directory in sorted({os.path.dirname(path) or '.' for path in self.paths}):
+            if not os.path.isdir(directory):
+                continue
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+            if wd < 0:
+                error = ctypes.get_errno()
+                os.close(self.fd)
+                raise OSError(error, f'Cannot watch {directory}: {os.strerror(error)}')
+            self.directories[wd] = directory
+
+    def changes(self, timeout):
+        # The watched files changed within `timeout` seconds (None waits
+        # until something changes)
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        changed = set()
+        if not readable:
+            return changed
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return changed
+        position = 0
+        while position < len(data):
+            wd, mask, cookie, length = _event.unpack_from(data, position)
+            position += _event.size
+            name = data[position:position + length].rstrip(b'\0')
+            position += length
+            if mask & _IN_Q_OVERFLOW:
+                # Events were dropped; assume everything changed
+                return set(self.paths)
+            path = os.path.normpath(os.path.join(self.directories.get(wd, '.'), os.fsdecode(name)))
+            if path in self.paths:
+                changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller:
+    # Reports the files changed among `paths` by comparing their mtime and
+    # size every `interval` seconds
+
+    def __init__(self, paths, interval=None):
+        self.paths = set(paths)
+        self.interval = interval or poll_interval
+        self.seen = {path: self._stat(path) for path in self.paths}
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def changes(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = set()
+            for path in self.paths:
+                current = self._stat(path)
+                if current != self.seen[path]:
+                    self.seen[path] = current
+                    changed.add(path)
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return changed
+            time.sleep(self.interval if deadline is None else
+                       max(0, min(self.interval, deadline - time.monotonic())))
+
+    def close(self):
+        pass
+
+
+class Watcher:
+
+    def __init__(self, stream=False, use_cache=True, poll=False, interval=None, quiet=None):
+        self.stream = stream
+        self.cache = ParseCache() if use_cache else None
+        self.checks = CheckCache() if use_cache else None
+        self.quiet = debounce if quiet is None else quiet
+        self.stages = build.build_stages()
+        self.dependencies = build.stage_dependencies(self.stages)
+        # Input file -> stages reading it
+        self.readers = {}
+        for name, (output, inputs) in self.stages.items():
+            for path in inputs:
+                self.readers.setdefault(os.path.normpath(path), set()).add(name)
+        self.order = self._build_order()
+        self.code_files = {path for path in self.readers if path.endswith('.py')}
+        self.source = None
+        if not poll:
+            try:
+                self.source = Inotify(self.readers)
+            except OSError as e:
+                print(f'Polling for changes instead of using inotify: {e}')
+        if self.source is None:
+            self.source = Poller(self.readers, interval)
+        self.state = build.load_state()
+
+    def _build_order(self):
+        # Stage names with every stage after the ones it depends on
+        order = []
+        visited = set()
+
+        def visit(name):
+            if name not in visited:
+                visited.add(name)
+                for dependency in sorted(self.dependencies[name]):
+                    visit(dependency)
+                order.append(name)
+
+        for name in sorted(self.stages):
+            visit(name)
+        return order
+
+    def affected(self, changed):
+        # The stages reading any of `changed`, and every stage after them
+        names = set()
+        for path in changed:
+            names |= self.readers.get(path, set())
+        grew = True
+        while grew:
+            grew = False
+            for name, dependencies in self.dependencies.items():
+                if name not in names and dependencies & names:
+                    names.add(name)
+                    grew = True
+        return [name for name in self.order if name in names]
+
+    def rebuild(self, names):
+        # Builds the given stages that are out of date, in order; returns
+        # the rebuilt and failed stages
+        rebuilt = []
+        failed = set()
+        for name in names:
+            output = self.stages[name][0]
+            if self.dependencies[name] & failed:
+                print(f'Skipping {output}: a dependency failed')
+                failed.add(name)
+                continue
+            if build.stage_is_current(name, self.stages[name], self.state):
+                continue
+            start = time.perf_counter()
+            try:
+                build.run_stage(name, self.stream, cache=self.cache, checks=self.checks)
+            except Exception as e:
+                print(f'Error building {output}: {e}')
+                failed.add(name)
+                continue
+            build.record_stage(name, self.stages[name], self.state)
+            rebuilt.append(name)
+            print(f'Built {output} in {(time.perf_counter() - start) * 1000:.0f}ms')
+        build.save_state(self.state)
+        return rebuilt, failed
+
+    def wait(self, stop=None):
+        # Blocks until something changed and the burst is over; returns
+        # the changed files and when the first change was seen, or None
+        # once `stop` is set
+        changed = set()
+        while not changed:
+            if stop is not None and stop.is_set():
+                return None
+            changed = self.source.changes(None if stop is None else 0.5)
+        noticed = time.perf_counter()
+        while True:
+            more = self.source.changes(self.quiet)
+            if not more:
+                return changed, noticed
+            changed |= more
+
+    def run(self, stop=None, on_rebuild=None):
+        # Watches until `stop` (a threading.Event) is set or the build's own
+        # code changes; returns the changed code files in that case.
+        # on_rebuild(rebuilt, failed, seconds since the change) is called
+        # after each build.
+        while True:
+            waited = self.wait(stop)
+            if waited is None:
+                return set()
+            changed, noticed = waited
+            code = changed & self.code_files
+            if code:
+                return code
+            rebuilt, failed = self.rebuild(self.affected(changed))
+            if rebuilt or failed:
+                latency = time.perf_counter() - noticed
+                print(f'Rebuilt {len(rebuilt)} stages {latency * 1000:.0f}ms after the change'
+                      f'{f", {len(failed)} failed" if failed else ""}')
+                if on_rebuild is not None:
+                    on_rebuild(rebuilt, failed, latency)
+
+    def close(self):
+        self.source.close()
+        if self.cache is not None:
+            self.cache.save()
+            self.checks.save()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the documents whenever their inputs change.')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='worker processes for the first, full build (default: number of CPUs)')
+    parser.add_argument('--stream', action='store_true',
+                        help='stream large JSON inputs instead of loading them whole')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='parse every JSON input instead of using the parse cache')
+    parser.add_argument('--poll', action='store_true', help='poll for changes instead of using inotify')
+    parser.add_argument('--interval', type=float, default=poll_interval,
+                        help=f'seconds between scans when polling (default: {poll_interval})')
+    parser.add_argument('--debounce', type=float, default=debounce,
+                        help=f'seconds to wait for a burst of changes to end (default: {debounce})')
+    args = parser.parse_args()
+
+    # Bring everything up to date first, in parallel, as `build.py` would
+    build.build(jobs=args.jobs, stream=args.stream, use_cache=not args.no_cache)
+    watcher = Watcher(stream=args.stream, use_cache=not args.no_cache, poll=args.poll,
+                      interval=args.interval, quiet=args.debounce)
+    print(f'Watching {len(watcher.readers)} files for {len(watcher.stages)} stages '
+          f'({type(watcher.source).__name__.lower()}); Ctrl-C to stop')
+    try:
+        code = watcher.run()
+    except KeyboardInterrupt:
+        code = set()
+    finally:
+        watcher.close()
+    if code:
+        print(f'{", ".join(sorted(code))} changed; restarting')
+        sys.stdout.flush()
+        os.execv(sys.executable, [sys.executable] + sys.argv)